@@ -7,29 +7,68 @@ This module is to check if a PIN code, which entered by a customer, is valid, by
 """
 
 import os
-import json
-import boto3
+import datetime
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
 import logging
+import lambda_cache
 
 AWS_REGION_NAME = os.environ['AWS_REGION_NAME']
-dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION_NAME)
+dynamodb = lambda_cache.get_resource('dynamodb', region_name=AWS_REGION_NAME)
 DYNAMODB_COLLECTION_REQUEST_TABLE_NAME = 'collectionSession'
 DYNAMODB_COLLECTION_REQUEST_SECONDARY_INDEX = 'conversationPIN-index'
+DYNAMODB_COLLECTION_CONTACT_TABLE_NAME = 'collectionContact'
+DYNAMODB_QUEUE_POOL_TABLE_NAME = 'connectQueuePool'
+CONTACT_TIME_FORMAT = '%Y%m%dT%H%M%S%fZ'
 HUMAN2HUMAN_MODE = 'human'
 HUMAN2BOT_MODE = 'bot'
 
 
+@lambda_cache.ttl_cache()
+def get_user_type(user_pin):
+    """
+    :type user_pin: String
+    :return: type of the user, None if the user does not exist, or if the PIN is only reserved
+    """
+    session = dynamodb.Table('userAccount').get_item(Key={"PIN": str(user_pin)}, ProjectionExpression='#type',
+                                                     ExpressionAttributeNames={'#type': 'type'})
+    return session.get('Item', {}).get('type')
+
+
+@lambda_cache.ttl_cache()
+def get_conversation_session(conversation_pin):
+    """
+    Look up the collection request of a conversation PIN, without its contact ids
+    Only the attributes that never change are returned, the status is checked again by the update of the contact ids
+    A collection request saved before the contact table existed keeps its contact ids in a list, which is not
+    appended any more, only its length is returned as legacyCount to seed the collected counter
+    :type conversation_pin: String
+    :return: collection request attributes, None if no collection request with the PIN is running
+    """
+    resp = dynamodb.Table(DYNAMODB_COLLECTION_REQUEST_TABLE_NAME).query(
+        # Add the name of the index you want to use in your query.
+        IndexName=DYNAMODB_COLLECTION_REQUEST_SECONDARY_INDEX,
+        KeyConditionExpression=Key('conversationPIN').eq(conversation_pin),
+        ProjectionExpression='collectionPIN, #mode, routingInfo, collectionBot, collectionGoal, collectionStatus, '
+                             'contactIDs',
+        ExpressionAttributeNames={'#mode': 'mode'},
+    )
+    if resp['Count'] != 1 or resp['Items'][0]['collectionStatus'] != 'START':
+        return None
+    session = resp['Items'][0]
+    del session['collectionStatus']
+    session['legacyCount'] = len(session.pop('contactIDs', []))
+    return session
+
+
 def check_user_pin(user_pin):
     """
     Check if the user-input user PIN is valid
     :type user_pin: String
     :return: if the PIN is valid
     """
-    table = dynamodb.Table('userAccount')
-    session = table.get_item(Key={"PIN": str(user_pin)})
     response = {'response': 'False'}
-    if 'Item' in session and session['Item']['type'] == 'customer':
+    if get_user_type(user_pin) == 'customer':
         response = {'response': 'True'}
     return response
 
@@ -37,50 +76,104 @@ def check_user_pin(user_pin):
 def check_conversation_pin(conversation_pin, event):
     """
     Check if the user-input conversation PIN is valid
+    The collected counter is incremented by one conditional update before the contact is saved into the contact table,
+    so that concurrent callers are all counted and no caller is accepted once the collection goal is met,
+    the counter of a legacy collection request without any counter starts from the length of its contact ids
+    Requires: the secondary index projects all attributes of the collection request
     :type conversation_pin: String
     :return: if the PIN is valid
     """
     table = dynamodb.Table(DYNAMODB_COLLECTION_REQUEST_TABLE_NAME)
-    resp = table.query(
-        # Add the name of the index you want to use in your query.
-        IndexName=DYNAMODB_COLLECTION_REQUEST_SECONDARY_INDEX,
-        KeyConditionExpression=Key('conversationPIN').eq(conversation_pin),
-    )
-
     response = dict()
     response['response'] = 'False'
-    if resp['Count'] == 1 and resp['Items'][0]['collectionStatus'] == 'START':
-        collection_pin = resp['Items'][0]['collectionPIN']
-        session = table.get_item(Key={"collectionPIN": collection_pin})
-        mode = session['Item']['mode']
-        response['response'] = mode
-
-        # Get queue Arn for Human/Human Conversation
-        if mode == HUMAN2HUMAN_MODE:
-            queue_id = session['Item']['routingInfo']['queueID']
-            response['queueID'] = queue_id
-        elif mode == HUMAN2BOT_MODE:
-            bot = session['Item']['collectionBot']
-            response['bot'] = bot
-
-        # Put new contact id into a list that associates with the PIN code
-        contact_id = event['Details']['ContactData']['ContactId']
-        list_contact_ids = session['Item']['contactIDs']
-        list_contact_ids.append(contact_id)
-        # Stop the collection if meeting the collection goal
-        if len(list_contact_ids) >= session['Item']['collectionGoal']:
-            session['Item']['collectionStatus'] = 'STOP'
-            if mode == 'human':
-                # (Human/Human) Important: Release the queue back to queue pool
-                queue_pool_table = dynamodb.Table('connectQueuePool')
-                with queue_pool_table.batch_writer() as batch:
-                    routing_info = session['Item']['routingInfo']
-                    batch.put_item(Item=routing_info)
-        table.put_item(Item=session['Item'], ReturnValues='NONE')
+    session = get_conversation_session(conversation_pin)
+    if session is None:
+        return response
+    collection_pin = session['collectionPIN']
+
+    # Count the new contact, if the collection is still running
+    contact_id = event['Details']['ContactData']['ContactId']
+    try:
+        collected_count = table.update_item(
+            Key={'collectionPIN': collection_pin},
+            UpdateExpression='SET collectedCount = if_not_exists(collectedCount, :legacy_count) + :one',
+            ConditionExpression='collectionStatus = :start AND (collectedCount < collectionGoal OR '
+                                '(attribute_not_exists(collectedCount) AND :legacy_count < collectionGoal))',
+            ExpressionAttributeValues={':start': 'START', ':one': 1, ':legacy_count': session['legacyCount']},
+            ReturnValues='UPDATED_NEW')['Attributes']['collectedCount']
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logging.info('Collection request {} is stopped or has met its goal.'.format(collection_pin))
+        return response
+    save_contact(table, collection_pin, contact_id)
+
+    mode = session['mode']
+    response['response'] = mode
+    # Get queue Arn for Human/Human Conversation
+    if mode == HUMAN2HUMAN_MODE:
+        response['queueID'] = session['routingInfo']['queueID']
+    elif mode == HUMAN2BOT_MODE:
+        response['bot'] = session['collectionBot']
+
+    # Stop the collection if meeting the collection goal
+    if collected_count >= session['collectionGoal']:
+        stop_collection(table, session)
 
     return response
 
 
+def save_contact(table, collection_pin, contact_id):
+    """
+    Save a counted contact into the contact table, the contact is not counted any more if it cannot be saved
+    :param table: collection request table
+    :type collection_pin: String
+    :type contact_id: String
+    """
+    contact_timestamp = '{}_{}'.format(datetime.datetime.utcnow().strftime(CONTACT_TIME_FORMAT), contact_id)
+    try:
+        dynamodb.Table(DYNAMODB_COLLECTION_CONTACT_TABLE_NAME).put_item(
+            Item={'collectionPIN': collection_pin, 'contactTimestamp': contact_timestamp, 'contactId': contact_id})
+    except ClientError:
+        table.update_item(Key={'collectionPIN': collection_pin}, UpdateExpression='ADD collectedCount :minus_one',
+                          ExpressionAttributeValues={':minus_one': -1})
+        raise
+
+
+def stop_collection(table, session):
+    """
+    Stop a collection request that meets its goal, only the caller that stops it releases its queue
+    :param table: collection request table
+    :param session: collection request item
+    """
+    try:
+        table.update_item(Key={'collectionPIN': session['collectionPIN']},
+                          UpdateExpression='SET collectionStatus = :stop',
+                          ConditionExpression='collectionStatus = :start',
+                          ExpressionAttributeValues={':stop': 'STOP', ':start': 'START'})
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return
+    if session['mode'] == HUMAN2HUMAN_MODE:
+        # (Human/Human) Important: Release the queue back to queue pool
+        release_queue(session['routingInfo'])
+
+
+def release_queue(routing_info):
+    """
+    Return a queue to the queue pool, a queue already returned is left as it is, as QueueAllocator.release does
+    :param routing_info: routing information of the queue
+    """
+    try:
+        dynamodb.Table(DYNAMODB_QUEUE_POOL_TABLE_NAME).put_item(Item=routing_info,
+                                                                ConditionExpression='attribute_not_exists(queueNumber)')
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+@lambda_cache.log_start_latency
 def lambda_handler(event, context):
     """
     The caller function of the lambda function
@@ -7,53 +7,141 @@ Consume the CTR Stream from Kinesis Data Stream and save it into S3 in certain f
 
 import json
 import base64
-import boto3
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import lambda_cache
 
-s3 = boto3.resource('s3')
 CALL_RECORDINGS_BUCKET_NAME = os.environ['CALL_RECORDINGS_BUCKET_NAME']
+MAX_CONCURRENT_RECORDS = 16
+# Recordings larger than the threshold are copied by parts on the server side, several parts at once
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=64 * 1024 * 1024, multipart_chunksize=64 * 1024 * 1024,
+                                 max_concurrency=4)
+
+s3_client = lambda_cache.get_client('s3', config=Config(
+    max_pool_connections=MAX_CONCURRENT_RECORDS * TRANSFER_CONFIG.max_concurrency))
+
+
+def get_object_size(bucket, key):
+    """
+    :return: size of an S3 object in bytes, None if the object does not exist
+    """
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ['404', 'NoSuchKey']:
+            raise
+        return None
 
 
 def transfer_call_recordings(json_dict):
+    """
+    Move the call recording of a human/human conversation next to its CTR,
+    a recording already copied by a previous attempt is not copied again.
+    A missing recording is logged and skipped, retrying the record would not bring it back,
+    only the S3 errors are raised for the record to be retried
+
+    :param json_dict: CTR of the conversation
+    """
     contact_id = json_dict['ContactId']
+    if json_dict.get('Recording') is None:
+        logging.warning('Contact {} has no call recording, e.g. recording disabled.'.format(contact_id))
+        return
     file_name = 'call_recordings_{}.wav'.format(contact_id)
     new_file_key = os.path.join(contact_id, file_name)
-    # try-except to avoid the situation when deleting file without successful copying
-    try:
+    old_bucket, old_file_key = json_dict['Recording']['Location'].split('/', 1)
+
+    old_file_size = get_object_size(old_bucket, old_file_key)
+    new_file_size = get_object_size(CALL_RECORDINGS_BUCKET_NAME, new_file_key)
+    if old_file_size is None:
+        if new_file_size is None:
+            logging.warning('Call recording {} of contact {} is not found.'.format(
+                json_dict['Recording']['Location'], contact_id))
+        # Otherwise moved by a previous attempt
+        return
+    if new_file_size != old_file_size:
         # Copy new files from old files
-        s3.Object(CALL_RECORDINGS_BUCKET_NAME, new_file_key).copy_from(CopySource=json_dict['Recording']['Location'])
-        # Delete old files
-        split_results = json_dict['Recording']['Location'].split('/', 1)
-        old_bucket = split_results[0]
-        old_file_key = split_results[1]
-        s3.Object(old_bucket, old_file_key).delete()
-    except Exception as e:
-        logging.error('Error: {}'.format(e))
+        s3_client.copy({'Bucket': old_bucket, 'Key': old_file_key}, CALL_RECORDINGS_BUCKET_NAME, new_file_key,
+                       Config=TRANSFER_CONFIG)
+    # Delete old files, only once copied
+    s3_client.delete_object(Bucket=old_bucket, Key=old_file_key)
+
+
+def decode_record(record):
+    # Decode CTR using base64, which is the Kinesis data encode rule.
+    return json.loads(base64.b64decode(record["kinesis"]["data"]))
 
 
+def process_record(record):
+    json_dict = decode_record(record)
+    # transfer call recordings if it is Human/Human
+    if json_dict['Agent'] is not None:
+        transfer_call_recordings(json_dict)
+
+    contact_id = json_dict['ContactId']
+    file_name = 'ctr_{}.json'.format(contact_id)
+    object_key = os.path.join(contact_id, file_name)
+    # Put CTR into S3 bucket
+    s3_client.put_object(Bucket=CALL_RECORDINGS_BUCKET_NAME, Key=object_key,
+                         Body=json.dumps(json_dict, sort_keys=True))
+
+
+def process_contact_records(records):
+    """
+    Process the records of one contact one after another, in the order of the stream,
+    so that an updated CTR is never overwritten by an older one.
+    The records following a failed one are not processed, they are retried along with it
+
+    :param records: Kinesis records of the same contact
+    :return: sequence numbers of the failed records
+    """
+    failed_sequence_numbers = []
+    for record in sorted(records, key=lambda record: int(record['kinesis']['sequenceNumber'])):
+        sequence_number = record['kinesis']['sequenceNumber']
+        if failed_sequence_numbers:
+            failed_sequence_numbers.append(sequence_number)
+            continue
+        try:
+            process_record(record)
+        except Exception as e:
+            logging.error('Error: record {}: {}'.format(sequence_number, e))
+            failed_sequence_numbers.append(sequence_number)
+    return failed_sequence_numbers
+
+
+@lambda_cache.log_start_latency
 def lambda_handler(event, context):
     """
     The caller function of the lambda function
+    The contacts of a batch are processed concurrently, the records of a contact in order,
+    only the failed records are reported to be retried
+    Requires: ReportBatchItemFailures is enabled on the event source mapping
     :param event: event-specified information, type: dict
     :param context: context information (Not used)
     :return: response dict
     """
     logging.info(event)
-    for record in event['Records']:
-        # Decode CTR using base64, which is the Kinesis data encode rule.
-        json_dict = json.loads(base64.b64decode(record["kinesis"]["data"]))
-        # transfer call recordings if it is Human/Human
-        if json_dict['Agent'] is not None:
-            transfer_call_recordings(json_dict)
-
-        contact_id = json_dict['ContactId']
-        file_name = 'ctr_{}.json'.format(contact_id)
-        object_key = os.path.join(contact_id, file_name)
-        # Put CTR into S3 bucket
-        s3_object = s3.Object(CALL_RECORDINGS_BUCKET_NAME, object_key)
-        s3_object.put(Body=json.dumps(json_dict, indent=4, sort_keys=True))
-
-    response = {'response': 'success'}
+    records = event['Records']
+
+    records_per_contact = {}
+    failed_sequence_numbers = set()
+    for record in records:
+        try:
+            contact_id = decode_record(record)['ContactId']
+        except Exception as e:
+            logging.error('Error: record {}: {}'.format(record['kinesis']['sequenceNumber'], e))
+            failed_sequence_numbers.add(record['kinesis']['sequenceNumber'])
+            continue
+        records_per_contact.setdefault(contact_id, []).append(record)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_RECORDS) as executor:
+        for sequence_numbers in executor.map(process_contact_records, records_per_contact.values()):
+            failed_sequence_numbers.update(sequence_numbers)
+
+    response = {'batchItemFailures': [{'itemIdentifier': record['kinesis']['sequenceNumber']} for record in records
+                                      if record['kinesis']['sequenceNumber'] in failed_sequence_numbers]}
     logging.info(response)
     return response
@@ -0,0 +1,53 @@
+"""
+forward_kvs_parser_queue.py:
+Consume the SQS queue filled by trigger_lambda_function when KVS_PARSER_QUEUE_URL is set, and
+Trigger the lambda function which does Kinesis Video Streaming Parsing with each message body.
+The KVS parser only accepts the parameters of a direct invoke, not an SQS event, so the queue is mapped to this
+function instead of the KVS parser, and the parser receives the very same payload as without the queue.
+
+"""
+
+import os
+import json
+import logging
+import lambda_cache
+
+KVS_PARSER_LAMBDA_FUNCTION = os.environ.get('KVS_PARSER_LAMBDA_FUNCTION', 'KVSTranscribeStreamingLambda')
+
+lambda_client = lambda_cache.get_client('lambda')
+
+
+def forward_record(record):
+    """
+    Invoke the KVS parser with the parameters queued by trigger_lambda_function
+
+    :param record: SQS record, its body is the JSON string of the parameters
+    """
+    output_event = json.loads(record['body'])
+    lambda_client.invoke(FunctionName=KVS_PARSER_LAMBDA_FUNCTION,
+                         InvocationType='Event',
+                         Payload=json.dumps(output_event))
+
+
+@lambda_cache.log_start_latency
+def lambda_handler(event, context):
+    """
+    The caller function of the lambda function
+    Only the messages which could not be forwarded are reported, they are retried after the visibility timeout
+    Requires: ReportBatchItemFailures is enabled on the SQS event source mapping
+    :param event: SQS event, type: dict
+    :param context: context information (Not used)
+    :return: response dict
+    """
+    logging.info(event)
+    failed_message_ids = []
+    for record in event['Records']:
+        try:
+            forward_record(record)
+        except Exception as e:
+            logging.error('Error: message {}: {}'.format(record['messageId'], e))
+            failed_message_ids.append(record['messageId'])
+
+    response = {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
+    logging.info(response)
+    return response
@@ -0,0 +1,101 @@
+"""
+lambda_cache.py:
+This module is not directly run by the framework.
+It is deployed with each lambda function, and keeps what can be reused between the invocations of a warm container:
+1. AWS clients and resources, created once when the lambda function is imported
+2. Short-lived memoization of the lookups whose result does not change, e.g. the mode of a collection request
+3. Logging of the latency of cold and warm starts
+
+"""
+
+import time
+import logging
+import functools
+import threading
+import boto3
+
+DEFAULT_TTL_SECONDS = 60
+
+# Time at which the container imported the lambda function
+INIT_START_TIME = time.monotonic()
+is_cold_start = True
+clients = {}
+resources = {}
+lock = threading.Lock()
+
+
+def get_client(service_name, **kwargs):
+    """
+    :param service_name: AWS service name
+    :param kwargs: arguments of boto3.client
+    :return: boto3 client shared by all invocations of the container
+    """
+    key = (service_name, tuple(sorted(kwargs.items())))
+    with lock:
+        if key not in clients:
+            clients[key] = boto3.client(service_name, **kwargs)
+        return clients[key]
+
+
+def get_resource(service_name, **kwargs):
+    """
+    :param service_name: AWS service name
+    :param kwargs: arguments of boto3.resource
+    :return: boto3 resource shared by all invocations of the container
+    """
+    key = (service_name, tuple(sorted(kwargs.items())))
+    with lock:
+        if key not in resources:
+            resources[key] = boto3.resource(service_name, **kwargs)
+        return resources[key]
+
+
+def ttl_cache(ttl=DEFAULT_TTL_SECONDS, clock=time.monotonic):
+    """
+    Memoize a lookup by its arguments for ttl seconds, a None result is not cached so that new items are found at once
+
+    :param ttl: seconds before a result expires
+    :param clock: function returning the current time in seconds
+    :return: decorator
+    """
+    def decorator(function):
+        cache = {}  # {arguments: (result, time of the result)}
+
+        @functools.wraps(function)
+        def wrapper(*args):
+            now = clock()
+            if args in cache and now - cache[args][1] < ttl:
+                return cache[args][0]
+            result = function(*args)
+            if result is None:
+                cache.pop(args, None)
+            else:
+                cache[args] = (result, now)
+            return result
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+def log_start_latency(handler):
+    """
+    Log the latency of each invocation of a lambda handler, the first invocation of a container is a cold start,
+    whose latency also counts the time since the lambda function was imported
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global is_cold_start
+        start_time = time.monotonic()
+        with lock:
+            cold_start, is_cold_start = is_cold_start, False
+        try:
+            return handler(event, context)
+        finally:
+            end_time = time.monotonic()
+            if cold_start:
+                logging.info('Cold start: {:.1f} ms, including {:.1f} ms of initialization.'.format(
+                    (end_time - INIT_START_TIME) * 1000, (start_time - INIT_START_TIME) * 1000))
+            else:
+                logging.info('Warm start: {:.1f} ms.'.format((end_time - start_time) * 1000))
+    return wrapper
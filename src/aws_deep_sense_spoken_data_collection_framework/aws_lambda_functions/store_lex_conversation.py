@@ -7,78 +7,139 @@ store_lex_conversation.py:
     lex bot states and append the conversation result into a new json file to S3
 """
 
+import io
 import json
-import boto3
+from botocore.config import Config
 import os
 import datetime
 import logging
+import tempfile
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+import lambda_cache
 
-s3_resource = boto3.resource('s3')
-s3_client = boto3.client('s3')
 CALL_RECORDINGS_BUCKET_NAME = os.environ['CALL_RECORDINGS_BUCKET_NAME']
+# Fixed-width UTC time down to the microsecond, so that the keys of the turns sort lexicographically
+BOT_STATE_KEY_TIME_FORMAT = '%Y%m%dT%H%M%S%fZ'
+LIST_OBJECTS_PAGE_SIZE = 1000
+MAX_CONCURRENT_GET_OBJECT = 32
+MAX_DELETE_OBJECTS_KEYS = 1000
+
+s3_resource = lambda_cache.get_resource('s3')
+s3_client = lambda_cache.get_client('s3', config=Config(max_pool_connections=MAX_CONCURRENT_GET_OBJECT))
+
+
+def get_bot_state_keys(key_prefix):
+    """
+    List the keys of the saved lex bot states of a conversation, in the order of the turns
+
+    :param key_prefix: key prefix of the lex bot states of the contact id
+    :return: list of object keys
+    """
+    bot_state_keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=CALL_RECORDINGS_BUCKET_NAME, Prefix='{}_'.format(key_prefix),
+                                   PaginationConfig={'PageSize': LIST_OBJECTS_PAGE_SIZE}):
+        bot_state_keys.extend(s3_object['Key'] for s3_object in page.get('Contents', []))
+
+    def get_turn_order(object_key):
+        # States saved before the timestamped keys are numbered by a sequence number, and come first
+        turn_suffix = object_key[len(key_prefix) + 1:]
+        return (0, int(turn_suffix), '') if turn_suffix.isdigit() else (1, 0, turn_suffix)
+
+    return sorted(bot_state_keys, key=get_turn_order)
+
+
+def get_bot_state(object_key):
+    s3_object = s3_client.get_object(Bucket=CALL_RECORDINGS_BUCKET_NAME, Key=object_key)
+    return json.loads(s3_object['Body'].read())
+
+
+def write_conversation_json(json_file, bot_states, conversation_result, current_time):
+    """
+    Write the combined conversation one turn at a time, formatted as json.dump(indent=4, sort_keys=True) would
+
+    :param json_file: text file to write to
+    :param bot_states: iterable of the lex bot states, in the order of the turns
+    :param conversation_result: result of the conversation
+    :param current_time: finished timestamp of the conversation
+    """
+    json_file.write('{\n    "conversationHistory": [')
+    num_turns = 0
+    for bot_state in bot_states:
+        json_file.write(',\n' if num_turns else '\n')
+        json_file.write(textwrap.indent(json.dumps(bot_state, indent=4, sort_keys=True), ' ' * 8))
+        num_turns += 1
+    json_file.write('\n    ],\n' if num_turns else '],\n')
+    json_file.write('    "conversationResult": {},\n    "finishedTimestamp": {}\n}}'.format(
+        json.dumps(conversation_result), json.dumps(current_time)))
 
 
 def combine_bot_state_to_s3(event, current_time):
+    """
+    Combine the lex bot states of a conversation with its result into one json file,
+    the states are fetched concurrently and deleted once the combined file is uploaded
+
+    :param event: amazon connect event
+    :param current_time: finished timestamp of the conversation
+    """
     contact_id = event['Details']['Parameters']['contactId']
     conversation_result = event['Details']['Parameters']['result']
     key_prefix = os.path.join(contact_id, 'lex_bot_{}'.format(contact_id))
-    response = s3_client.list_objects(
-        Bucket=CALL_RECORDINGS_BUCKET_NAME,
-        Prefix=key_prefix
-    )
-    if 'Contents' in response:
-        num_bot_state = len(response['Contents'])
-    else:
-        num_bot_state = 0
-
-    json_dict = {'conversationResult': conversation_result, 'conversationHistory': [],
-                 'finishedTimestamp': current_time}
-    for sequence_number in range(num_bot_state):
-        object_key = '{}_{}'.format(key_prefix, sequence_number)
-        s3_object = s3_client.get_object(Bucket=CALL_RECORDINGS_BUCKET_NAME, Key=object_key)
-        object_content = s3_object['Body'].read()
-        json_object = json.loads(object_content)
-        json_dict['conversationHistory'].append(json_object)
-        s3_resource.Object(CALL_RECORDINGS_BUCKET_NAME, object_key).delete()
-
-    object_key = '{}.json'.format(key_prefix)
-    s3_object = s3_resource.Object(CALL_RECORDINGS_BUCKET_NAME, object_key)
-    s3_object.put(Body=json.dumps(json_dict, indent=4, sort_keys=True))
+    bot_state_keys = get_bot_state_keys(key_prefix)
 
+    with tempfile.TemporaryFile() as combined_file:
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_GET_OBJECT) as executor:
+            # The states are fetched concurrently but written in the order of the turns
+            json_file = io.TextIOWrapper(combined_file, encoding='utf-8')
+            write_conversation_json(json_file, executor.map(get_bot_state, bot_state_keys), conversation_result,
+                                    current_time)
+            json_file.detach()
+        combined_file.seek(0)
+        s3_client.upload_fileobj(combined_file, CALL_RECORDINGS_BUCKET_NAME, '{}.json'.format(key_prefix))
 
-def save_bot_state_to_s3(event, current_time):
+    for start in range(0, len(bot_state_keys), MAX_DELETE_OBJECTS_KEYS):
+        s3_client.delete_objects(Bucket=CALL_RECORDINGS_BUCKET_NAME, Delete={
+            'Objects': [{'Key': object_key} for object_key in bot_state_keys[start:start + MAX_DELETE_OBJECTS_KEYS]],
+            'Quiet': True})
+
+
+def save_bot_state_to_s3(event, current_time, turn_time, request_id):
+    """
+    Save the lex bot state of one turn, under a key that sorts in the order of the turns,
+    the id of the lambda request keeps the keys of concurrent turns apart
+
+    :param event: lex bot event
+    :param current_time: timestamp saved with the state
+    :param turn_time: datetime of the turn
+    :param request_id: id of the lambda request
+    """
     contact_id = event['sessionAttributes']['contactId']
     json_dict = event  # Shall save every information from Lex
     json_dict['timestamp'] = current_time
     key_prefix = os.path.join(contact_id, 'lex_bot_{}'.format(contact_id))
-    response = s3_client.list_objects(
-        Bucket=CALL_RECORDINGS_BUCKET_NAME,
-        Prefix=key_prefix
-    )
-    if 'Contents' in response:
-        sequence_number = len(response['Contents'])
-    else:
-        sequence_number = 0
 
-    object_key = '{}_{}'.format(key_prefix, sequence_number)
+    object_key = '{}_{}_{}'.format(key_prefix, turn_time.strftime(BOT_STATE_KEY_TIME_FORMAT), request_id)
     s3_object = s3_resource.Object(CALL_RECORDINGS_BUCKET_NAME, object_key)
     s3_object.put(Body=json.dumps(json_dict))
 
 
+@lambda_cache.log_start_latency
 def lambda_handler(event, context):
     """
     The caller function of the lambda function
     :param event: event-specified information, type: dict
-    :param context: context information (Not used)
+    :param context: context information, the request id names the saved lex bot state
     :return: response dict
     """
     logging.info(event)
-    current_time = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    turn_time = datetime.datetime.utcnow()
+    current_time = turn_time.strftime("%Y-%m-%dT%H:%M:%SZ")
     is_conversation_result = 'Details' in event
     if is_conversation_result:
         combine_bot_state_to_s3(event, current_time)
     else:
-        save_bot_state_to_s3(event, current_time)
+        save_bot_state_to_s3(event, current_time, turn_time, context.aws_request_id)
 
     # Generate response back to bot
     response = dict()
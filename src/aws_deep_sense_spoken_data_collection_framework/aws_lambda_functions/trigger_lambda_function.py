@@ -2,17 +2,57 @@
 trigger_lambda_function.py:
 Forward the parameters from Amazon Connect and
 Trigger another lambda function which does Kinesis Video Streaming Parsing.
+The parameters are either sent to the other lambda function by an asynchronous invoke,
+or queued into an SQS queue (KVS_PARSER_QUEUE_URL), which absorbs bursts of calls.
+The KVS parser does not accept SQS events, the queue is consumed by forward_kvs_parser_queue instead,
+which invokes the KVS parser with the queued parameters.
 
 """
 
+import os
 import json
-import boto3
+import time
 import logging
+from botocore.config import Config
+import lambda_cache
 
 HTTP_RESPONSE_SUCCESS_CODE = 200
-KVS_PARSER_LAMBDA_FUNCTION = 'KVSTranscribeStreamingLambda'
+KVS_PARSER_LAMBDA_FUNCTION = os.environ.get('KVS_PARSER_LAMBDA_FUNCTION', 'KVSTranscribeStreamingLambda')
+KVS_PARSER_QUEUE_URL = os.environ.get('KVS_PARSER_QUEUE_URL')
+# Fail fast rather than keep the caller waiting, Amazon Connect waits at most 8 seconds for the whole function
+DISPATCH_CLIENT_CONFIG = Config(connect_timeout=1, read_timeout=2, retries={'max_attempts': 2})
 
+lambda_client = lambda_cache.get_client('lambda', config=DISPATCH_CLIENT_CONFIG)
+sqs_client = lambda_cache.get_client('sqs', config=DISPATCH_CLIENT_CONFIG) if KVS_PARSER_QUEUE_URL else None
 
+
+def invoke_dispatch(output_event):
+    lambda_client.invoke(FunctionName=KVS_PARSER_LAMBDA_FUNCTION,
+                         InvocationType='Event',
+                         Payload=json.dumps(output_event))
+
+
+def queue_dispatch(output_event):
+    sqs_client.send_message(QueueUrl=KVS_PARSER_QUEUE_URL, MessageBody=json.dumps(output_event))
+
+
+def dispatch(output_event):
+    """
+    Hand the parameters over to the KVS parser, through the queue if one is configured, and log the latency
+
+    :param output_event: parameters of the KVS parser
+    :return: name of the dispatch path
+    """
+    dispatch_path, dispatch_function = ('queue', queue_dispatch) if KVS_PARSER_QUEUE_URL else \
+        ('invoke', invoke_dispatch)
+    start_time = time.monotonic()
+    dispatch_function(output_event)
+    logging.info('Dispatch latency ({} {}): {:.1f} ms.'.format(
+        dispatch_path, KVS_PARSER_QUEUE_URL or KVS_PARSER_LAMBDA_FUNCTION, (time.monotonic() - start_time) * 1000))
+    return dispatch_path
+
+
+@lambda_cache.log_start_latency
 def lambda_handler(event, context):
     """
     The caller function of the lambda function
@@ -30,10 +70,7 @@ def lambda_handler(event, context):
     output_event['saveCallRecording'] = 'true'
     output_event['languageCode'] = 'en-US'
 
-    lambda_client = boto3.client('lambda')
-    invoke_response = lambda_client.invoke(FunctionName=KVS_PARSER_LAMBDA_FUNCTION,
-                                           InvocationType='Event',
-                                           Payload=json.dumps(output_event))
+    dispatch(output_event)
     response = {
         'statusCode': HTTP_RESPONSE_SUCCESS_CODE,
         'body': json.dumps('Success')
@@ -0,0 +1,285 @@
+# batch_runner.py: Run framework operations without any prompt, given their parameters from the command line
+#                  or from a JSON/YAML batch file, and write one JSON line per operation
+
+import os
+import sys
+import json
+import time
+import decimal
+import logging
+import aws_deep_sense_spoken_data_collection_framework.utils as utils
+
+# Operations accepted in a batch file, the name of the BatchRunner method is the name with '_' instead of '-'
+OPERATIONS = ('start-collection', 'get-collection', 'list-collections', 'change-collection-status', 'download',
+              'get-transcribe', 'delete-call-recordings', 'create-user', 'create-users', 'list-users', 'delete-user',
+              'delete-all-users')
+OPERATION_KEY = 'operation'
+OPERATION_ID_KEY = 'id'
+
+
+def load_batch_file(batch_file):
+    """
+    Read the operations of a batch file, a list of operations, or a dict with the list under 'operations'
+    Every operation is a dict with its name under 'operation', an optional 'id' copied into its JSON line,
+    and its parameters, e.g. {"operation": "download", "pin": "12345", "output": "recordings"}
+
+    :param batch_file: path of the JSON file, or of the YAML file ending with .yaml or .yml
+    :return: list of operations
+    """
+    with open(batch_file, 'r') as file:
+        if os.path.splitext(batch_file)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('PyYAML is required to read the YAML batch file {}'.format(batch_file))
+            batch = yaml.safe_load(file)
+        else:
+            batch = json.load(file)
+    if isinstance(batch, dict):
+        batch = batch.get('operations')
+    if not isinstance(batch, list) or not all(isinstance(operation, dict) for operation in batch):
+        raise ValueError('Error: The batch file {} is not a list of operations.'.format(batch_file))
+    return batch
+
+
+def to_json(value):
+    """
+    Convert the values returned by AWS Dynamo DB which json does not serialize
+
+    :param value: value not serializable by json
+    :return: serializable value
+    """
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+
+class BatchRunner:
+    """
+    Run operations given all their parameters, the managers and their AWS clients are created once
+    by the first operation which needs them, and reused by the following operations of the batch
+
+    :param config_path: path of the AWS configuration file
+    :param output: file the JSON lines are written to, the standard output by default
+    """
+
+    def __init__(self, config_path, output=None):
+        self.config_path = config_path
+        self.output = sys.stdout if output is None else output
+        self.ACCESS_KEY_ID, self.ACCESS_KEY = utils.get_aws_access_key(config_path)
+        self.AWS_REGION_NAME = utils.get_aws_region_name(config_path)
+        self.CALL_RECORDINGS_BUCKET_NAME = utils.get_call_recordings_bucket_name(config_path)
+        self._collection_request_manager = None
+        self._user_manager = None
+        self._call_recordings_manager = None
+
+    @property
+    def collection_request_manager(self):
+        if self._collection_request_manager is None:
+            from aws_deep_sense_spoken_data_collection_framework.collection_request_manager import \
+                CollectionRequestManager
+            self._collection_request_manager = CollectionRequestManager(
+                self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME, self.CALL_RECORDINGS_BUCKET_NAME)
+        return self._collection_request_manager
+
+    @property
+    def user_manager(self):
+        if self._user_manager is None:
+            from aws_deep_sense_spoken_data_collection_framework.user_manager import UserManager
+            CONNECT_INSTANCE_ID, CONNECT_SECURITY_ID, CONNECT_PHONE_NUMBER, CONNECT_CCP_URL = utils.get_connect_info(
+                self.config_path)
+            self._user_manager = UserManager(self.config_path, self.ACCESS_KEY_ID, self.ACCESS_KEY,
+                                             self.AWS_REGION_NAME, CONNECT_INSTANCE_ID, CONNECT_SECURITY_ID,
+                                             CONNECT_PHONE_NUMBER, CONNECT_CCP_URL)
+        return self._user_manager
+
+    @property
+    def call_recordings_manager(self):
+        if self._call_recordings_manager is None:
+            from aws_deep_sense_spoken_data_collection_framework.call_recordings_manager import \
+                CallRecordingsManager
+            self._call_recordings_manager = CallRecordingsManager(
+                self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME, self.CALL_RECORDINGS_BUCKET_NAME)
+        return self._call_recordings_manager
+
+    def run(self, operations, fail_fast=False):
+        """
+        Run the operations one after another, and write the JSON line of each one as soon as it is done
+
+        :param operations: list of operations, see load_batch_file
+        :param fail_fast: if True, stop at the first failed operation
+        :return: number of failed operations
+        """
+        num_failed = 0
+        for operation in operations:
+            parameters = dict(operation)
+            name = parameters.pop(OPERATION_KEY, None)
+            operation_id = parameters.pop(OPERATION_ID_KEY, None)
+            line = self.run_operation(name, parameters)
+            if operation_id is not None:
+                line[OPERATION_ID_KEY] = operation_id
+            self.output.write(json.dumps(line, default=to_json) + '\n')
+            self.output.flush()
+            if line['status'] != 'ok':
+                num_failed += 1
+                if fail_fast:
+                    break
+        return num_failed
+
+    def run_operation(self, name, parameters):
+        """
+        Run one operation, its failure is reported in its JSON line instead of being raised
+
+        :param name: operation name, one of OPERATIONS
+        :param parameters: keyword arguments of the operation
+        :return: {'operation': xx, 'status': 'ok', 'result': xx, 'seconds': xx}, or 'error' instead of 'result'
+        """
+        line = {OPERATION_KEY: name}
+        start_time = time.monotonic()
+        try:
+            if name not in OPERATIONS:
+                raise ValueError('Error: Invalid operation, please use one of {}.'.format(', '.join(OPERATIONS)))
+            line['result'] = getattr(self, name.replace('-', '_'))(**parameters)
+            line['status'] = 'ok'
+        except Exception as e:
+            logging.error('Operation {} failed, Error Message: {}'.format(name, e))
+            line['status'] = 'error'
+            line['error'] = str(e)
+        line['seconds'] = round(time.monotonic() - start_time, 3)
+        return line
+
+    def start_collection(self, mode, goal, name, bot=None):
+        """
+        :param mode: collection mode (human | bot)
+        :param goal: number of conversations to be collected
+        :param name: collection request name
+        :param bot: lex bot of a collection request in bot mode
+        :return: {'collection_pin': xx, 'conversation_pin': xx}
+        """
+        if mode not in ('human', 'bot'):
+            raise ValueError('Error: Invalid collection mode {}, please use human or bot.'.format(mode))
+        if mode == 'bot' and bot is None:
+            raise ValueError('Error: A collection bot is required in bot mode.')
+        collection_pin, conversation_pin = self.collection_request_manager.generate_collection_request_given_info(
+            mode, bot, int(goal), name)
+        if collection_pin == '':
+            raise RuntimeError('Error: No Amazon Connect queue is available.')
+        return {'collection_pin': collection_pin, 'conversation_pin': conversation_pin}
+
+    def get_collection(self, pin, page_size=None, start_key=None):
+        """
+        :param pin: collection request PIN
+        :param page_size: maximum number of contact ids returned, None for all of them
+        :param start_key: 'next_contact_key' of the previous page of contact ids
+        :return: collection request information
+        """
+        response = self.collection_request_manager.get_collection_request_given_pin(str(pin), page_size, start_key)
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+    def list_collections(self):
+        return self.collection_request_manager.list_collect_requests()
+
+    def change_collection_status(self, pin, status):
+        """
+        :param pin: collection request PIN
+        :param status: START | PAUSE
+        :return: {'collection_pin': xx, 'collection_status': xx}, with the status stored after the change
+        """
+        if status not in ('START', 'PAUSE'):
+            raise ValueError('Error: Invalid collection status {}, please use START or PAUSE.'.format(status))
+        self.collection_request_manager.change_collection_status_given_info(str(pin), status)
+        # A stopped collection request is left as it is, the status is read back
+        table = self.collection_request_manager.dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        session = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: str(pin)},
+                                 ProjectionExpression='collectionStatus')
+        if 'Item' not in session:
+            raise ValueError('Error: Invalid Collection PIN or No session information was found.')
+        return {'collection_pin': str(pin), 'collection_status': session['Item']['collectionStatus']}
+
+    def download(self, pin, output):
+        """
+        :param pin: collection request PIN
+        :param output: output directory, the call recordings are written under its sub directory named by the PIN
+        :return: download statistics, an error is raised if a conversation is not downloaded
+        """
+        statistics = self.call_recordings_manager.download_call_recordings_given_pin(
+            str(pin), os.path.join(os.path.abspath(output), str(pin)))
+        if statistics['failed']:
+            raise RuntimeError('Error: {} conversations are not downloaded: {}'.format(len(statistics['failed']),
+                                                                                      json.dumps(statistics['failed'])))
+        return statistics
+
+    def get_transcribe(self, pin, output, wait=False):
+        """
+        :param pin: collection request PIN
+        :param output: output directory, the transcripts are written under its sub directory named by the PIN
+        :param wait: if True, wait until every transcribe job is completed or failed
+        :return: number of conversations per transcribe job status
+        """
+        return self.call_recordings_manager.get_transcribe_given_pin(
+            str(pin), os.path.join(os.path.abspath(output), str(pin)), wait)
+
+    def delete_call_recordings(self, pin, dry_run=False):
+        """
+        :param pin: collection request PIN
+        :param dry_run: if True, only count the objects that would be deleted
+        :return: deletion statistics
+        """
+        return self.call_recordings_manager.delete_call_recordings_given_pin(str(pin), dry_run)
+
+    def create_user(self, role, name, pin=None):
+        """
+        :param role: customer | agent
+        :param name: user name
+        :param pin: collection request PIN the agent is bound to
+        :return: {'user_pin': xx, 'account': xx}
+        """
+        if role not in ('customer', 'agent'):
+            raise ValueError('Error: Invalid role {}, please use customer or agent.'.format(role))
+        if role == 'agent' and pin is None:
+            raise ValueError('Error: A collection PIN is required for an agent.')
+        user_pin, account = self.user_manager.create_user_given_info(role, name, None if pin is None else str(pin))
+        if 'userId' not in account and role == 'agent':
+            raise RuntimeError('Error: Failed to create the user account on Amazon Connect.')
+        return {'user_pin': user_pin, 'account': account}
+
+    def create_users(self, csv):
+        """
+        :param csv: CSV file of the users, with a header row: name,role,collection_pin
+        :return: {'created': xx, 'failed': xx, 'users': one result per row of the CSV file}
+        """
+        with open(csv, 'r', newline='') as csv_file:
+            users = self.user_manager.read_users_csv(csv_file)
+        report = self.user_manager.create_users_bulk(users)
+        num_created = sum(result['status'] == 'created' for result in report)
+        return {'created': num_created, 'failed': len(report) - num_created, 'users': report}
+
+    def list_users(self):
+        return self.user_manager.list_all_user()
+
+    def delete_user(self, pin):
+        """
+        :param pin: 6-digit user PIN
+        :return: {'user_pin': xx}
+        """
+        error_list = self.user_manager.delete_user_given_pin(str(pin))
+        if error_list:
+            raise RuntimeError(' '.join(error_list))
+        return {'user_pin': str(pin)}
+
+    def delete_all_users(self, yes=False):
+        """
+        :param yes: must be True, to confirm that all users are deleted
+        :return: {'deleted': xx, 'failed': [{'PIN': xx, 'error': xx}, ...]}
+        """
+        if yes is not True:
+            raise ValueError('Error: Please confirm that all users are deleted with yes.')
+        statistics = self.user_manager.delete_users_bulk(self.user_manager.iter_all_user())
+        if statistics['failed']:
+            raise RuntimeError('Error: {} users are not deleted: {}'.format(len(statistics['failed']), json.dumps(
+                statistics['failed'])))
+        return statistics
@@ -1,20 +1,119 @@
 import os
 import json
+import time
 import logging
-import boto3
+import mmap
+import wave
+import threading
+import contextlib
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import urllib.request
-import scipy.io.wavfile as wavfile
+from botocore.exceptions import ClientError
+# numpy and scipy take most of the import time of this module, they are only imported by the methods processing audio
 import aws_deep_sense_spoken_data_collection_framework.utils as utils
+from aws_deep_sense_spoken_data_collection_framework.streaming_zip import StreamingZip, ZipEntry
 import datetime
 
 TRANSCRIBE_JOB_STATUS_NOT_START = 'NOT_STARTED'
 TRANSCRIBE_JOB_STATUS_IN_PROGRESS = 'IN_PROGRESS'
 TRANSCRIBE_JOB_STATUS_COMPLETED = 'COMPLETED'
 TRANSCRIBE_JOB_STATUS_FAILED = 'FAILED'
+# Errors of StartTranscriptionJob: the job exists already, or the request is rejected and fails again if retried
+TRANSCRIBE_JOB_EXISTS_ERROR_CODE = 'ConflictException'
+TRANSCRIBE_JOB_REJECTED_ERROR_CODE = 'BadRequestException'
 TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 AUDIO_MEDIA_SAMPLE_RATE_HERTZ = 8000
 MINIMUM_SILENCE_LENGTH_MS = 2000
 SILENCE_THRESHOLD_DB = -60
+DEFAULT_DOWNLOAD_CONCURRENCY = 16
+DOWNLOAD_MANIFEST_FILE_NAME = 'download_manifest_{}.json'
+STREAMING_CHUNK_SIZE = 1024 * 1024
+SPLIT_AUDIO_BLOCK_NUM_FRAMES = 64 * 1024
+AUDIO_CHUNK_SILENCE_PADDING_MS = 500
+MAX_DELETE_OBJECTS_KEYS = 1000
+# Tag of an S3 object holding its CRC-32 for the streamed archives, along with the ETag it was computed for
+CRC32_OBJECT_TAG_KEY = 'crc32'
+
+
+class DownloadManifest:
+    """
+    A per-collection record of the S3 objects that have been downloaded completely.
+    Each completed key is stored along with its size and ETag, so that an interrupted download can be resumed
+    without downloading the same object twice, and an object changed on S3 since then is downloaded again.
+    The conversations whose downloaded objects are post-processed are recorded as well,
+    so that a conversation interrupted between its download and its post-processing is processed by the next run.
+
+    :param manifest_file: path for the manifest file
+    """
+
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.lock = threading.Lock()
+        self.completed_objects = {}
+        self.processed_contact_ids = set()
+        if os.path.exists(manifest_file):
+            try:
+                with open(manifest_file, 'r') as json_file:
+                    manifest = json.load(json_file)
+                self.completed_objects = manifest['completedObjects']
+                # Missing from the manifests written before, every conversation is processed again once
+                self.processed_contact_ids = set(manifest.get('processedConversations', []))
+            except Exception as e:
+                logging.error('Cannot read download manifest {}, starting over. Error: {}'.format(manifest_file, e))
+
+    def is_completed(self, s3_object, output_file_name):
+        """
+        Check if an S3 object was downloaded completely and the local copy is still there
+
+        :param s3_object: {'Key': xx, 'Size': xx, 'ETag': xx} as listed from S3
+        :param output_file_name: local file path of the object
+        :return: if the object can be skipped
+        """
+        with self.lock:
+            record = self.completed_objects.get(s3_object['Key'])
+        return record is not None and record['size'] == s3_object['Size'] and \
+            record['etag'] == s3_object['ETag'] and os.path.isfile(output_file_name) and \
+            os.path.getsize(output_file_name) == s3_object['Size']
+
+    def mark_completed(self, s3_object):
+        """
+        Record an S3 object as downloaded completely
+
+        :param s3_object: {'Key': xx, 'Size': xx, 'ETag': xx} as listed from S3
+        """
+        with self.lock:
+            self.completed_objects[s3_object['Key']] = {'size': s3_object['Size'], 'etag': s3_object['ETag']}
+
+    def is_processed(self, contact_id):
+        with self.lock:
+            return contact_id in self.processed_contact_ids
+
+    def set_processed(self, contact_id, is_processed):
+        """
+        Record if the downloaded objects of a conversation are post-processed
+
+        :param contact_id: contact id of the conversation
+        :param is_processed: False once an object of the conversation is to be downloaded again
+        """
+        with self.lock:
+            if is_processed:
+                self.processed_contact_ids.add(contact_id)
+            else:
+                self.processed_contact_ids.discard(contact_id)
+
+    def save(self):
+        """
+        Write the manifest to disk, the file is replaced atomically so that an interruption never corrupts it
+        """
+        with self.lock:
+            content = json.dumps({'completedObjects': self.completed_objects,
+                                  'processedConversations': sorted(self.processed_contact_ids)},
+                                 indent=4, sort_keys=True)
+        temporary_file = '{}.tmp'.format(self.manifest_file)
+        with open(temporary_file, 'w+') as json_file:
+            json_file.write(content)
+        os.replace(temporary_file, self.manifest_file)
 
 
 class CallRecordingsManager:
@@ -33,13 +132,22 @@ class CallRecordingsManager:
         self.AWS_REGION_NAME = AWS_REGION_NAME
         self.CALL_RECORDINGS_BUCKET_NAME = CALL_RECORDINGS_BUCKET_NAME
 
-        self.dynamodb = boto3.resource('dynamodb', region_name=self.AWS_REGION_NAME,
-                                       aws_access_key_id=self.ACCESS_KEY_ID,
-                                       aws_secret_access_key=self.ACCESS_KEY)
-        self.s3_resource = boto3.resource('s3', aws_access_key_id=self.ACCESS_KEY_ID,
-                                          aws_secret_access_key=self.ACCESS_KEY)
-        self.s3_client = boto3.client('s3', aws_access_key_id=self.ACCESS_KEY_ID,
-                                      aws_secret_access_key=self.ACCESS_KEY)
+    @property
+    def dynamodb(self):
+        return utils.get_boto3_resource('dynamodb', self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME)
+
+    @property
+    def s3_resource(self):
+        return utils.get_boto3_resource('s3', self.ACCESS_KEY_ID, self.ACCESS_KEY, None)
+
+    @property
+    def s3_client(self):
+        # S3 client is thread-safe, it is shared by the download workers
+        return utils.get_boto3_client('s3', self.ACCESS_KEY_ID, self.ACCESS_KEY, None)
+
+    @property
+    def transcribe_client(self):
+        return utils.get_boto3_client('transcribe', self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME)
 
     def download_call_recordings(self):
         """
@@ -56,11 +164,18 @@ class CallRecordingsManager:
             self.get_transcribe_given_pin(collection_pin, output_file_path)
         return
 
-    def download_call_recordings_given_pin(self, collection_pin, output_file_path):
+    def download_call_recordings_given_pin(self, collection_pin, output_file_path,
+                                           max_concurrency=DEFAULT_DOWNLOAD_CONCURRENCY):
         """
         Download call recordings in AWS S3 given a valid collection PIN code, and a valid output file path
+        Objects of all conversations are downloaded by a bounded pool of workers, and the completed ones are recorded
+        in a download manifest under the output file path, so an interrupted download resumes where it stopped.
+
         :param collection_pin: 5-digit collection PIN code
         :param output_file_path: Output file path for call recordings
+        :param max_concurrency: maximum number of objects downloaded at the same time
+        :return: download statistics {'conversations': xx, 'objects': xx, 'bytes': xx, 'seconds': xx,
+                 'failed': [contact ids of the conversations not downloaded, ...]}
         """
         self.ensure_directory_exists(output_file_path)
 
@@ -68,8 +183,6 @@ class CallRecordingsManager:
         session = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: collection_pin})
         mode = session['Item']['mode']
 
-        # Retrieve all call recording files under the user S3 bucket
-        call_recordings_bucket = self.s3_resource.Bucket(self.CALL_RECORDINGS_BUCKET_NAME)
         list_ids = utils.get_contact_ids(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME, collection_pin)
 
         # Download bot definition if human/bot
@@ -77,48 +190,230 @@ class CallRecordingsManager:
             bot_name = session['Item']['collectionBot']
             self.download_bot_definition(bot_name, output_file_path)
 
-        # Download call recordings per contact id
-        counter = 0  # Count the number of conversations downloaded
-        for contact_id in list_ids:
-            try:
+        manifest = DownloadManifest(os.path.join(output_file_path, DOWNLOAD_MANIFEST_FILE_NAME.format(collection_pin)))
+        statistics = {'conversations': 0, 'objects': 0, 'bytes': 0, 'seconds': 0}
+        failed_contact_ids = set()
+        audio_files_to_split = []
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            # Retrieve all call recording files under the contact id prefixes
+            objects_per_contact_id = {}
+            listing_futures = {executor.submit(self.list_objects_given_contact_id, contact_id): contact_id
+                               for contact_id in list_ids}
+            for future in as_completed(listing_futures):
+                contact_id = listing_futures[future]
+                try:
+                    objects_per_contact_id[contact_id] = future.result()
+                except Exception as e:
+                    failed_contact_ids.add(contact_id)
+                    logging.error('Download Failure with Contact ID {}, Error Message: {}'.format(contact_id, e))
+
+            # Download every object not completed before
+            download_futures = {}
+            pending_downloads = {}
+            for contact_id, s3_objects in objects_per_contact_id.items():
                 output_file_path_with_contact_id = os.path.join(output_file_path, contact_id)
                 self.ensure_directory_exists(output_file_path_with_contact_id)  # Ensure the file path exists
-                if len(os.listdir(output_file_path_with_contact_id)) == 0:  # Not downloaded before
-                    key_prefix = contact_id + '/'
-                    objects_with_contact_id = call_recordings_bucket.objects.filter(Prefix=key_prefix)
-                    for objects_with_contact_id in objects_with_contact_id:
-                        object_key = objects_with_contact_id.key
-                        s3_file_name = object_key.split('/', 1)[-1]
-                        output_file_name = os.path.join(output_file_path_with_contact_id, s3_file_name)
-                        call_recordings_bucket.download_file(object_key, output_file_name)
-                    if mode == 'human':
-                        call_recordings_output_file_name = os.path.join(output_file_path_with_contact_id,
-                                                                        'call_recordings_{}.wav'.format(contact_id))
-                        if os.path.exists(call_recordings_output_file_name) and os.path.isfile(
-                                call_recordings_output_file_name):
-                            self.split_audio_by_channel(call_recordings_output_file_name)
-                    if mode == 'bot':
-                        self.split_audio_by_lex_bot_state(output_file_path_with_contact_id, contact_id)
-                    counter += 1
-                self.generate_conversation_report(mode, contact_id, output_file_path_with_contact_id)
-            except Exception as e:
-                logging.error('Download Failure with Contact ID {}, Error Message: {}'.format(contact_id, e))
-        logging.info('Download Success, {} Conversations are Downloaded Under "{}" Directory.'.format(counter,
-                                                                                                      output_file_path))
+                pending_downloads[contact_id] = 0
+                for s3_object in s3_objects:
+                    output_file_name = os.path.join(output_file_path_with_contact_id,
+                                                    s3_object['Key'].split('/', 1)[-1])
+                    if not manifest.is_completed(s3_object, output_file_name):
+                        future = executor.submit(self.s3_client.download_file, self.CALL_RECORDINGS_BUCKET_NAME,
+                                                 s3_object['Key'], output_file_name)
+                        download_futures[future] = (contact_id, s3_object)
+                        pending_downloads[contact_id] += 1
+                if pending_downloads[contact_id] > 0:
+                    manifest.set_processed(contact_id, False)
+
+            # Process a conversation as soon as all of its objects are downloaded,
+            # the ones downloaded before are only processed again if their processing did not complete
+            processed_contact_ids = set()
+            for contact_id, num_pending_download in pending_downloads.items():
+                if num_pending_download == 0 and self.process_downloaded_conversation(
+                        mode, contact_id, os.path.join(output_file_path, contact_id),
+                        not manifest.is_processed(contact_id), audio_files_to_split):
+                    processed_contact_ids.add(contact_id)
+            for future in as_completed(download_futures):
+                contact_id, s3_object = download_futures[future]
+                try:
+                    future.result()
+                    manifest.mark_completed(s3_object)
+                    statistics['objects'] += 1
+                    statistics['bytes'] += s3_object['Size']
+                except Exception as e:
+                    failed_contact_ids.add(contact_id)
+                    logging.error('Download Failure with Contact ID {}, Error Message: {}'.format(contact_id, e))
+                pending_downloads[contact_id] -= 1
+                if pending_downloads[contact_id] == 0:
+                    manifest.save()
+                    if contact_id not in failed_contact_ids:
+                        if self.process_downloaded_conversation(mode, contact_id,
+                                                                os.path.join(output_file_path, contact_id), True,
+                                                                audio_files_to_split):
+                            processed_contact_ids.add(contact_id)
+                        statistics['conversations'] += 1
+        split_audio_files = []
+        self.split_audio_files_by_channel(audio_files_to_split, split_audio_files=split_audio_files)
+        # A human/human conversation is processed once its call recording is split
+        for audio_file in set(audio_files_to_split) - set(split_audio_files):
+            processed_contact_ids.discard(os.path.basename(os.path.dirname(audio_file)))
+        for contact_id in processed_contact_ids:
+            manifest.set_processed(contact_id, True)
+        manifest.save()
+
+        statistics['seconds'] = time.time() - start_time
+        statistics['failed'] = sorted(failed_contact_ids)
+        elapsed_seconds = max(statistics['seconds'], 1e-6)
+        logging.info('Download Success, {} Conversations are Downloaded Under "{}" Directory.'.format(
+            statistics['conversations'], output_file_path))
+        if failed_contact_ids:
+            logging.error('Download Failure, {} Conversations are not Downloaded, please download again: {}'.format(
+                len(failed_contact_ids), ', '.join(statistics['failed'])))
+        logging.info('Download Throughput: {} objects, {:.2f} MB in {:.2f} seconds ({:.2f} objects/s, {:.2f} MB/s).'.format(
+            statistics['objects'], statistics['bytes'] / 1e6, statistics['seconds'],
+            statistics['objects'] / elapsed_seconds, statistics['bytes'] / 1e6 / elapsed_seconds))
 
         if len(list_ids) != 0:
             self.generate_collection_request_report(collection_pin, output_file_path)
             self.get_transcribe_given_pin(collection_pin, output_file_path)
-        return
+        return statistics
+
+    def list_objects_given_contact_id(self, contact_id):
+        """
+        List all S3 objects stored under the prefix of a contact id
+
+        :param contact_id: contact id associated with the single call recording
+        :return: [{'Key': xx, 'Size': xx, 'ETag': xx, 'LastModified': xx}, ...]
+        """
+        s3_objects = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.CALL_RECORDINGS_BUCKET_NAME, Prefix=contact_id + '/'):
+            for s3_object in page.get('Contents', []):
+                s3_objects.append({'Key': s3_object['Key'], 'Size': s3_object['Size'], 'ETag': s3_object['ETag'],
+                                   'LastModified': s3_object['LastModified']})
+        return s3_objects
+
+    def get_call_recordings_archive(self, collection_pin, max_concurrency=DEFAULT_DOWNLOAD_CONCURRENCY):
+        """
+        Describe the call recordings in AWS S3 given a valid collection PIN code as a ZIP archive streamed from S3
+        Nothing is downloaded until the archive is iterated, and the objects are read in chunks
+
+        :param collection_pin: 5-digit collection PIN code
+        :param max_concurrency: maximum number of contact ids listed at the same time
+        :return: StreamingZip of the call recordings
+        """
+        list_ids = utils.get_contact_ids(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME, collection_pin)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            objects_per_contact_id = dict(zip(list_ids, executor.map(self.list_objects_given_contact_id, list_ids)))
+
+        zip_dir = 'call_recordings_{}'.format(collection_pin)
+        entries = []
+        for contact_id in sorted(objects_per_contact_id):
+            for s3_object in sorted(objects_per_contact_id[contact_id], key=lambda s3_object: s3_object['Key']):
+                arcname = '/'.join([zip_dir, collection_pin, contact_id, s3_object['Key'].split('/', 1)[-1]])
+                entries.append(ZipEntry(arcname, s3_object['Size'], s3_object['LastModified'].timetuple()[:6],
+                                        self.get_object_reader(s3_object['Key']),
+                                        (self.CALL_RECORDINGS_BUCKET_NAME, s3_object['Key'], s3_object['ETag']),
+                                        functools.partial(self.get_object_crc, s3_object['Key'], s3_object['ETag']),
+                                        functools.partial(self.save_object_crc, s3_object['Key'], s3_object['ETag'])))
+        return StreamingZip(entries)
+
+    def get_object_crc(self, key, etag):
+        """
+        Read the CRC-32 of an S3 object saved in its tags, so that a range request of an archive in any process
+        does not read the objects before the range
+
+        :param key: S3 object key in the call recordings bucket
+        :param etag: ETag of the object content the CRC-32 is for
+        :return: CRC-32 of the object, None if it is not saved or saved for another content
+        """
+        try:
+            tag_set = self.s3_client.get_object_tagging(Bucket=self.CALL_RECORDINGS_BUCKET_NAME, Key=key)['TagSet']
+        except ClientError as e:
+            logging.warning('Cannot read the CRC-32 of {}. Error: {}'.format(key, e))
+            return None
+        for tag in tag_set:
+            if tag['Key'] == CRC32_OBJECT_TAG_KEY:
+                crc, _, tag_etag = tag['Value'].partition(':')
+                if tag_etag == etag.strip('"'):
+                    return int(crc)
+        return None
+
+    def save_object_crc(self, key, etag, crc):
+        """
+        Save the CRC-32 of an S3 object in its tags, next to the other tags of the object
+        Tagging an object changes neither its content, ETag nor last modified time, so the archive stays the same
+
+        :param key: S3 object key in the call recordings bucket
+        :param etag: ETag of the object content the CRC-32 is computed from
+        :param crc: CRC-32 of the object
+        """
+        try:
+            tag_set = self.s3_client.get_object_tagging(Bucket=self.CALL_RECORDINGS_BUCKET_NAME, Key=key)['TagSet']
+            tag_set = [tag for tag in tag_set if tag['Key'] != CRC32_OBJECT_TAG_KEY]
+            tag_set.append({'Key': CRC32_OBJECT_TAG_KEY, 'Value': '{}:{}'.format(crc, etag.strip('"'))})
+            self.s3_client.put_object_tagging(Bucket=self.CALL_RECORDINGS_BUCKET_NAME, Key=key,
+                                              Tagging={'TagSet': tag_set})
+        except ClientError as e:
+            # Only the range requests are slower without it
+            logging.warning('Cannot save the CRC-32 of {}. Error: {}'.format(key, e))
+
+    def get_object_reader(self, key):
+        """
+        :param key: S3 object key in the call recordings bucket
+        :return: reader(offset) returning an iterable of byte chunks of the object from the offset
+        """
+        def reader(offset):
+            get_object_kwargs = {'Bucket': self.CALL_RECORDINGS_BUCKET_NAME, 'Key': key}
+            if offset > 0:
+                get_object_kwargs['Range'] = 'bytes={}-'.format(offset)
+            body = self.s3_client.get_object(**get_object_kwargs)['Body']
+            try:
+                for chunk in body.iter_chunks(STREAMING_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                body.close()
+        return reader
+
+    def process_downloaded_conversation(self, mode, contact_id, output_file_path_with_contact_id, is_new_download,
+                                        audio_files_to_split=None):
+        """
+        Preprocess the call recordings of one conversation after downloading and generate its report
+
+        :param mode: Conversation Mode, can be Human/Human or Human/Bot
+        :param contact_id: contact id associated with the single call recording
+        :param output_file_path_with_contact_id: the output file path for the conversation
+        :param is_new_download: if any file of the conversation is downloaded in this run
+        :param audio_files_to_split: if given, human/human recordings are appended to it to be split later in batch
+        :return: if the conversation is processed without any error
+        """
+        try:
+            if is_new_download:
+                if mode == 'human':
+                    call_recordings_output_file_name = os.path.join(output_file_path_with_contact_id,
+                                                                    'call_recordings_{}.wav'.format(contact_id))
+                    if os.path.exists(call_recordings_output_file_name) and os.path.isfile(
+                            call_recordings_output_file_name):
+                        if audio_files_to_split is None:
+                            self.split_audio_by_channel(call_recordings_output_file_name)
+                        else:
+                            audio_files_to_split.append(call_recordings_output_file_name)
+                if mode == 'bot':
+                    self.split_audio_by_lex_bot_state(output_file_path_with_contact_id, contact_id)
+            self.generate_conversation_report(mode, contact_id, output_file_path_with_contact_id)
+            return True
+        except Exception as e:
+            logging.error('Download Failure with Contact ID {}, Error Message: {}'.format(contact_id, e))
+            return False
 
     def download_bot_definition(self, bot_name, output_file_path):
         bot_definition_zip_path = os.path.join(output_file_path, 'bot_definition_{}.zip'.format(bot_name))
 
         if not os.path.exists(bot_definition_zip_path):
             try:
-                lex_model = boto3.client('lex-models', region_name=self.AWS_REGION_NAME,
-                                         aws_access_key_id=self.ACCESS_KEY_ID,
-                                         aws_secret_access_key=self.ACCESS_KEY)
+                lex_model = utils.get_boto3_client('lex-models', self.ACCESS_KEY_ID, self.ACCESS_KEY,
+                                                   self.AWS_REGION_NAME)
                 response = lex_model.get_export(
                     name=bot_name,
                     version='1',
@@ -138,54 +433,30 @@ class CallRecordingsManager:
         output_file_path = self.ask_output_directory(collection_pin)
         self.get_transcribe_given_pin(collection_pin, output_file_path)
 
-    def get_transcribe_given_pin(self, collection_pin, output_file_path):
+    def get_transcribe_given_pin(self, collection_pin, output_file_path, wait=False):
         """
         Get text transcribe of previous call recordings from AWS Transcribe given collection PIN and output file path
+        Jobs are started for the conversations not transcribed yet, and the transcripts of the completed ones
+        are downloaded, the job statuses are kept under the output file path so that a repeated run is incremental
 
         :param collection_pin: collection session PIN
         :param output_file_path: the output file path for transcribe file downloaded
+        :param wait: if True, wait until every transcribe job is completed or failed
+        :return: number of conversations per transcribe job status
         """
-        transcribe = boto3.client('transcribe', aws_access_key_id=self.ACCESS_KEY_ID,
-                                  aws_secret_access_key=self.ACCESS_KEY)
-        list_ids = utils.get_contact_ids(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME, collection_pin)
-        mode = utils.check_collection_request_mode(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME,
-                                                   collection_pin)
-        for contact_id in list_ids:
-            job_status = self.check_transcribe_given_contact_id(transcribe, contact_id)
-
-            if job_status == TRANSCRIBE_JOB_STATUS_IN_PROGRESS:
-                logging.info('Transcribe job with contact id {} is in progress.'.format(contact_id))
-            elif job_status == TRANSCRIBE_JOB_STATUS_FAILED:
-                logging.info('Transcribe job with contact id {} is failed.'.format(contact_id))
-            elif job_status == TRANSCRIBE_JOB_STATUS_COMPLETED:
-                response = transcribe.get_transcription_job(TranscriptionJobName=contact_id)
-                transcript_file_url = response['TranscriptionJob']['Transcript']['TranscriptFileUri']
-                #  Download the transcribe file
-                output_file_path_with_contact_id = os.path.join(output_file_path, contact_id)
-                self.ensure_directory_exists(output_file_path_with_contact_id)
-                output_transcribe_file_name = os.path.join(output_file_path_with_contact_id,
-                                                           'transcribe_{}.json'.format(contact_id))
-                if not os.path.exists(output_transcribe_file_name):
-                    transcribe_json = urllib.request.urlopen(transcript_file_url).read()
-                    transcribe_dict = json.loads(transcribe_json)
-                    with open(output_transcribe_file_name, 'w+') as transcript_file:
-                        transcript_file.write(str(json.dumps(transcribe_dict, indent=4, sort_keys=True)))
-                    logging.info('Transcribe job with contact id {} is downloaded.'.format(contact_id))
-            elif job_status == TRANSCRIBE_JOB_STATUS_NOT_START:
-                # Start Transcribe job on AWS Transcribe with the one not in S3
-                if self.start_transcribe_job(transcribe, mode, contact_id):
-                    logging.info('Transcribe job with contact id {} is in progress.'.format(contact_id))
-                else:
-                    logging.error(
-                        'Transcribe job with contact id {} is failed. Cannot find S3 audio file.'.format(contact_id))
+        # Import module here to avoid circular import
+        from aws_deep_sense_spoken_data_collection_framework.transcription_orchestrator import \
+            TranscriptionOrchestrator
+        return TranscriptionOrchestrator(self, collection_pin, output_file_path).run(wait=wait)
 
     def start_transcribe_job(self, transcribe_object, mode, contact_id):
         """
-        Start the transcribe job
+        Start the transcribe job, a job started before is left as it is
+        The other errors, e.g. throttling, are raised, for the job to be started again later
         :param transcribe_object: AWS Transcribe Object
         :param mode: Collection Request Mode
         :param contact_id: Contact ID to start Transcribe
-        :return: If the job is successfully started
+        :return: If the job is started or exists already, False if the request is rejected
         """
         file_prefix = 'call_recordings' if mode == 'human' else 'customer'
         s3_audio_file_key = '{}/{}_{}.wav'.format(contact_id, file_prefix, contact_id)
@@ -205,34 +476,91 @@ class CallRecordingsManager:
                 }
             )
             return True
-        except:
-            return False
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code == TRANSCRIBE_JOB_EXISTS_ERROR_CODE:
+                return True
+            if error_code == TRANSCRIBE_JOB_REJECTED_ERROR_CODE:
+                logging.error('Transcribe job with contact id {} is rejected. Error: {}'.format(contact_id, e))
+                return False
+            raise
+
+    def delete_call_recordings(self):
+        """
+        Delete call recordings in AWS S3 given a valid collection PIN code, after a dry run and a confirmation
+
+        """
+        collection_pin = utils.ask_collection_pin(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME)
+        statistics = self.delete_call_recordings_given_pin(collection_pin, dry_run=True)
+        decision = input('Delete {} objects ({:.2f} MB) of collection request {}? Y/N | '.format(
+            statistics['objects'], statistics['bytes'] / 1e6, collection_pin))
+        if decision == 'Y' or decision == 'y':
+            self.delete_call_recordings_given_pin(collection_pin)
+        return
 
-    def delete_call_recordings_given_pin(self, collection_pin):
+    def delete_call_recordings_given_pin(self, collection_pin, dry_run=False,
+                                         max_concurrency=DEFAULT_DOWNLOAD_CONCURRENCY):
         """
         Delete call recordings in AWS S3 given a valid collection PIN code
+        Only the objects under the prefixes of the contact ids of the collection request are listed, and they are
+        deleted by batches of up to 1000 keys, the contact ids being processed concurrently
 
         :param collection_pin: collection request PIN code associated with the call recordings
+        :param dry_run: if True, only count the objects that would be deleted
+        :param max_concurrency: maximum number of contact ids processed at the same time
+        :return: deletion statistics {'objects': xx, 'bytes': xx, 'errors': xx}
         """
-        bucket = self.s3_resource.Bucket(self.CALL_RECORDINGS_BUCKET_NAME)
         list_ids = utils.get_contact_ids(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME, collection_pin)
-        for s3_file in bucket.objects.all():
-            key = s3_file.key
-            contact_id = self.parse_contact_id_from_key(key)  # Parse the contact ID from file key
-            # Only Download audio files associated with the PIN code
-            if contact_id in list_ids:
-                if s3_file.size != 0:
-                    response = bucket.delete_objects(
-                        Delete={
-                            'Objects': [
-                                {
-                                    'Key': key
-                                },
-                            ],
-                            'Quiet': True
-                        }
-                    )
-        return
+        statistics = {'objects': 0, 'bytes': 0, 'errors': 0}
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {executor.submit(self.delete_call_recordings_given_contact_id, contact_id, dry_run): contact_id
+                       for contact_id in list_ids}
+            for future in as_completed(futures):
+                try:
+                    contact_statistics = future.result()
+                except Exception as e:
+                    logging.error('Deletion Failure with Contact ID {}, Error Message: {}'.format(futures[future], e))
+                    statistics['errors'] += 1
+                    continue
+                for key in statistics:
+                    statistics[key] += contact_statistics[key]
+
+        logging.info('{} {} Objects ({:.2f} MB) of Collection Request {}, {} Errors.'.format(
+            'Would Delete' if dry_run else 'Deleted', statistics['objects'], statistics['bytes'] / 1e6,
+            collection_pin, statistics['errors']))
+        return statistics
+
+    def delete_call_recordings_given_contact_id(self, contact_id, dry_run=False):
+        """
+        Delete all S3 objects stored under the prefix of a contact id, by batches of up to 1000 keys
+
+        :param contact_id: contact id associated with the single call recording
+        :param dry_run: if True, only count the objects that would be deleted
+        :return: deletion statistics {'objects': xx, 'bytes': xx, 'errors': xx}
+        """
+        statistics = {'objects': 0, 'bytes': 0, 'errors': 0}
+        s3_objects = self.list_objects_given_contact_id(contact_id)
+        if dry_run:
+            statistics['objects'] = len(s3_objects)
+            statistics['bytes'] = sum(s3_object['Size'] for s3_object in s3_objects)
+            return statistics
+
+        for start in range(0, len(s3_objects), MAX_DELETE_OBJECTS_KEYS):
+            batch = s3_objects[start:start + MAX_DELETE_OBJECTS_KEYS]
+            response = self.s3_client.delete_objects(Bucket=self.CALL_RECORDINGS_BUCKET_NAME, Delete={
+                'Objects': [{'Key': s3_object['Key']} for s3_object in batch],
+                'Quiet': True
+            })
+            failed_keys = set()
+            for error in response.get('Errors', []):
+                logging.error('Cannot delete {}, Error Message: {}'.format(error['Key'], error.get('Message')))
+                failed_keys.add(error['Key'])
+            for s3_object in batch:
+                if s3_object['Key'] not in failed_keys:
+                    statistics['objects'] += 1
+                    statistics['bytes'] += s3_object['Size']
+            statistics['errors'] += len(failed_keys)
+        return statistics
 
     @staticmethod
     def ask_output_directory(pin):
@@ -275,22 +603,77 @@ class CallRecordingsManager:
         return contact_id
 
     @staticmethod
-    def split_audio_by_channel(audio_file):
+    def split_audio_by_channel(audio_file, block_num_frames=SPLIT_AUDIO_BLOCK_NUM_FRAMES):
         """
         Separate the customer-agent dialog audio file into 2 files by channel
         one for customer-only audio, one for agent-only audio
         1. parse the file name
-        2. read the file
-        3. save first column which corresponds to channel 1
-        4. save second column which corresponds to channel 2
+        2. memory-map the file
+        3. save first column which corresponds to channel 1, block by block
+        4. save second column which corresponds to channel 2, block by block
 
         :param audio_file: path for the audio file
+        :param block_num_frames: number of frames written at a time, only one block per channel is held in memory
         """
+        import scipy.io.wavfile as wavfile
+
+        audio_file_name = os.path.splitext(audio_file)[0]
+        fs, data = wavfile.read(audio_file, mmap=True)
+        output_files = ['{}_customer.wav'.format(audio_file_name), '{}_agent.wav'.format(audio_file_name)]
+        if data.dtype.kind not in 'iu':
+            # Only PCM integer samples can be written by blocks, e.g. floating point samples are written at once
+            for channel, output_file in enumerate(output_files):
+                wavfile.write(output_file, fs, data[:, channel])
+            return
 
-        audio_file_name = audio_file.split('.')[0]
-        fs, data = wavfile.read(audio_file)
-        wavfile.write('{}_customer.wav'.format(audio_file_name), fs, data[:, 0])
-        wavfile.write('{}_agent.wav'.format(audio_file_name), fs, data[:, 1])
+        # Pages of the input already split are dropped from memory, the mapping starts with part of the header
+        mapped_file = data.base
+        while mapped_file is not None and not isinstance(mapped_file, mmap.mmap):
+            mapped_file = getattr(mapped_file, 'base', None)
+        if not hasattr(mmap, 'MADV_DONTNEED'):
+            mapped_file = None
+        header_size = len(mapped_file) - data.nbytes if mapped_file is not None else 0
+        with contextlib.ExitStack() as stack:
+            wave_files = [stack.enter_context(wave.open(output_file, 'wb')) for output_file in output_files]
+            for wave_file in wave_files:
+                wave_file.setnchannels(1)
+                wave_file.setsampwidth(data.dtype.itemsize)
+                wave_file.setframerate(fs)
+            for start in range(0, data.shape[0], block_num_frames):
+                block = data[start:start + block_num_frames]
+                for channel, wave_file in enumerate(wave_files):
+                    wave_file.writeframesraw(block[:, channel].tobytes())
+                if mapped_file is not None:
+                    split_size = header_size + (start + block.shape[0]) * data.strides[0]
+                    mapped_file.madvise(mmap.MADV_DONTNEED, 0, split_size - split_size % mmap.PAGESIZE)
+
+    @staticmethod
+    def split_audio_files_by_channel(audio_files, max_workers=None, split_audio_files=None):
+        """
+        Separate many customer-agent dialog audio files by channel across a pool of processes
+
+        :param audio_files: paths for the audio files
+        :param max_workers: number of processes, the number of CPUs by default
+        :param split_audio_files: if given, the paths for the audio files split successfully are appended to it
+        :return: number of audio files split successfully
+        """
+        if len(audio_files) <= 1:
+            executor = ThreadPoolExecutor(max_workers=1)  # Not worth starting a process for a single file
+        else:
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+        audio_files_split = 0
+        with executor:
+            futures = {executor.submit(CallRecordingsManager.split_audio_by_channel, audio_file): audio_file
+                       for audio_file in audio_files}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    audio_files_split += 1
+                    if split_audio_files is not None:
+                        split_audio_files.append(futures[future])
+                except Exception as e:
+                    logging.error('Cannot split {} by channel. Error: {}'.format(futures[future], e))
+        return audio_files_split
 
     def split_audio_by_lex_bot_state(self, output_file_path_with_contact_id, contact_id):
         """
@@ -299,10 +682,7 @@ class CallRecordingsManager:
         :type output_file_path_with_contact_id: str
         :type contact_id: str
         """
-        # Import package here to avoid overhead when creating class object
-        from pydub.silence import detect_nonsilent
-        from pydub import AudioSegment
-
+        import scipy.io.wavfile as wavfile
         ctr_file_name = os.path.join(output_file_path_with_contact_id, 'ctr_{}.json'.format(contact_id))
         with open(ctr_file_name, 'r') as ctr_file:
             ctr_json = json.load(ctr_file)
@@ -321,15 +701,15 @@ class CallRecordingsManager:
             relative_time = datetime.datetime.strptime(time_response, TIMESTAMP_FORMAT) - datetime.datetime.strptime(
                 start_timestamp,
                 TIMESTAMP_FORMAT)
-            lex_response_timestamps.append(relative_time.seconds * 1000)  # pydub time in ms
+            lex_response_timestamps.append(relative_time.seconds * 1000)  # time in ms
 
         logging.info(lex_response_timestamps)
 
         wav_file_path = os.path.join(output_file_path_with_contact_id, 'customer_{}.wav'.format(contact_id))
-        wav_file = AudioSegment.from_wav(wav_file_path)
+        fs, data = wavfile.read(wav_file_path, mmap=True)
 
-        chunks = detect_nonsilent(wav_file, min_silence_len=MINIMUM_SILENCE_LENGTH_MS,
-                                  silence_thresh=SILENCE_THRESHOLD_DB)
+        chunks = self.detect_nonsilent(data, fs, min_silence_len=MINIMUM_SILENCE_LENGTH_MS,
+                                       silence_thresh=SILENCE_THRESHOLD_DB)
         chunks.append([lex_response_timestamps[-1] + 1])
         if len(chunks) != len(lex_response_timestamps):
             valid_chunks = []
@@ -351,15 +731,134 @@ class CallRecordingsManager:
         logging.info('Valid chunks: {}'.format(valid_chunks))
         chunk_output_file_path = os.path.join(output_file_path_with_contact_id, 'audio_chunks')
         self.ensure_directory_exists(chunk_output_file_path)
-        silence_chunk = AudioSegment.silent(duration=500)
         for i, chunk in enumerate(valid_chunks):
-            audio_chunk = wav_file[chunk[0]:chunk[1]]
-            audio_chunk = silence_chunk + audio_chunk + silence_chunk
             chunk_file_path = os.path.join(chunk_output_file_path,
                                            'chunk{}_customer_{}.wav'.format(i, contact_id))
-            audio_chunk.export(chunk_file_path, format='wav')
+            self.write_audio_chunk(chunk_file_path, fs, data[self.get_frame_index(chunk[0], fs, len(data)):
+                                                             self.get_frame_index(chunk[1], fs, len(data))])
         return
 
+    @staticmethod
+    def get_frame_index(ms, fs, num_frames):
+        """
+        :param ms: time in milliseconds
+        :param fs: sample rate of the audio
+        :param num_frames: number of frames of the audio
+        :return: index of the frame at the given time, within the audio
+        """
+        return min(int(ms * (fs / 1000.0)), num_frames)
+
+    @staticmethod
+    def detect_nonsilent(data, fs, min_silence_len=MINIMUM_SILENCE_LENGTH_MS, silence_thresh=SILENCE_THRESHOLD_DB):
+        """
+        Find the non-silent parts of an audio, with the same results as pydub.silence.detect_nonsilent (seek step 1ms)
+        The RMS of every min_silence_len window, sliding 1ms at a time, is computed at once from a cumulative sum
+        of the squared samples, and the consecutive silent windows are merged into silent ranges
+
+        :param data: samples of the audio as read by scipy.io.wavfile, 1 column per channel if more than 1 channel
+        :param fs: sample rate of the audio
+        :param min_silence_len: minimum length of a silent part in ms
+        :param silence_thresh: upper bound in dBFS of the RMS of a silent part
+        :return: list of non-silent parts [start, end] in ms
+        """
+        import numpy as np
+        sample_width = data.dtype.itemsize
+        num_frames = data.shape[0]
+        num_channels = 1 if data.ndim == 1 else data.shape[1]
+        seg_len = round(1000 * (float(num_frames) / fs))
+        if seg_len < min_silence_len:
+            return [[0, seg_len]]
+
+        # Sum of the squared samples before every millisecond, exact with integers up to 16-bit samples
+        ms_frames = (np.arange(seg_len + 1) * (fs / 1000.0)).astype(np.int64)
+        cumulative_squares = CallRecordingsManager.get_cumulative_squares(data, np.minimum(ms_frames, num_frames))
+
+        # RMS of every window of min_silence_len ms, sliding 1 ms at a time
+        # A window past the last frame is padded with silence, which counts in the mean
+        num_samples = (ms_frames[min_silence_len:] - ms_frames[:seg_len - min_silence_len + 1]) * num_channels
+        sum_squares = cumulative_squares[min_silence_len:] - cumulative_squares[:seg_len - min_silence_len + 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rms = np.floor(np.sqrt(sum_squares.astype(np.float64) / num_samples))
+        rms[num_samples == 0] = 0
+        threshold = 10 ** (float(silence_thresh) / 20) * (2 ** (sample_width * 8) / 2)
+        silence_starts = np.flatnonzero(rms <= threshold)
+        if len(silence_starts) == 0:
+            return [[0, seg_len]]
+
+        # Silent windows closer than min_silence_len to each other overlap and belong to the same silent range
+        breaks = np.flatnonzero(np.diff(silence_starts) > max(min_silence_len, 1))
+        range_starts = silence_starts[np.concatenate([[0], breaks + 1])]
+        range_ends = silence_starts[np.concatenate([breaks, [len(silence_starts) - 1]])] + min_silence_len
+        silent_ranges = [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+        if silent_ranges[0][0] == 0 and silent_ranges[0][1] == seg_len:
+            return []
+        nonsilent_ranges = []
+        previous_end = 0
+        for start, end in silent_ranges:
+            nonsilent_ranges.append([previous_end, start])
+            previous_end = end
+        if silent_ranges[-1][1] != seg_len:
+            nonsilent_ranges.append([previous_end, seg_len])
+        if nonsilent_ranges[0] == [0, 0]:
+            nonsilent_ranges.pop(0)
+        return nonsilent_ranges
+
+    @staticmethod
+    def get_cumulative_squares(data, frame_indices, block_num_frames=SPLIT_AUDIO_BLOCK_NUM_FRAMES):
+        """
+        Sum the squared samples of an audio before some frames, the audio is read block by block
+
+        :param data: samples of the audio, 1 column per channel if more than 1 channel
+        :param frame_indices: non-decreasing frame indices, at most the number of frames
+        :param block_num_frames: number of frames read at a time
+        :return: sum of the squared samples of all channels before every frame index
+        """
+        import numpy as np
+        accumulator_dtype = np.int64 if data.dtype.itemsize <= 2 else np.float64
+        cumulative_squares = np.zeros(len(frame_indices), dtype=accumulator_dtype)
+        total = accumulator_dtype(0)
+        for start in range(0, data.shape[0], block_num_frames):
+            block = data[start:start + block_num_frames]
+            if block.dtype == np.uint8:  # 8-bit WAV samples are unsigned
+                block = block.astype(np.int16) - 128
+            block_squares = np.square(block, dtype=accumulator_dtype)
+            if block_squares.ndim > 1:
+                block_squares = block_squares.sum(axis=1)
+            block_cumulative_squares = np.cumsum(block_squares) + total
+            first, last = np.searchsorted(frame_indices, [start, start + len(block)], side='right')
+            cumulative_squares[first:last] = block_cumulative_squares[frame_indices[first:last] - start - 1]
+            total = block_cumulative_squares[-1]
+        return cumulative_squares
+
+    @staticmethod
+    def write_audio_chunk(chunk_file_path, fs, chunk_data, padding_ms=AUDIO_CHUNK_SILENCE_PADDING_MS):
+        """
+        Write a chunk of audio surrounded by silence, the samples are written from the given slice without copy
+
+        :param chunk_file_path: path for the audio chunk
+        :param fs: sample rate of the audio
+        :param chunk_data: samples of the chunk
+        :param padding_ms: length of the silence before and after the chunk in ms
+        """
+        import numpy as np
+        import scipy.io.wavfile as wavfile
+        num_channels = 1 if chunk_data.ndim == 1 else chunk_data.shape[1]
+        padding = np.zeros((int(fs * (padding_ms / 1000.0)),) + chunk_data.shape[1:], dtype=chunk_data.dtype)
+        if chunk_data.dtype == np.uint8:
+            padding += 128
+        if chunk_data.dtype.kind not in 'iu':
+            # Only PCM integer samples can be written by the wave module
+            wavfile.write(chunk_file_path, fs, np.concatenate([padding, chunk_data, padding]))
+            return
+        with wave.open(chunk_file_path, 'wb') as wave_file:
+            wave_file.setnchannels(num_channels)
+            wave_file.setsampwidth(chunk_data.dtype.itemsize)
+            wave_file.setframerate(fs)
+            wave_file.writeframesraw(padding.tobytes())
+            wave_file.writeframesraw(np.ascontiguousarray(chunk_data))
+            wave_file.writeframesraw(padding.tobytes())
+
     def generate_collection_request_report(self, collection_pin, output_file_path):
         """
         Generate a report for one collection request
@@ -374,7 +873,8 @@ class CallRecordingsManager:
         if 'Item' in session:
             item = session['Item']
             collection_pin = item['collectionPIN']
-            contact_ids = item['contactIDs']
+            contact_ids = utils.get_contact_ids(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME,
+                                                collection_pin)
             conversation_pin = item[utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY]
             mode = item['mode']
             collection_goal = item['collectionGoal']
@@ -396,7 +896,8 @@ class CallRecordingsManager:
                     collection_type,
                     collection_status)
                 report_file.write(content)
-                content = '{}/{} conversation(s) are collected so far:\n'.format(len(contact_ids), collection_goal)
+                content = '{}/{} conversation(s) are collected so far:\n'.format(
+                    item.get('collectedCount', len(contact_ids)), collection_goal)
                 for index, contact_id in enumerate(contact_ids, start=1):
                     content += '\t{}: {}\n'.format(index, contact_id)
                 report_file.write(content)
@@ -1,8 +1,17 @@
 import logging
 import random
-import boto3
+import datetime
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
 import aws_deep_sense_spoken_data_collection_framework.utils as utils
 from aws_deep_sense_spoken_data_collection_framework.call_recordings_manager import CallRecordingsManager
+from aws_deep_sense_spoken_data_collection_framework.pin_allocator import PinAllocator, RESERVATION_ATTRIBUTE
+from aws_deep_sense_spoken_data_collection_framework.queue_allocator import QueueAllocator
+
+# Attributes of a collection request shown when listing them
+COLLECTION_REQUEST_LIST_ATTRIBUTES = [utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY, 'conversationPIN', 'mode',
+                                      'collectionGoal', 'collectionStatus', 'collectionName', 'collectionBot',
+                                      'collectedCount']
 
 
 class CollectionRequestManager:
@@ -25,9 +34,19 @@ class CollectionRequestManager:
                                                             CALL_RECORDINGS_BUCKET_NAME)
         self.num_digit_collection_pin = 5
         self.num_digit_conversation_pin = 5
-        self.dynamodb = boto3.resource('dynamodb', region_name=self.AWS_REGION_NAME,
-                                       aws_access_key_id=self.ACCESS_KEY_ID,
-                                       aws_secret_access_key=self.ACCESS_KEY)
+        self.collection_pin_allocator = PinAllocator(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME,
+                                                     utils.COLLECTION_REQUEST_DYNAMODB_TABLE,
+                                                     utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY,
+                                                     self.num_digit_collection_pin)
+        self.conversation_pin_allocator = PinAllocator(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME,
+                                                       utils.COLLECTION_REQUEST_DYNAMODB_TABLE,
+                                                       utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY,
+                                                       self.num_digit_conversation_pin)
+        self.queue_allocator = QueueAllocator(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME)
+
+    @property
+    def dynamodb(self):
+        return utils.get_boto3_resource('dynamodb', self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME)
 
     def generate_collect_request(self):
         """
@@ -67,59 +86,58 @@ class CollectionRequestManager:
         if mode == 'human':
             routing_info = {'routingInfo': self.get_routing_info()}
             if 'error' in routing_info['routingInfo']:
+                self.collection_pin_allocator.release(collection_pin)
                 return '', ''
-            self.save2db(collection_pin, conversation_pin, mode, routing_info, collection_goal, collection_status,
-                         collection_name)
+            try:
+                self.save2db(collection_pin, conversation_pin, mode, routing_info, collection_goal,
+                             collection_status, collection_name)
+            except Exception:
+                self.queue_allocator.release(routing_info['routingInfo'])
+                self.collection_pin_allocator.release(collection_pin)
+                raise
             self.collection_request_printer(collection_pin, conversation_pin, mode,
                                             None, collection_goal, collection_status,
                                             collection_name, [])
         elif mode == 'bot':
             bot_info = {'collectionBot': collection_bot}
-            self.save2db(collection_pin, conversation_pin, mode, bot_info, collection_goal, collection_status,
-                         collection_name)
+            try:
+                self.save2db(collection_pin, conversation_pin, mode, bot_info, collection_goal, collection_status,
+                             collection_name)
+            except Exception:
+                self.collection_pin_allocator.release(collection_pin)
+                raise
             self.collection_request_printer(collection_pin, conversation_pin, mode, bot_info['collectionBot'],
                                             collection_goal, collection_status, collection_name, [])
         return collection_pin, conversation_pin
 
     def get_routing_info(self):
         """
-        Retrieve an available queue from the queue pool
+        Check out an available queue from the queue pool
         :return: routing information, including queue id, and routing profile id
         """
-        table = self.dynamodb.Table('connectQueuePool')
-        available_queue = table.scan(ProjectionExpression='queueNumber')
-        num_available_queue = len(available_queue)
-        if num_available_queue == 0:
+        queue_item = self.queue_allocator.checkout()
+        if queue_item is None:
             logging.error('Error: No available queue found.')
             return {'error': 'No available queue found.'}
-        queue_number = random.choice(available_queue['Items'])['queueNumber']
-        queue_item = table.get_item(Key={'queueNumber': queue_number})['Item']
-        table.delete_item(
-            Key={
-                'queueNumber': queue_number
-            }
-        )
         return queue_item
 
-    def get_num_available_queue(self):
+    def get_num_available_queue(self, refresh=False):
         """
-        Get number of available queues for human/human collection
+        Get number of available queues for human/human collection, cached for a short time
+
+        :param refresh: count the available queues again, even if the cached number is not expired
         :return: number of available queues
         """
-        table = self.dynamodb.Table('connectQueuePool')
-        available_queue = table.scan(ProjectionExpression='queueNumber')['Items']
-        return len(available_queue)
+        return self.queue_allocator.num_free_queue(refresh)
 
     def generate_collection_pin(self):
         """
         Generate a unique collection PIN code as collection request PIN
+        The PIN code is reserved in AWS Dynamo DB until the collection request is saved
 
         :return: generated 5-digit PIN collection request PIN code
         """
-        PIN = utils.random_with_n_digits(self.num_digit_collection_pin)
-        while utils.is_collection_pin_exists(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME, PIN):
-            PIN = utils.random_with_n_digits(self.num_digit_collection_pin)
-        return PIN
+        return self.collection_pin_allocator.reserve()
 
     def generate_conversation_pin(self):
         """
@@ -127,9 +145,12 @@ class CollectionRequestManager:
 
         :return: generated 5-digit PIN conversation PIN code
         """
-        PIN = utils.random_with_n_digits(self.num_digit_conversation_pin)
+        # Conversation PIN is not the table key and cannot be reserved, verify the drawn one on the secondary index
+        PIN = self.conversation_pin_allocator.draw()
         while utils.is_conversation_pin_exists(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME, PIN):
-            PIN = utils.random_with_n_digits(self.num_digit_conversation_pin)
+            self.conversation_pin_allocator.mark_used(PIN)
+            PIN = self.conversation_pin_allocator.draw()
+        self.conversation_pin_allocator.mark_used(PIN)
         return PIN
 
     @staticmethod
@@ -210,7 +231,7 @@ class CollectionRequestManager:
         with table.batch_writer() as batch:
             collection_item = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: collection_pin,
                                utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: conversation_pin, 'mode': mode,
-                               'contactIDs': [], 'collectionGoal': collection_goal,
+                               'collectedCount': 0, 'collectionGoal': collection_goal,
                                'collectionStatus': collection_status, 'collectionName': collection_name}
             collection_item.update(collection_info)
             batch.put_item(Item=collection_item)
@@ -232,12 +253,20 @@ class CollectionRequestManager:
             logging.error(response['error'])
         return
 
-    def get_collection_request_given_pin(self, collection_pin):
+    def get_collection_request_given_pin(self, collection_pin, page_size=None, start_key=None):
+        """
+        Get the information of a collection request, with one page of its contact ids
+
+        :param collection_pin: collection request PIN
+        :param page_size: maximum number of contact ids returned, None for all of them
+        :param start_key: key to start the page of contact ids from, None for the first page
+        :return: collection request information, with the key of the next page of contact ids ('next_contact_key')
+        """
         table = self.dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
         session = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: str(collection_pin)})
 
-        # Get parameters from session item
-        if 'Item' in session:
+        # Get parameters from session item, a collection PIN only reserved has none
+        if 'Item' in session and utils.PIN_RESERVATION_ATTRIBUTE not in session['Item']:
             conversation_pin = session['Item']['conversationPIN']
             mode = session['Item']['mode']
             collection_info = ''
@@ -245,30 +274,55 @@ class CollectionRequestManager:
                 collection_info = None
             elif mode == 'bot':
                 collection_info = session['Item']['collectionBot']
-            contact_ids = session['Item']['contactIDs']
+            # Contact ids of a collection request not migrated yet come first
+            contact_ids = session['Item'].get('contactIDs', []) if start_key is None else []
+            if page_size is None:
+                contact_ids.extend(utils.iter_contact_ids(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME,
+                                                          collection_pin))
+                next_contact_key = None
+            else:
+                page_contact_ids, next_contact_key = utils.query_contact_ids(
+                    self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME, collection_pin, page_size, start_key)
+                contact_ids.extend(page_contact_ids)
             collection_goal = session['Item']['collectionGoal']
             collection_status = session['Item']['collectionStatus']
             collection_name = session['Item']['collectionName']
 
             response = {'collection_pin': collection_pin, 'conversation_pin': conversation_pin, 'mode': mode,
                         'collection_info': collection_info, 'contact_ids': contact_ids,
+                        'next_contact_key': next_contact_key,
+                        'collected_count': self.get_collected_count(session['Item']),
                         'collection_goal': collection_goal, 'collection_status': collection_status,
                         'collection_name': collection_name}
         else:
             response = {'error': 'Error: Invalid Collection PIN or No session information was found.'}
         return response
 
-    def list_collect_requests(self):
+    def iter_collect_requests(self, total_segments=1):
+        """
+        Stream all collection requests page by page, with the listed attributes only
+
+        :param total_segments: number of segments of the table scanned in parallel
+        :return: generator of the collection requests
+        """
+        table = self.dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        return utils.scan_table(table, COLLECTION_REQUEST_LIST_ATTRIBUTES,
+                                filter_expression=Attr(RESERVATION_ATTRIBUTE).not_exists(),
+                                total_segments=total_segments)
+
+    def list_collect_requests(self, total_segments=1):
         """
         List all ongoing collection requests
 
+        :param total_segments: number of segments of the table scanned in parallel
         """
         # Get all requests from the table
-        table = self.dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
-        collection_request_list = table.scan()['Items']
-        for item in collection_request_list:
+        collection_request_list = []
+        for item in self.iter_collect_requests(total_segments):
+            item['collectedCount'] = self.get_collected_count(item)
+            collection_request_list.append(item)
             collection_pin = item[utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY]
-            contact_ids = item['contactIDs']
+            collected_count = item['collectedCount']
             conversation_pin = item['conversationPIN']
             mode = item['mode']
             collection_goal = item['collectionGoal']
@@ -279,16 +333,74 @@ class CollectionRequestManager:
                 collection_bot = item['collectionBot']
                 logging.info(
                     'Collection Name: {}, Collection PIN: {}, conversation PIN: {}, mode: {}, collection bot: {}, collection progress: {}/{}, collection status: {}.'.format(
-                        collection_name, collection_pin, conversation_pin, mode, collection_bot, len(contact_ids),
+                        collection_name, collection_pin, conversation_pin, mode, collection_bot, collected_count,
                         collection_goal, collection_status))
             else:
                 logging.info(
                     'Collection Name: {}, Collection PIN: {}, conversation PIN: {}, mode: {}, collection progress: {}/{}, collection status: {}.'.format(
-                        collection_name, collection_pin, conversation_pin, mode, len(contact_ids),
+                        collection_name, collection_pin, conversation_pin, mode, collected_count,
                         collection_goal, collection_status))
         logging.info('All sessions are listed.')
         return collection_request_list
 
+    def get_collected_count(self, item):
+        """
+        Get the number of conversations collected by a collection request, from its counter
+        The contact ids are only read for a collection request saved before the counter existed
+
+        :param item: collection request item
+        :return: number of collected conversations
+        """
+        if 'collectedCount' in item:
+            return int(item['collectedCount'])
+        return len(utils.get_legacy_contact_ids(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME,
+                                                item[utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY]))
+
+    def migrate_contact_ids(self):
+        """
+        Move the contact ids kept in the collection request items into the contact table,
+        and set the counter of collected conversations of each collection request to its number of contacts
+        The contact ids are removed from an item only if none is appended meanwhile, otherwise it is read again.
+        A contact moved before has the same key, so the migration can be run again.
+        The moved contacts have no time, they are sorted before any new contact, in the order of the list
+
+        :return: number of collection requests migrated
+        """
+        table = self.dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        contact_table = self.dynamodb.Table(utils.COLLECTION_CONTACT_DYNAMODB_TABLE)
+        legacy_contact_time = datetime.datetime(1970, 1, 1)
+        num_migrated = 0
+        for item in utils.scan_table(table, [utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY, 'contactIDs'],
+                                     filter_expression=Attr('contactIDs').exists()):
+            collection_pin = item[utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY]
+            key = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: collection_pin}
+            while 'contactIDs' in item:
+                with contact_table.batch_writer(overwrite_by_pkeys=[
+                        utils.COLLECTION_CONTACT_DYNAMODB_TABLE_KEY,
+                        utils.COLLECTION_CONTACT_DYNAMODB_TABLE_SORT_KEY]) as batch:
+                    for index, contact_id in enumerate(item['contactIDs']):
+                        contact_time = legacy_contact_time + datetime.timedelta(microseconds=index)
+                        batch.put_item(Item={
+                            utils.COLLECTION_CONTACT_DYNAMODB_TABLE_KEY: collection_pin,
+                            utils.COLLECTION_CONTACT_DYNAMODB_TABLE_SORT_KEY: utils.get_contact_sort_key(
+                                contact_time, contact_id),
+                            utils.COLLECTION_CONTACT_ID_ATTRIBUTE: contact_id})
+                collected_count = sum(1 for _ in utils.iter_contact_ids(self.ACCESS_KEY_ID, self.ACCESS_KEY,
+                                                                         self.AWS_REGION_NAME, collection_pin))
+                try:
+                    table.update_item(Key=key, UpdateExpression='SET collectedCount = :count REMOVE contactIDs',
+                                      ConditionExpression='size(contactIDs) = :size',
+                                      ExpressionAttributeValues={':count': collected_count,
+                                                                 ':size': len(item['contactIDs'])})
+                    num_migrated += 1
+                    break
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        raise
+                    item = table.get_item(Key=key, ProjectionExpression='contactIDs', ConsistentRead=True)['Item']
+        logging.info('Contact ids of {} collection request(s) are migrated.'.format(num_migrated))
+        return num_migrated
+
     def change_collection_status(self):
         """
         Change current collection status to desired collection status
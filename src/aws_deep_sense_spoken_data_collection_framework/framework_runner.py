@@ -12,18 +12,15 @@ logging.getLogger().setLevel(logging.INFO)
 
 # Add module directory into system path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-import aws_deep_sense_spoken_data_collection_framework.utils as utils
-from aws_deep_sense_spoken_data_collection_framework.call_recordings_manager import CallRecordingsManager
-from aws_deep_sense_spoken_data_collection_framework.collection_request_manager import CollectionRequestManager
-from aws_deep_sense_spoken_data_collection_framework.user_manager import UserManager
+# The framework modules, and the AWS SDK they import, are only imported by the operation which needs them,
+# so that the command line starts fast
 
 # Change to your desired configuration file
 config_path = os.path.join(os.path.dirname(__file__), '..', '..', 'configurations', 'aws_config')
 
-ACCESS_KEY_ID, ACCESS_KEY = utils.get_aws_access_key(config_path)
-AWS_REGION_NAME = utils.get_aws_region_name(config_path)
-CALL_RECORDINGS_BUCKET_NAME = utils.get_call_recordings_bucket_name(config_path)
-CONNECT_INSTANCE_ID, CONNECT_SECURITY_ID, CONNECT_PHONE_NUMBER, CONNECT_CCP_URL = utils.get_connect_info(config_path)
+LEGACY_OPERATION_FLAGS = ('startCollection', 'getCollection', 'changeCollectionStatus', 'listCollection',
+                          'migrateContactIds', 'createUser', 'listAllUser', 'openConnectPortal', 'deleteUser',
+                          'deleteAllUser', 'download', 'getTranscribe', 'deleteCallRecordings')
 
 
 def parser_add_argument():
@@ -40,6 +37,8 @@ def parser_add_argument():
                         help='change the collection status of an onging collection request')
     parser.add_argument('-lc', '--listCollection', action='store_true',
                         help='list all ongoing collection requests')
+    parser.add_argument('-mc', '--migrateContactIds', action='store_true',
+                        help='move the contact ids of the collection requests into the contact table')
     parser.add_argument('-cu', '--createUser', action='store_true',
                         help='create a new user as conversation role')
     parser.add_argument('-lu', '--listAllUser', action='store_true',
@@ -54,13 +53,98 @@ def parser_add_argument():
                         help='download call recordings and corresponding metadata from AWS S3')
     parser.add_argument('-gt', '--getTranscribe', action='store_true',
                         help='apply machine transcribe to call recordings for fast benchmarking purpose')
+    parser.add_argument('-dr', '--deleteCallRecordings', action='store_true',
+                        help='delete call recordings of a collection request from AWS S3')
+    add_subcommands(parser)
     args = parser.parse_args()
     return args
 
 
+def add_subcommands(parser):
+    """
+    Add the subcommands which take all their parameters as arguments, and print one JSON line per operation
+    The argument names are the parameter names of the operations of batch_runner.BatchRunner
+
+    """
+    subparsers = parser.add_subparsers(dest='command', metavar='command',
+                                       help='run operations without any prompt, see command -h')
+    batch_parser = subparsers.add_parser('batch', help='run the operations listed in a JSON/YAML batch file')
+    batch_parser.add_argument('batch_file', help='JSON file, or YAML file ending with .yaml or .yml')
+    batch_parser.add_argument('--fail-fast', action='store_true', help='stop at the first failed operation')
+
+    start_collection_parser = subparsers.add_parser('start-collection', help='start a new collection request')
+    start_collection_parser.add_argument('--mode', required=True, choices=['human', 'bot'])
+    start_collection_parser.add_argument('--goal', required=True, type=int,
+                                         help='number of conversations to be collected')
+    start_collection_parser.add_argument('--name', required=True, help='collection request name')
+    start_collection_parser.add_argument('--bot', help='lex bot, required in bot mode')
+
+    get_collection_parser = subparsers.add_parser('get-collection', help='get the information of a collection request')
+    get_collection_parser.add_argument('--pin', required=True, help='collection request PIN')
+    get_collection_parser.add_argument('--page-size', dest='page_size', type=int,
+                                       help='maximum number of contact ids returned')
+
+    subparsers.add_parser('list-collections', help='list all ongoing collection requests')
+
+    change_status_parser = subparsers.add_parser('change-collection-status',
+                                                 help='change the collection status of a collection request')
+    change_status_parser.add_argument('--pin', required=True, help='collection request PIN')
+    change_status_parser.add_argument('--status', required=True, choices=['START', 'PAUSE'])
+
+    for command, help_message in [('download', 'download call recordings and corresponding metadata from AWS S3'),
+                                  ('get-transcribe', 'apply machine transcribe to call recordings')]:
+        output_parser = subparsers.add_parser(command, help=help_message)
+        output_parser.add_argument('--pin', required=True, help='collection request PIN')
+        output_parser.add_argument('--output', required=True,
+                                   help='output directory, the files are written under its sub directory named by PIN')
+        if command == 'get-transcribe':
+            output_parser.add_argument('--wait', action='store_true',
+                                       help='wait until every transcribe job is completed or failed')
+
+    delete_recordings_parser = subparsers.add_parser('delete-call-recordings',
+                                                     help='delete call recordings of a collection request')
+    delete_recordings_parser.add_argument('--pin', required=True, help='collection request PIN')
+    delete_recordings_parser.add_argument('--dry-run', dest='dry_run', action='store_true',
+                                          help='only count the objects that would be deleted')
+
+    create_user_parser = subparsers.add_parser('create-user', help='create a new user as conversation role')
+    create_user_parser.add_argument('--role', required=True, choices=['customer', 'agent'])
+    create_user_parser.add_argument('--name', required=True, help='user name')
+    create_user_parser.add_argument('--pin', help='collection request PIN, required for an agent')
+
+    create_users_parser = subparsers.add_parser('create-users', help='create the users listed in a CSV file')
+    create_users_parser.add_argument('--csv', required=True,
+                                     help='CSV file with a header row: name,role,collection_pin')
+
+    subparsers.add_parser('list-users', help='list all users')
+
+    delete_user_parser = subparsers.add_parser('delete-user', help='delete a user')
+    delete_user_parser.add_argument('--pin', required=True, help='6-digit user PIN')
+
+    delete_all_users_parser = subparsers.add_parser('delete-all-users', help='delete all users')
+    delete_all_users_parser.add_argument('--yes', action='store_true', help='confirm that all users are deleted')
+
+
+def run_command(args):
+    """
+    Run the subcommand, all the operations of a batch share the same managers and AWS clients
+
+    :param args: parsed command-line arguments
+    :return: number of failed operations
+    """
+    from aws_deep_sense_spoken_data_collection_framework.batch_runner import BatchRunner, load_batch_file
+    if args.command == 'batch':
+        return BatchRunner(config_path).run(load_batch_file(args.batch_file), fail_fast=args.fail_fast)
+    # The arguments of the subcommand are the only ones which are not legacy operation flags
+    parameters = {key: value for key, value in vars(args).items()
+                  if key != 'command' and key not in LEGACY_OPERATION_FLAGS}
+    return BatchRunner(config_path).run([dict(parameters, operation=args.command)])
+
+
 def main():
     """
     Perform action based on command-line arguments, **only one operation is supported at a time**
+    The subcommands run without any prompt, and exit with status 1 if an operation failed
     There are 3 categories of operations:
     1. Collection Request Manager operations
     2. User Manager operations
@@ -68,7 +152,18 @@ def main():
 
     """
     args = parser_add_argument()
-    if args.startCollection or args.getCollection or args.changeCollectionStatus or args.listCollection:
+    if args.command is not None:
+        sys.exit(1 if run_command(args) else 0)
+    import aws_deep_sense_spoken_data_collection_framework.utils as utils
+    # The configuration file is parsed once and cached
+    ACCESS_KEY_ID, ACCESS_KEY = utils.get_aws_access_key(config_path)
+    AWS_REGION_NAME = utils.get_aws_region_name(config_path)
+    CALL_RECORDINGS_BUCKET_NAME = utils.get_call_recordings_bucket_name(config_path)
+
+    if args.startCollection or args.getCollection or args.changeCollectionStatus or args.listCollection or \
+            args.migrateContactIds:
+        from aws_deep_sense_spoken_data_collection_framework.collection_request_manager import \
+            CollectionRequestManager
         collection_request_manager = CollectionRequestManager(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME,
                                                               CALL_RECORDINGS_BUCKET_NAME)
         if args.startCollection:
@@ -83,8 +178,14 @@ def main():
         elif args.listCollection:
             print('List all ongoing collection requests...')
             return collection_request_manager.list_collect_requests()
+        elif args.migrateContactIds:
+            print('Move the contact ids of all collection requests into the contact table...')
+            return collection_request_manager.migrate_contact_ids()
 
     elif args.createUser or args.listAllUser or args.openConnectPortal or args.deleteUser or args.deleteAllUser:
+        from aws_deep_sense_spoken_data_collection_framework.user_manager import UserManager
+        CONNECT_INSTANCE_ID, CONNECT_SECURITY_ID, CONNECT_PHONE_NUMBER, CONNECT_CCP_URL = utils.get_connect_info(
+            config_path)
         user_manager = UserManager(config_path, ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME,
                                    CONNECT_INSTANCE_ID, CONNECT_SECURITY_ID, CONNECT_PHONE_NUMBER, CONNECT_CCP_URL)
         if args.createUser:
@@ -103,7 +204,8 @@ def main():
             print('Delete all users...')
             return user_manager.delete_all_user()
 
-    elif args.download or args.getTranscribe:
+    elif args.download or args.getTranscribe or args.deleteCallRecordings:
+        from aws_deep_sense_spoken_data_collection_framework.call_recordings_manager import CallRecordingsManager
         call_recordings_manager = CallRecordingsManager(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME,
                                                         CALL_RECORDINGS_BUCKET_NAME)
         if args.download:
@@ -112,6 +214,9 @@ def main():
         elif args.getTranscribe:
             print('Get text transcribe of previous call recordings...')
             return call_recordings_manager.get_transcribe()
+        elif args.deleteCallRecordings:
+            print('Delete call recordings from AWS S3...')
+            return call_recordings_manager.delete_call_recordings()
 
 
 if __name__ == "__main__":
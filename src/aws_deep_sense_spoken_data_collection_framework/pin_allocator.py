@@ -0,0 +1,256 @@
+# pin_allocator.py: Allocate unique PIN codes without checking AWS Dynamo DB for every candidate
+
+import time
+import random
+import logging
+import datetime
+import threading
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+import aws_deep_sense_spoken_data_collection_framework.utils as utils
+
+DEFAULT_REFRESH_INTERVAL_SECONDS = 300
+SATURATION_WARNING_RATIO = 0.8
+RANDOM_DRAW_ATTEMPTS = 32
+MAX_TRANSACTION_ITEMS = 25
+# Attribute marking an item which only reserves a PIN code, it is overwritten once the real item is saved
+RESERVATION_ATTRIBUTE = utils.PIN_RESERVATION_ATTRIBUTE
+# Expiry time of a reservation in epoch seconds, the TTL attribute of the table deleting the reservations never saved
+RESERVATION_EXPIRY_ATTRIBUTE = 'reservationExpiresAt'
+RESERVATION_TTL_SECONDS = 24 * 60 * 60
+
+
+class PinAllocator:
+    """
+    Allocate unique n-digit PIN codes stored in an attribute of an AWS Dynamo DB table.
+    The used PIN codes are cached locally in a bitmap, which is refreshed periodically by a projected scan,
+    so that a free candidate is drawn without any request to AWS Dynamo DB.
+    A PIN code stored as the table key is reserved atomically by a conditional put on the key.
+
+    :param ACCESS_KEY_ID: Access credential key id for AWS account
+    :param ACCESS_KEY: Access Credential key for AWS account
+    :param AWS_REGION_NAME: Region name for AWS services
+    :param table_name: AWS Dynamo DB table storing the PIN codes
+    :param attribute_name: attribute storing the PIN codes
+    :param num_digit: number of digits of the PIN codes
+    :param refresh_interval: seconds before the cached bitmap is refreshed from AWS Dynamo DB
+    """
+
+    def __init__(self, ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, table_name, attribute_name, num_digit,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL_SECONDS):
+        self.ACCESS_KEY_ID = ACCESS_KEY_ID
+        self.ACCESS_KEY = ACCESS_KEY
+        self.AWS_REGION_NAME = AWS_REGION_NAME
+        self.table_name = table_name
+        self.attribute_name = attribute_name
+        self.num_digit = num_digit
+        self.refresh_interval = refresh_interval
+
+        self.first_pin = 10 ** (num_digit - 1)
+        self.num_pin = 10 ** num_digit - self.first_pin
+        self.lock = threading.Lock()
+        self.used_pins = bytearray(self.num_pin)  # 1 if the PIN code is used
+        self.num_used_pin = 0
+        self.pins_used_while_refreshing = set()
+        self.last_refresh_time = None
+        self.is_saturation_warned = False
+
+    @property
+    def table(self):
+        dynamodb = utils.get_boto3_resource('dynamodb', self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME)
+        return dynamodb.Table(self.table_name)
+
+    def refresh(self):
+        """
+        Reload the bitmap of used PIN codes from AWS Dynamo DB
+
+        """
+        with self.lock:
+            self.pins_used_while_refreshing = set()
+        used_pins = bytearray(self.num_pin)
+        for item in utils.scan_table(self.table, [self.attribute_name]):
+            index = self.get_index(item.get(self.attribute_name))
+            if index is not None:
+                used_pins[index] = 1
+
+        with self.lock:
+            # PIN codes taken since the scan started are kept as used
+            for index in self.pins_used_while_refreshing:
+                used_pins[index] = 1
+            self.used_pins = used_pins
+            self.num_used_pin = self.num_pin - used_pins.count(0)
+            self.last_refresh_time = time.time()
+            self.is_saturation_warned = False
+        self.warn_if_saturated()
+
+    def refresh_if_expired(self):
+        if self.last_refresh_time is None or time.time() - self.last_refresh_time > self.refresh_interval:
+            self.refresh()
+
+    def get_index(self, PIN):
+        """
+        :param PIN: PIN code
+        :return: index of the PIN code in the bitmap, None if it is not a valid n-digit PIN code
+        """
+        try:
+            index = int(PIN) - self.first_pin
+        except (TypeError, ValueError):
+            return None
+        if len(str(PIN)) != self.num_digit or index < 0 or index >= self.num_pin:
+            return None
+        return index
+
+    def mark_used(self, PIN):
+        """
+        Mark a PIN code as used in the local bitmap
+
+        :param PIN: PIN code
+        """
+        index = self.get_index(PIN)
+        if index is not None:
+            with self.lock:
+                self.pins_used_while_refreshing.add(index)
+                if not self.used_pins[index]:
+                    self.used_pins[index] = 1
+                    self.num_used_pin += 1
+
+    def mark_free(self, PIN):
+        """
+        Undo the marking of a PIN code drawn but not reserved
+
+        :param PIN: PIN code
+        """
+        index = self.get_index(PIN)
+        if index is not None:
+            with self.lock:
+                self.pins_used_while_refreshing.discard(index)
+                if self.used_pins[index]:
+                    self.used_pins[index] = 0
+                    self.num_used_pin -= 1
+
+    def is_used(self, PIN):
+        index = self.get_index(PIN)
+        return index is not None and self.used_pins[index] == 1
+
+    def saturation(self):
+        """
+        :return: ratio of the PIN code space which is already used, between 0 and 1
+        """
+        return self.num_used_pin / self.num_pin
+
+    def warn_if_saturated(self):
+        saturation = self.saturation()
+        if saturation >= SATURATION_WARNING_RATIO and not self.is_saturation_warned:
+            self.is_saturation_warned = True
+            logging.warning('{:.1%} of the {}-digit PIN codes in {}.{} are used, the PIN code space is near exhaustion.'
+                            .format(saturation, self.num_digit, self.table_name, self.attribute_name))
+
+    def draw(self):
+        """
+        Draw a PIN code which is free in the local bitmap, without reserving it
+
+        :return: n-digit PIN code
+        """
+        self.refresh_if_expired()
+        with self.lock:
+            index = None
+            for _ in range(RANDOM_DRAW_ATTEMPTS):
+                candidate = random.randrange(self.num_pin)
+                if not self.used_pins[candidate]:
+                    index = candidate
+                    break
+            if index is None:  # The space is crowded, take the next free one from a random position
+                start = random.randrange(self.num_pin)
+                index = self.used_pins.find(0, start)
+                if index == -1:
+                    index = self.used_pins.find(0, 0, start)
+            if index == -1:
+                raise RuntimeError('All {}-digit PIN codes in {}.{} are used.'.format(self.num_digit, self.table_name,
+                                                                                       self.attribute_name))
+        return str(self.first_pin + index)
+
+    def reserve(self):
+        """
+        Reserve a unique PIN code by a conditional put on the table key
+        Requires: the PIN code attribute is the key of the table
+
+        :return: reserved n-digit PIN code
+        """
+        while True:
+            PIN = self.draw()
+            try:
+                self.table.put_item(Item=self.get_reservation_item(PIN),
+                                    ConditionExpression=Attr(self.attribute_name).not_exists())
+                is_reserved = True
+            except ClientError as e:
+                # Any other error says nothing about the PIN code, the bitmap is left as it is
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                is_reserved = False  # Taken by another process since the bitmap was loaded
+            self.mark_used(PIN)
+            self.warn_if_saturated()
+            if is_reserved:
+                return PIN
+
+    def reserve_batch(self, num_pin):
+        """
+        Reserve several unique PIN codes, up to 25 PIN codes are reserved by one transaction
+        Requires: the PIN code attribute is the key of the table
+
+        :param num_pin: number of PIN codes to reserve
+        :return: list of reserved n-digit PIN codes
+        """
+        reserved_pins = []
+        while len(reserved_pins) < num_pin:
+            candidates = []
+            while len(candidates) < min(MAX_TRANSACTION_ITEMS, num_pin - len(reserved_pins)):
+                PIN = self.draw()
+                self.mark_used(PIN)
+                candidates.append(PIN)
+            try:
+                # The client of the resource serializes the attribute values
+                self.table.meta.client.transact_write_items(TransactItems=[{
+                    'Put': {
+                        'TableName': self.table_name,
+                        'Item': self.get_reservation_item(PIN),
+                        'ConditionExpression': 'attribute_not_exists(#pin)',
+                        'ExpressionAttributeNames': {'#pin': self.attribute_name}
+                    }
+                } for PIN in candidates])
+                reserved_pins.extend(candidates)
+            except Exception as e:
+                # None of the candidates is reserved, they were only marked so that they are drawn once
+                for PIN in candidates:
+                    self.mark_free(PIN)
+                if not isinstance(e, ClientError) or e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+                # One of the candidates was taken meanwhile, reserve this chunk one by one
+                for _ in candidates:
+                    reserved_pins.append(self.reserve())
+            self.warn_if_saturated()
+        return reserved_pins
+
+    def release(self, PIN):
+        """
+        Release a reserved PIN code whose item was never saved
+
+        :param PIN: reserved PIN code
+        """
+        try:
+            self.table.delete_item(Key={self.attribute_name: PIN},
+                                   ConditionExpression=Attr(RESERVATION_ATTRIBUTE).exists())
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    def get_reservation_item(self, PIN):
+        """
+        Item reserving a PIN code, deleted by AWS Dynamo DB once expired if it is never overwritten by the real item
+        Requires: the time to live of the table is enabled on RESERVATION_EXPIRY_ATTRIBUTE
+
+        :param PIN: PIN code
+        :return: reservation item
+        """
+        return {self.attribute_name: PIN,
+                RESERVATION_ATTRIBUTE: datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                RESERVATION_EXPIRY_ATTRIBUTE: int(time.time()) + RESERVATION_TTL_SECONDS}
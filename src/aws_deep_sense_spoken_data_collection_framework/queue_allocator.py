@@ -0,0 +1,154 @@
+# queue_allocator.py: Check out and release the Amazon Connect queues of the queue pool stored in AWS Dynamo DB
+
+import time
+import random
+import threading
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+import aws_deep_sense_spoken_data_collection_framework.utils as utils
+
+DEFAULT_REFRESH_INTERVAL_SECONDS = 300
+# The queues released by the lambda functions are only seen by a new count
+DEFAULT_COUNT_TTL_SECONDS = 30
+
+
+class QueueAllocator:
+    """
+    Check out and release the queues of the queue pool, a queue is free while its item is in the pool table.
+    The numbers of the free queues are cached locally, and refreshed periodically by a projected scan,
+    so that a queue is checked out by a single conditional delete instead of a scan of the pool.
+    The conditional delete returns the item it removes, only one of several concurrent callers gets a queue.
+    A queue is released by putting its item back, as the check_pin_code lambda function does when a collection stops.
+    The number of free queues is cached as well, it follows the checkouts and releases of this allocator,
+    and is counted again by a COUNT scan once it is older than count_ttl.
+
+    :param ACCESS_KEY_ID: Access credential key id for AWS account
+    :param ACCESS_KEY: Access Credential key for AWS account
+    :param AWS_REGION_NAME: Region name for AWS services
+    :param refresh_interval: seconds before the cached free queues are refreshed from AWS Dynamo DB
+    :param count_ttl: seconds before the cached number of free queues is counted again
+    """
+
+    def __init__(self, ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, refresh_interval=DEFAULT_REFRESH_INTERVAL_SECONDS,
+                 count_ttl=DEFAULT_COUNT_TTL_SECONDS):
+        self.ACCESS_KEY_ID = ACCESS_KEY_ID
+        self.ACCESS_KEY = ACCESS_KEY
+        self.AWS_REGION_NAME = AWS_REGION_NAME
+        self.refresh_interval = refresh_interval
+        self.count_ttl = count_ttl
+
+        self.lock = threading.Lock()
+        self.free_queue_numbers = set()
+        self.last_refresh_time = None
+        self.num_free = None
+        self.last_count_time = None
+
+    @property
+    def table(self):
+        dynamodb = utils.get_boto3_resource('dynamodb', self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME)
+        return dynamodb.Table(utils.QUEUE_POOL_DYNAMODB_TABLE)
+
+    def refresh(self):
+        """
+        Reload the numbers of the free queues from AWS Dynamo DB
+
+        """
+        free_queue_numbers = {item[utils.QUEUE_POOL_DYNAMODB_TABLE_KEY] for item in
+                              utils.scan_table(self.table, [utils.QUEUE_POOL_DYNAMODB_TABLE_KEY])}
+        with self.lock:
+            self.free_queue_numbers = free_queue_numbers
+            self.last_refresh_time = time.time()
+            self.num_free = len(free_queue_numbers)
+            self.last_count_time = self.last_refresh_time
+
+    def refresh_if_expired(self):
+        if self.last_refresh_time is None or time.time() - self.last_refresh_time > self.refresh_interval:
+            self.refresh()
+
+    def count(self):
+        """
+        Count the free queues by a COUNT scan, which returns no item
+
+        """
+        num_free = 0
+        scan_kwargs = {'Select': 'COUNT'}
+        while True:
+            response = self.table.scan(**scan_kwargs)
+            num_free += response['Count']
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        with self.lock:
+            self.num_free = num_free
+            self.last_count_time = time.time()
+
+    def num_free_queue(self, refresh=False):
+        """
+        :param refresh: count the free queues again, even if the cached number is not expired
+        :return: number of free queues
+        """
+        if refresh or self.last_count_time is None or time.time() - self.last_count_time > self.count_ttl:
+            self.count()
+        return self.num_free
+
+    def draw(self):
+        """
+        Take a random queue number out of the local cache, without checking it out
+
+        :return: queue number, None if no queue is free in the local cache
+        """
+        with self.lock:
+            if len(self.free_queue_numbers) == 0:
+                return None
+            queue_number = random.choice(list(self.free_queue_numbers))
+            self.free_queue_numbers.discard(queue_number)
+            return queue_number
+
+    def checkout(self):
+        """
+        Check out a free queue by a conditional delete of its item
+        The local cache is refreshed once if all its queues are taken by other callers meanwhile
+
+        :return: routing information of the queue, None if no queue is free
+        """
+        self.refresh_if_expired()
+        queue_exists = Attr(utils.QUEUE_POOL_DYNAMODB_TABLE_KEY).exists()
+        is_refreshed = False
+        while True:
+            queue_number = self.draw()
+            if queue_number is None:
+                if is_refreshed:
+                    return None
+                self.refresh()
+                is_refreshed = True
+                continue
+            try:
+                response = self.table.delete_item(Key={utils.QUEUE_POOL_DYNAMODB_TABLE_KEY: queue_number},
+                                                  ConditionExpression=queue_exists, ReturnValues='ALL_OLD')
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                continue
+            self.add_to_num_free(-1)
+            return response['Attributes']
+
+    def release(self, routing_info):
+        """
+        Return a checked out queue to the queue pool, a queue already returned is left as it is
+
+        :param routing_info: routing information of the queue
+        """
+        try:
+            self.table.put_item(Item=routing_info,
+                                ConditionExpression=Attr(utils.QUEUE_POOL_DYNAMODB_TABLE_KEY).not_exists())
+            self.add_to_num_free(1)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        with self.lock:
+            self.free_queue_numbers.add(routing_info[utils.QUEUE_POOL_DYNAMODB_TABLE_KEY])
+
+    def add_to_num_free(self, delta):
+        with self.lock:
+            if self.num_free is not None:
+                self.num_free = max(self.num_free + delta, 0)
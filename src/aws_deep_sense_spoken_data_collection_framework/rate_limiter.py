@@ -0,0 +1,70 @@
+# rate_limiter.py: Keep the calls to an AWS API within its rate limit, and retry the calls which are throttled
+
+import time
+import random
+import threading
+from botocore.exceptions import ClientError
+
+# Amazon Connect allows about 2 user management requests per second, with bursts of 5
+CONNECT_API_RATE = 2
+CONNECT_API_BURST = 5
+THROTTLING_ERROR_CODES = {'TooManyRequestsException', 'ThrottlingException', 'Throttling', 'RequestLimitExceeded',
+                          'ProvisionedThroughputExceededException'}
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 8
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, shared by the workers calling the same API.
+    Tokens are added at a constant rate up to the capacity, and every call takes one token.
+
+    :param rate: number of tokens added per second
+    :param capacity: maximum number of tokens, the size of a burst of calls, the rate by default
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = max(1, rate) if capacity is None else capacity
+        self.lock = threading.Lock()
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
+
+    def acquire(self):
+        """
+        Take a token, wait until one is added if the bucket is empty
+
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+                self.last_time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+def call_with_retry(function, token_bucket=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                    backoff=DEFAULT_BACKOFF_SECONDS):
+    """
+    Call an AWS API, and retry it with an exponential backoff and jitter while it is throttled
+
+    :param function: function without argument calling the API
+    :param token_bucket: token bucket taken before every attempt, None for no rate limit
+    :param max_attempts: maximum number of attempts
+    :param backoff: seconds waited before the first retry, doubled for every retry
+    :return: return value of the function
+    """
+    for attempt in range(1, max_attempts + 1):
+        if token_bucket is not None:
+            token_bucket.acquire()
+        try:
+            return function()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES or attempt == max_attempts:
+                raise
+        time.sleep(min(MAX_BACKOFF_SECONDS, backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1))
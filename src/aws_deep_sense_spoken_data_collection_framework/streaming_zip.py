@@ -0,0 +1,321 @@
+# streaming_zip.py: Stream a ZIP archive of remote objects with a constant memory footprint
+
+import re
+import json
+import struct
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+
+# Sizes, offsets and number of files from which the ZIP64 records are needed
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+# Values of the classic fields whose actual values are stored in the ZIP64 records
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_FILECOUNT_MARKER = 0xFFFF
+MAX_CRC_CACHE_ENTRIES = 100000
+
+# Flags: the CRC-32 and sizes follow the data in a data descriptor (bit 3), the file name is UTF-8 (bit 11)
+GENERAL_PURPOSE_FLAGS = 0x0808
+COMPRESSION_STORED = 0
+EXTERNAL_ATTRIBUTES = 0o100644 << 16
+
+# entry of the archive
+#   arcname: path of the file in the archive
+#   size: size of the file in bytes
+#   date_time: (year, month, day, hour, minute, second) of the file
+#   reader: reader(offset) returns an iterable of byte chunks from the offset to the end of the file
+#   cache_key: hashable key identifying the content of the file (e.g. its ETag), None if the content may change
+#   load_crc: load_crc() returns the CRC-32 of the file saved by save_crc, None if unknown, optional
+#   save_crc: save_crc(crc) keeps the CRC-32 of the file beyond the process, e.g. next to the file, optional
+ZipEntry = namedtuple('ZipEntry', ['arcname', 'size', 'date_time', 'reader', 'cache_key', 'load_crc', 'save_crc'],
+                      defaults=(None, None))
+
+# CRC-32 of the files streamed before by this process, on top of the ones saved by the entries,
+# a range request after the first one can skip the files before the range
+_crc_cache = OrderedDict()
+_crc_cache_lock = threading.Lock()
+
+
+def get_cached_crc(cache_key):
+    if cache_key is None:
+        return None
+    with _crc_cache_lock:
+        return _crc_cache.get(cache_key)
+
+
+def set_cached_crc(cache_key, crc):
+    if cache_key is None:
+        return
+    with _crc_cache_lock:
+        _crc_cache[cache_key] = crc
+        _crc_cache.move_to_end(cache_key)
+        while len(_crc_cache) > MAX_CRC_CACHE_ENTRIES:
+            _crc_cache.popitem(last=False)
+
+
+def clear_crc_cache():
+    with _crc_cache_lock:
+        _crc_cache.clear()
+
+
+def parse_range_header(range_header, size):
+    """
+    Parse a single HTTP byte range, multiple ranges are not supported and the whole content is served instead
+
+    :param range_header: value of the Range header, e.g. 'bytes=100-199', 'bytes=100-', 'bytes=-100'
+    :param size: size of the content
+    :return: (start, end) with both ends inclusive, None if the whole content should be served
+    :raise ValueError: if the range is not satisfiable
+    """
+    match = re.fullmatch(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*', range_header or '')
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    if match.group(1) == '':  # Suffix range: the last n bytes
+        suffix_length = int(match.group(2))
+        if suffix_length == 0:
+            raise ValueError('Range {} is not satisfiable.'.format(range_header))
+        return max(0, size - suffix_length), size - 1
+    start = int(match.group(1))
+    end = size - 1 if match.group(2) == '' else min(int(match.group(2)), size - 1)
+    if start >= size or end < start:
+        raise ValueError('Range {} is not satisfiable.'.format(range_header))
+    return start, end
+
+
+def to_dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+
+class StreamingZip:
+    """
+    A ZIP archive of STORED (uncompressed) files, generated on the fly while the files are read.
+    The layout of the archive only depends on the names, sizes and dates of the files, so its size is known
+    before any file is read, and any byte range of it can be generated again identically.
+    The CRC-32 of every file is written in a data descriptor after the file, and ZIP64 records are used
+    only when a size, an offset or the number of files overflows the classic ZIP format.
+
+    :param entries: list of ZipEntry, in the order of the archive
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.local_headers = []
+        self.offsets = []  # offset of the local header of every entry
+        self.is_zip64 = []
+        offset = 0
+        for entry in self.entries:
+            is_zip64 = entry.size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT
+            local_header = self.get_local_header(entry, is_zip64)
+            self.local_headers.append(local_header)
+            self.offsets.append(offset)
+            self.is_zip64.append(is_zip64)
+            offset += len(local_header) + entry.size + self.get_data_descriptor_size(is_zip64)
+        self.central_directory_offset = offset
+        self.central_directory_size = sum(self.get_central_directory_header_size(entry, index)
+                                          for index, entry in enumerate(self.entries))
+        self.size = self.central_directory_offset + self.central_directory_size + len(self.get_end_records())
+
+    @property
+    def etag(self):
+        """
+        :return: strong entity tag of the archive, it changes whenever any file of the archive changes
+        """
+        description = json.dumps([[entry.arcname, entry.size, list(entry.date_time), str(entry.cache_key)]
+                                  for entry in self.entries])
+        return '"{}"'.format(hashlib.sha1(description.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def get_local_header(entry, is_zip64):
+        name = entry.arcname.encode('utf-8')
+        dos_date, dos_time = to_dos_date_time(entry.date_time)
+        extra = b''
+        size_field = 0
+        if is_zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            size_field = ZIP64_MARKER
+        return struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', 45 if is_zip64 else 20, GENERAL_PURPOSE_FLAGS,
+                           COMPRESSION_STORED, dos_time, dos_date, 0, size_field, size_field, len(name),
+                           len(extra)) + name + extra
+
+    @staticmethod
+    def get_data_descriptor_size(is_zip64):
+        return 24 if is_zip64 else 16
+
+    @staticmethod
+    def get_data_descriptor(entry, crc, is_zip64):
+        if is_zip64:
+            return struct.pack('<4sLQQ', b'PK\x07\x08', crc, entry.size, entry.size)
+        return struct.pack('<4sLLL', b'PK\x07\x08', crc, entry.size, entry.size)
+
+    def get_central_directory_zip64_fields(self, entry, index):
+        fields = []
+        if entry.size >= ZIP64_LIMIT or self.is_zip64[index]:
+            fields += [entry.size, entry.size]
+        if self.offsets[index] >= ZIP64_LIMIT:
+            fields.append(self.offsets[index])
+        return fields
+
+    def get_central_directory_header_size(self, entry, index):
+        zip64_fields = self.get_central_directory_zip64_fields(entry, index)
+        return 46 + len(entry.arcname.encode('utf-8')) + (4 + 8 * len(zip64_fields) if zip64_fields else 0)
+
+    def get_central_directory_header(self, entry, index, crc):
+        name = entry.arcname.encode('utf-8')
+        dos_date, dos_time = to_dos_date_time(entry.date_time)
+        zip64_fields = self.get_central_directory_zip64_fields(entry, index)
+        extra = b''
+        size_field = entry.size
+        if zip64_fields:
+            extra = struct.pack('<HH', 0x0001, 8 * len(zip64_fields)) + struct.pack(
+                '<{}Q'.format(len(zip64_fields)), *zip64_fields)
+            size_field = ZIP64_MARKER
+        offset_field = ZIP64_MARKER if self.offsets[index] >= ZIP64_LIMIT else self.offsets[index]
+        version = 45 if zip64_fields else 20
+        return struct.pack('<4sHHHHHHLLLHHHHHLL', b'PK\x01\x02', version, version, GENERAL_PURPOSE_FLAGS,
+                           COMPRESSION_STORED, dos_time, dos_date, crc, size_field, size_field, len(name),
+                           len(extra), 0, 0, 0, EXTERNAL_ATTRIBUTES, offset_field) + name + extra
+
+    def get_end_records(self):
+        num_entries = len(self.entries)
+        if num_entries < ZIP_FILECOUNT_LIMIT and self.central_directory_offset < ZIP64_LIMIT and \
+                self.central_directory_size < ZIP64_LIMIT:
+            return struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, num_entries, num_entries,
+                               self.central_directory_size, self.central_directory_offset, 0)
+        zip64_end_offset = self.central_directory_offset + self.central_directory_size
+        return struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, 45, 45, 0, 0, num_entries, num_entries,
+                           self.central_directory_size, self.central_directory_offset) + \
+            struct.pack('<4sLQL', b'PK\x06\x07', 0, zip64_end_offset, 1) + \
+            struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, ZIP64_FILECOUNT_MARKER, ZIP64_FILECOUNT_MARKER,
+                        ZIP64_MARKER, ZIP64_MARKER, 0)
+
+    @staticmethod
+    def load_crc(entry):
+        """
+        :param entry: ZipEntry
+        :return: CRC-32 of the file cached by this process or saved by the entry, None if unknown
+        """
+        if entry.size == 0:
+            return 0
+        crc = get_cached_crc(entry.cache_key)
+        if crc is None and entry.load_crc is not None:
+            crc = entry.load_crc()
+            if crc is not None:
+                set_cached_crc(entry.cache_key, crc)
+        return crc
+
+    @staticmethod
+    def save_crc(entry, crc):
+        """
+        Cache the CRC-32 of a file, and have the entry save it the first time it is computed
+
+        :param entry: ZipEntry
+        :param crc: CRC-32 of the file
+        """
+        is_new = get_cached_crc(entry.cache_key) is None
+        set_cached_crc(entry.cache_key, crc)
+        if is_new and entry.save_crc is not None:
+            entry.save_crc(crc)
+
+    def read_entry(self, entry, offset):
+        """
+        Read a file from an offset, the CRC-32 is computed and saved when the file is read from the start
+
+        :param entry: ZipEntry
+        :param offset: offset in the file
+        :return: generator of byte chunks from the offset to the end of the file
+        """
+        if entry.size == 0:
+            set_cached_crc(entry.cache_key, 0)
+            return
+        crc = 0
+        num_bytes = 0
+        for chunk in entry.reader(offset):
+            if offset == 0:
+                crc = zlib.crc32(chunk, crc)
+            num_bytes += len(chunk)
+            yield chunk
+        if num_bytes != entry.size - offset:
+            raise IOError('{} has {} bytes instead of {}.'.format(entry.arcname, offset + num_bytes, entry.size))
+        if offset == 0:
+            self.save_crc(entry, crc)
+
+    def get_crc(self, entry):
+        crc = self.load_crc(entry)
+        if crc is None:
+            crc = 0
+            for chunk in self.read_entry(entry, 0):
+                crc = zlib.crc32(chunk, crc)
+        return crc
+
+    def iter_bytes(self, start=0, end=None):
+        """
+        Generate the bytes of the archive between two offsets, only the files overlapping the range are read,
+        unless the CRC-32 of a file is needed and has been neither cached nor saved yet
+
+        :param start: first offset, inclusive
+        :param end: last offset, inclusive, the end of the archive by default
+        :return: generator of byte chunks
+        """
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        if start > end:
+            return
+        crcs = {}
+
+        def clip(segment_offset, segment):
+            # Part of a segment inside the range
+            return segment[max(0, start - segment_offset):max(0, end + 1 - segment_offset)]
+
+        for index, entry in enumerate(self.entries):
+            offset = self.offsets[index]
+            if offset > end:
+                break
+            local_header = self.local_headers[index]
+            data_offset = offset + len(local_header)
+            descriptor_offset = data_offset + entry.size
+            next_offset = descriptor_offset + self.get_data_descriptor_size(self.is_zip64[index])
+            if offset + len(local_header) > start:
+                yield clip(offset, local_header)
+
+            if descriptor_offset > start and data_offset <= end:
+                # The file overlaps the range, read it from the start unless its CRC-32 is known,
+                # the saved one is only looked up when the range starts inside the file
+                crc = get_cached_crc(entry.cache_key) if start <= data_offset else self.load_crc(entry)
+                read_offset = max(0, start - data_offset) if crc is not None else 0
+                position = data_offset + read_offset
+                running_crc = 0
+                for chunk in self.read_entry(entry, read_offset):
+                    if crc is None:
+                        running_crc = zlib.crc32(chunk, running_crc)
+                    chunk_end = position + len(chunk)
+                    if chunk_end > start and position <= end:
+                        yield clip(position, chunk)
+                    position = chunk_end
+                    if position > end:
+                        break
+                if crc is not None:
+                    crcs[index] = crc
+                elif position == descriptor_offset:
+                    crcs[index] = running_crc
+
+            if next_offset > start and descriptor_offset <= end:
+                if index not in crcs:
+                    crcs[index] = self.get_crc(entry)
+                yield clip(descriptor_offset, self.get_data_descriptor(entry, crcs[index], self.is_zip64[index]))
+
+        if end < self.central_directory_offset:
+            return
+        offset = self.central_directory_offset
+        for index, entry in enumerate(self.entries):
+            header_size = self.get_central_directory_header_size(entry, index)
+            if offset + header_size > start:
+                crc = crcs[index] if index in crcs else self.get_crc(entry)
+                yield clip(offset, self.get_central_directory_header(entry, index, crc))
+            offset += header_size
+            if offset > end:
+                return
+        yield clip(offset, self.get_end_records())
@@ -0,0 +1,379 @@
+# transcription_orchestrator.py: Run the AWS Transcribe jobs of a whole collection request
+
+import os
+import json
+import time
+import logging
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+import aws_deep_sense_spoken_data_collection_framework.utils as utils
+from aws_deep_sense_spoken_data_collection_framework.call_recordings_manager import TRANSCRIBE_JOB_STATUS_NOT_START, \
+    TRANSCRIBE_JOB_STATUS_IN_PROGRESS, TRANSCRIBE_JOB_STATUS_COMPLETED, TRANSCRIBE_JOB_STATUS_FAILED
+
+TRANSCRIBE_STATE_FILE_NAME = 'transcribe_state_{}.json'
+DEFAULT_MAX_IN_FLIGHT_JOBS = 10
+DEFAULT_DOWNLOAD_CONCURRENCY = 8
+INITIAL_POLL_INTERVAL_SECONDS = 5
+MAX_POLL_INTERVAL_SECONDS = 120
+POLL_BACKOFF_FACTOR = 2
+LIST_TRANSCRIPTION_JOBS_MAX_RESULTS = 100
+DEFAULT_STATUS_CACHE_TTL_SECONDS = 30
+
+TRANSCRIBE_JOB_STATUS_QUEUED = 'QUEUED'
+TRANSCRIBE_JOB_ACTIVE_STATUSES = [TRANSCRIBE_JOB_STATUS_QUEUED, TRANSCRIBE_JOB_STATUS_IN_PROGRESS]
+# Error codes of get_transcription_job for a job which does not exist
+TRANSCRIBE_JOB_NOT_FOUND_ERROR_CODES = ['BadRequestException', 'NotFoundException']
+# Local status of a completed job whose transcript is downloaded
+TRANSCRIBE_JOB_STATUS_DOWNLOADED = 'DOWNLOADED'
+
+
+def list_transcription_jobs(transcribe_client, status=None):
+    """
+    List the transcribe jobs of the account page by page
+
+    :param transcribe_client: AWS Transcribe client
+    :param status: only list the jobs with this status, all jobs if None
+    :return: {job name: job status}
+    """
+    job_statuses = {}
+    list_kwargs = {'MaxResults': LIST_TRANSCRIPTION_JOBS_MAX_RESULTS}
+    if status is not None:
+        list_kwargs['Status'] = status
+    while True:
+        response = transcribe_client.list_transcription_jobs(**list_kwargs)
+        for job_summary in response['TranscriptionJobSummaries']:
+            job_statuses[job_summary['TranscriptionJobName']] = job_summary['TranscriptionJobStatus']
+        if 'NextToken' not in response:
+            break
+        list_kwargs['NextToken'] = response['NextToken']
+    return job_statuses
+
+
+def list_active_transcription_jobs(transcribe_client):
+    """
+    List the transcribe jobs queued or in progress, their number is bounded by the concurrency quota of the account,
+    unlike the whole history of jobs
+
+    :param transcribe_client: AWS Transcribe client
+    :return: {job name: job status}
+    """
+    job_statuses = {}
+    for status in TRANSCRIBE_JOB_ACTIVE_STATUSES:
+        job_statuses.update(list_transcription_jobs(transcribe_client, status))
+    return job_statuses
+
+
+def get_transcription_job_status(transcribe_client, job_name):
+    """
+    :param transcribe_client: AWS Transcribe client
+    :param job_name: name of the job
+    :return: status of the job, not started if there is no such job
+    """
+    try:
+        return transcribe_client.get_transcription_job(
+            TranscriptionJobName=job_name)['TranscriptionJob']['TranscriptionJobStatus']
+    except ClientError as e:
+        if e.response['Error']['Code'] not in TRANSCRIBE_JOB_NOT_FOUND_ERROR_CODES:
+            raise
+        return TRANSCRIBE_JOB_STATUS_NOT_START
+
+
+class TranscriptionState:
+    """
+    A per-collection record of the AWS Transcribe jobs, so that a repeated run only deals with the unfinished ones
+
+    :param state_file: path for the state file
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.jobs = {}
+        if os.path.exists(state_file):
+            try:
+                with open(state_file, 'r') as json_file:
+                    self.jobs = json.load(json_file)['jobs']
+            except Exception as e:
+                logging.error('Cannot read transcribe state {}, starting over. Error: {}'.format(state_file, e))
+
+    def is_known(self, contact_id):
+        with self.lock:
+            return contact_id in self.jobs
+
+    def get_status(self, contact_id):
+        with self.lock:
+            return self.jobs.get(contact_id, {}).get('status', TRANSCRIBE_JOB_STATUS_NOT_START)
+
+    def set_status(self, contact_id, status):
+        with self.lock:
+            self.jobs.setdefault(contact_id, {})['status'] = status
+
+    def save(self):
+        """
+        Write the state to disk, the file is replaced atomically so that an interruption never corrupts it
+        """
+        with self.lock:
+            content = json.dumps({'jobs': self.jobs}, indent=4, sort_keys=True)
+        temporary_file = '{}.tmp'.format(self.state_file)
+        with open(temporary_file, 'w+') as json_file:
+            json_file.write(content)
+        os.replace(temporary_file, self.state_file)
+
+
+class TranscriptionOrchestrator:
+    """
+    Start, poll and download the AWS Transcribe jobs of all the conversations of a collection request.
+    At most max_in_flight jobs are queued or in progress at a time, and only those are polled, one
+    get_transcription_job each, so a poll does not depend on the number of jobs in the account.
+    The polling interval grows exponentially while nothing completes.
+
+    :param call_recordings_manager: CallRecordingsManager of the call recordings bucket
+    :param collection_pin: collection request PIN
+    :param output_file_path: the output file path for transcribe file downloaded
+    :param transcribe_client: AWS Transcribe client, the one of the call recordings manager by default
+    :param max_in_flight: maximum number of jobs queued or in progress at a time
+    :param download_concurrency: maximum number of transcripts downloaded at the same time
+    :param initial_poll_interval: seconds between the first polls
+    :param max_poll_interval: maximum seconds between two polls
+    :param sleep: function waiting for some seconds
+    """
+
+    def __init__(self, call_recordings_manager, collection_pin, output_file_path, transcribe_client=None,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT_JOBS, download_concurrency=DEFAULT_DOWNLOAD_CONCURRENCY,
+                 initial_poll_interval=INITIAL_POLL_INTERVAL_SECONDS, max_poll_interval=MAX_POLL_INTERVAL_SECONDS,
+                 sleep=time.sleep):
+        self.call_recordings_manager = call_recordings_manager
+        self.collection_pin = collection_pin
+        self.output_file_path = output_file_path
+        self.transcribe_client = transcribe_client if transcribe_client is not None \
+            else call_recordings_manager.transcribe_client
+        self.max_in_flight = max_in_flight
+        self.download_concurrency = download_concurrency
+        self.initial_poll_interval = initial_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.sleep = sleep
+        self.call_recordings_manager.ensure_directory_exists(output_file_path)
+        self.state = TranscriptionState(os.path.join(output_file_path,
+                                                     TRANSCRIBE_STATE_FILE_NAME.format(collection_pin)))
+
+    def run(self, wait=False):
+        """
+        Bring the transcribe jobs of the collection request forward
+
+        :param wait: if True, poll until every job is downloaded or failed, otherwise poll once
+        :return: number of conversations per status {'DOWNLOADED': xx, 'IN_PROGRESS': xx, ...}
+        """
+        manager = self.call_recordings_manager
+        contact_ids = utils.get_contact_ids(manager.ACCESS_KEY_ID, manager.ACCESS_KEY, manager.AWS_REGION_NAME,
+                                            self.collection_pin)
+        mode = utils.check_collection_request_mode(manager.ACCESS_KEY_ID, manager.ACCESS_KEY,
+                                                   manager.AWS_REGION_NAME, self.collection_pin)
+        poll_interval = self.initial_poll_interval
+        with ThreadPoolExecutor(max_workers=self.download_concurrency) as executor:
+            while True:
+                pending_contact_ids = [contact_id for contact_id in contact_ids if not self.is_finished(contact_id)]
+                num_downloaded = 0
+                if len(pending_contact_ids) > 0:
+                    self.poll(pending_contact_ids)
+                    self.start_jobs(mode, pending_contact_ids)
+                    num_downloaded = self.download_transcripts(executor, pending_contact_ids)
+                    self.state.save()
+                if not wait or all(self.is_finished(contact_id) for contact_id in contact_ids):
+                    break
+                # Poll again soon after some progress, back off while nothing completes
+                if num_downloaded > 0:
+                    poll_interval = self.initial_poll_interval
+                logging.info('Waiting {} seconds for transcribe jobs of collection request {}.'.format(
+                    poll_interval, self.collection_pin))
+                self.sleep(poll_interval)
+                poll_interval = min(poll_interval * POLL_BACKOFF_FACTOR, self.max_poll_interval)
+
+        summary = {}
+        for contact_id in contact_ids:
+            status = self.state.get_status(contact_id)
+            summary[status] = summary.get(status, 0) + 1
+        logging.info('Transcribe jobs of collection request {}: {}'.format(self.collection_pin, summary))
+        return summary
+
+    def is_finished(self, contact_id):
+        return self.state.get_status(contact_id) in [TRANSCRIBE_JOB_STATUS_DOWNLOADED, TRANSCRIBE_JOB_STATUS_FAILED]
+
+    def poll(self, contact_ids):
+        """
+        Update the status of the jobs of some contact ids, the job of a contact id is named after it
+        Only the jobs in flight are read, and the ones not in the state yet, e.g. started by an earlier run
+        without the state file, are read once. The jobs not started are started by start_jobs, which
+        takes over a job existing already.
+
+        :param contact_ids: contact ids of the jobs
+        """
+        polled_contact_ids = [contact_id for contact_id in contact_ids
+                              if self.state.get_status(contact_id) in TRANSCRIBE_JOB_ACTIVE_STATUSES]
+        polled_contact_ids.extend(contact_id for contact_id in contact_ids if not self.state.is_known(contact_id))
+        for contact_id in polled_contact_ids:
+            try:
+                status = get_transcription_job_status(self.transcribe_client, contact_id)
+            except ClientError as e:
+                logging.warning('Cannot read transcribe job with contact id {}, retrying later. Error: {}'.format(
+                    contact_id, e))
+                # The following reads would most likely be throttled as well
+                break
+            if status == TRANSCRIBE_JOB_STATUS_FAILED:
+                logging.info('Transcribe job with contact id {} is failed.'.format(contact_id))
+            if status != TRANSCRIBE_JOB_STATUS_NOT_START or \
+                    self.state.get_status(contact_id) not in TRANSCRIBE_JOB_ACTIVE_STATUSES:
+                # A job just started may not be found yet
+                self.state.set_status(contact_id, status)
+
+    def start_jobs(self, mode, contact_ids):
+        """
+        Start the jobs not started yet, as long as less than max_in_flight jobs are queued or in progress
+        A job which cannot be started for now, e.g. throttled, is left not started and started by a later pass,
+        only a rejected request fails the job
+
+        :param mode: Collection Request Mode
+        :param contact_ids: contact ids of the jobs
+        """
+        num_in_flight = len([contact_id for contact_id in contact_ids
+                             if self.state.get_status(contact_id) in TRANSCRIBE_JOB_ACTIVE_STATUSES])
+        for contact_id in contact_ids:
+            if num_in_flight >= self.max_in_flight:
+                break
+            if self.state.get_status(contact_id) != TRANSCRIBE_JOB_STATUS_NOT_START:
+                continue
+            try:
+                is_started = self.call_recordings_manager.start_transcribe_job(self.transcribe_client, mode,
+                                                                               contact_id)
+            except ClientError as e:
+                logging.warning('Transcribe job with contact id {} is not started, retrying later. Error: {}'.format(
+                    contact_id, e))
+                # The following jobs would most likely be throttled as well
+                break
+            if is_started:
+                logging.info('Transcribe job with contact id {} is in progress.'.format(contact_id))
+                self.state.set_status(contact_id, TRANSCRIBE_JOB_STATUS_IN_PROGRESS)
+                num_in_flight += 1
+            else:
+                logging.error('Transcribe job with contact id {} is failed.'.format(contact_id))
+                self.state.set_status(contact_id, TRANSCRIBE_JOB_STATUS_FAILED)
+
+    def download_transcripts(self, executor, contact_ids):
+        """
+        Download the transcripts of the completed jobs concurrently
+
+        :param executor: executor running the downloads
+        :param contact_ids: contact ids of the jobs
+        :return: number of transcripts downloaded
+        """
+        futures = {executor.submit(self.download_transcript, contact_id): contact_id for contact_id in contact_ids
+                   if self.state.get_status(contact_id) == TRANSCRIBE_JOB_STATUS_COMPLETED}
+        num_downloaded = 0
+        for future, contact_id in futures.items():
+            try:
+                future.result()
+                self.state.set_status(contact_id, TRANSCRIBE_JOB_STATUS_DOWNLOADED)
+                num_downloaded += 1
+                logging.info('Transcribe job with contact id {} is downloaded.'.format(contact_id))
+            except Exception as e:
+                logging.error('Cannot download transcribe job with contact id {}. Error: {}'.format(contact_id, e))
+        return num_downloaded
+
+    def download_transcript(self, contact_id):
+        output_file_path_with_contact_id = os.path.join(self.output_file_path, contact_id)
+        self.call_recordings_manager.ensure_directory_exists(output_file_path_with_contact_id)
+        output_transcribe_file_name = os.path.join(output_file_path_with_contact_id,
+                                                   'transcribe_{}.json'.format(contact_id))
+        if os.path.exists(output_transcribe_file_name):
+            return
+        response = self.transcribe_client.get_transcription_job(TranscriptionJobName=contact_id)
+        transcript_file_url = response['TranscriptionJob']['Transcript']['TranscriptFileUri']
+        with urllib.request.urlopen(transcript_file_url) as transcript_response:
+            transcribe_dict = json.loads(transcript_response.read())
+        with open(output_transcribe_file_name, 'w+') as transcript_file:
+            transcript_file.write(str(json.dumps(transcribe_dict, indent=4, sort_keys=True)))
+
+
+class TranscribeStatusResolver:
+    """
+    Resolve the transcribe job statuses of many contact ids at once, for the web interface.
+    The statuses are cached by contact id, a status expires after ttl seconds unless the job is finished,
+    and the expired ones are refreshed all together, which is shared by the concurrent callers.
+    A refresh lists the jobs queued or in progress only, never the whole history of the account,
+    and reads the few other jobs it needs one by one.
+
+    :param transcribe_client: AWS Transcribe client
+    :param ttl: seconds before the status of an unfinished job expires
+    :param clock: function returning the current time in seconds
+    """
+
+    def __init__(self, transcribe_client, ttl=DEFAULT_STATUS_CACHE_TTL_SECONDS, clock=time.time):
+        self.transcribe_client = transcribe_client
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.statuses = {}  # {contact id: (status, time of the status)}
+
+    def get_cached_statuses(self, contact_ids):
+        """
+        :param contact_ids: contact ids of the jobs
+        :return: {contact id: cached status, None if unknown}, without any request to AWS Transcribe
+        """
+        with self.lock:
+            return {contact_id: self.statuses[contact_id][0] if contact_id in self.statuses else None
+                    for contact_id in contact_ids}
+
+    def is_fresh(self, contact_id, now):
+        with self.lock:
+            if contact_id not in self.statuses:
+                return False
+            status, status_time = self.statuses[contact_id]
+        return status in [TRANSCRIBE_JOB_STATUS_COMPLETED, TRANSCRIBE_JOB_STATUS_FAILED] or \
+            now - status_time < self.ttl
+
+    def get_statuses(self, contact_ids):
+        """
+        :param contact_ids: contact ids of the jobs
+        :return: {contact id: "NOT_STARTED" | "QUEUED" | "IN_PROGRESS" | "FAILED" | "COMPLETED"}
+        """
+        if not all(self.is_fresh(contact_id, self.clock()) for contact_id in contact_ids):
+            with self.refresh_lock:
+                # Another caller may have refreshed the statuses while waiting for the lock
+                if not all(self.is_fresh(contact_id, self.clock()) for contact_id in contact_ids):
+                    self.refresh(contact_ids)
+        return self.get_cached_statuses(contact_ids)
+
+    def refresh(self, contact_ids):
+        """
+        Reload the expired statuses of some contact ids
+        A job which is not queued or in progress any more, or not known yet, is read by itself.
+        A job not started stays so unless it shows up among the active jobs, a job started by this process
+        is set by set_status.
+
+        :param contact_ids: contact ids of the jobs
+        """
+        refresh_time = self.clock()
+        job_statuses = list_active_transcription_jobs(self.transcribe_client)
+        cached_statuses = self.get_cached_statuses(contact_ids)
+        for contact_id in contact_ids:
+            if contact_id in job_statuses or self.is_fresh(contact_id, refresh_time):
+                continue
+            if cached_statuses[contact_id] == TRANSCRIBE_JOB_STATUS_NOT_START:
+                job_statuses[contact_id] = TRANSCRIBE_JOB_STATUS_NOT_START
+            else:
+                job_statuses[contact_id] = get_transcription_job_status(self.transcribe_client, contact_id)
+        with self.lock:
+            for job_name, status in job_statuses.items():
+                self.statuses[job_name] = (status, refresh_time)
+
+    def set_status(self, contact_id, status):
+        """
+        Update the status of a job changed by this process, e.g. a job just started
+
+        :param contact_id: contact id of the job
+        :param status: new status of the job
+        """
+        with self.lock:
+            self.statuses[contact_id] = (status, self.clock())
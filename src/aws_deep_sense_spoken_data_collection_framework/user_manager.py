@@ -1,15 +1,30 @@
 import os
+import csv
 import time
 import logging
-import boto3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
 import urllib.request
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+# selenium is only imported to open the Contact Center Portal
 import aws_deep_sense_spoken_data_collection_framework.utils as utils
+from aws_deep_sense_spoken_data_collection_framework.pin_allocator import PinAllocator, RESERVATION_ATTRIBUTE
+from aws_deep_sense_spoken_data_collection_framework.rate_limiter import TokenBucket, call_with_retry, \
+    CONNECT_API_RATE, CONNECT_API_BURST, DEFAULT_MAX_ATTEMPTS, DEFAULT_BACKOFF_SECONDS
 
 CHROME_DRIVER_URL = 'https://chromedriver.storage.googleapis.com/75.0.3770.140/chromedriver_mac64.zip'
 CHROME_DRIVER_NAME = 'chromedriver'
+# Attributes of a user shown when listing them
+USER_LIST_ATTRIBUTES = ['name', utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY, 'type', 'account']
+# Columns of the CSV file of the users created in bulk
+USER_CSV_COLUMNS = ['name', 'role', 'collection_pin']
+DEFAULT_USER_NAME = 'Default User Name'
+DEFAULT_BULK_CONCURRENCY = 8
+# Maximum number of keys of one BatchGetItem request, and of items of one BatchWriteItem request
+MAX_BATCH_GET_KEYS = 100
+MAX_BATCH_WRITE_ITEMS = 25
+# Number of Amazon Connect accounts deleted between two progress logs
+PROGRESS_LOG_INTERVAL = 50
 
 
 class UserManager:
@@ -37,10 +52,18 @@ class UserManager:
         self.CONNECT_PHONE_NUMBER = CONNECT_PHONE_NUMBER
         self.CONNECT_CCP_URL = CONNECT_CCP_URL
         self.config_path = config_path
+        self.num_digit_user_pin = 6
+        self.user_pin_allocator = PinAllocator(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME,
+                                               utils.USER_ACCOUNT_DYNAMODB_TABLE, utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY,
+                                               self.num_digit_user_pin)
 
-        self.dynamodb = boto3.resource('dynamodb', region_name=self.AWS_REGION_NAME,
-                                       aws_access_key_id=self.ACCESS_KEY_ID,
-                                       aws_secret_access_key=self.ACCESS_KEY)
+    @property
+    def dynamodb(self):
+        return utils.get_boto3_resource('dynamodb', self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME)
+
+    @property
+    def connect_client(self):
+        return utils.get_boto3_client('connect', self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME)
 
     def create_user(self):
         """
@@ -53,7 +76,7 @@ class UserManager:
 
         user_name = input('Please enter the name of the conversation role (blank for default name): ')
         if len(user_name) == 0:
-            user_name = 'Default User Name'
+            user_name = DEFAULT_USER_NAME
 
         role = ''
         PIN = ''
@@ -101,9 +124,9 @@ class UserManager:
         :return: [{collectionPIN: xx, collectionName: xx}, ...]
         """
         table = self.dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
-        collection_request_list = table.scan(ProjectionExpression='collectionPIN,collectionName',
-                                             FilterExpression=Attr('collectionStatus').ne('STOP') and Attr('mode').eq(
-                                                 'human'))['Items']
+        collection_request_list = list(utils.scan_table(
+            table, ['collectionPIN', 'collectionName'],
+            filter_expression=Attr('collectionStatus').ne('STOP') & Attr('mode').eq('human')))
         return collection_request_list
 
     def create_user_given_info(self, role, user_name, collection_pin):
@@ -153,6 +176,7 @@ class UserManager:
                                                     PIN)
         if 'error' in response:
             logging.error('Error: {}'.format(response['error']))
+            self.user_pin_allocator.release(PIN)
         else:
             # Get collection request name
             table = self.dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
@@ -163,17 +187,135 @@ class UserManager:
             self.save2db(name, PIN, role, account)
         return PIN, account
 
+    @staticmethod
+    def read_users_csv(csv_file):
+        """
+        Read the users to create in bulk from a CSV file with a header row: name,role,collection_pin
+        The collection PIN is only read for an agent
+
+        :param csv_file: opened CSV file, or any iterable of its lines
+        :return: [{'name': xx, 'role': xx, 'collection_pin': xx}, ...]
+        """
+        users = []
+        for row in csv.DictReader(csv_file):
+            users.append({column: (row.get(column) or '').strip() for column in USER_CSV_COLUMNS})
+        return users
+
+    def create_users_bulk(self, users, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        """
+        Create many users at once, e.g. the agents of a crowd
+        The collection requests of the agents are read by batches, the user PIN codes are reserved by batches,
+        the Amazon Connect accounts are created concurrently within the rate limit of Amazon Connect,
+        and the users are saved into AWS Dynamo DB by batches of 25 items.
+        A user which can not be created is reported, and does not stop the other ones.
+
+        :param users: [{'name': xx, 'role': customer | agent, 'collection_pin': xx}, ...], see read_users_csv
+        :param max_concurrency: maximum number of Amazon Connect accounts created at the same time
+        :return: one result per user, in order,
+                 [{'row': xx, 'name': xx, 'role': xx, 'collection_pin': xx, 'user_pin': xx, 'status': 'created' |
+                 'failed', 'error': xx}, ...]
+        """
+        report = [{'row': row, 'name': user.get('name') or DEFAULT_USER_NAME, 'role': user.get('role'),
+                   'collection_pin': user.get('collection_pin') if user.get('role') == 'agent' else None,
+                   'user_pin': None, 'status': 'failed', 'error': None}
+                  for row, user in enumerate(users, start=1)]
+        collection_requests = self.get_collection_requests(
+            {result['collection_pin'] for result in report if result['collection_pin']})
+        for result in report:
+            if result['role'] not in ('customer', 'agent'):
+                result['error'] = 'Error: Invalid role input.'
+            elif result['role'] == 'agent' and 'routingInfo' not in collection_requests.get(
+                    result['collection_pin'], {}):
+                result['error'] = 'Error: No collection request is found to associate the user account with.'
+        valid_results = [result for result in report if result['error'] is None]
+        for result, user_pin in zip(valid_results, self.user_pin_allocator.reserve_batch(len(valid_results))):
+            result['user_pin'] = user_pin
+
+        accounts = {result['row']: {} for result in valid_results if result['role'] == 'customer'}
+        token_bucket = TokenBucket(CONNECT_API_RATE, CONNECT_API_BURST)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {executor.submit(self.create_agent_account, result['user_pin'],
+                                       collection_requests[result['collection_pin']], token_bucket): result
+                       for result in valid_results if result['role'] == 'agent'}
+            for future in as_completed(futures):
+                result = futures[future]
+                try:
+                    accounts[result['row']] = future.result()
+                except Exception as e:
+                    result['error'] = 'Error: Failed to create user account on Amazon Connect: {}'.format(e)
+                    logging.error('{} (row {})'.format(result['error'], result['row']))
+                    self.user_pin_allocator.release(result['user_pin'])
+
+        # A user not saved is rolled back: its Amazon Connect account is deleted and its PIN code released
+        results = [result for result in valid_results if result['row'] in accounts]
+        for start in range(0, len(results), MAX_BATCH_WRITE_ITEMS):
+            chunk = results[start:start + MAX_BATCH_WRITE_ITEMS]
+            unprocessed_requests, error = self.batch_write_user_items([{'PutRequest': {'Item': {
+                'name': result['name'], 'PIN': result['user_pin'], 'type': result['role'],
+                'account': accounts[result['row']]}}} for result in chunk])
+            unsaved_pins = {request['PutRequest']['Item']['PIN'] for request in unprocessed_requests}
+            for result in chunk:
+                if result['user_pin'] not in unsaved_pins:
+                    result['status'] = 'created'
+                    continue
+                result['error'] = 'Error: Failed to save user information on AWS DynamoDB: {}'.format(error)
+                logging.error('{} (row {})'.format(result['error'], result['row']))
+                try:
+                    self.delete_agent_account({'account': accounts[result['row']]}, token_bucket)
+                except Exception as e:
+                    result['error'] += ' Failed to delete user account on Amazon Connect: {}'.format(e)
+                self.user_pin_allocator.release(result['user_pin'])
+        num_created = sum(result['status'] == 'created' for result in report)
+        logging.info('{} of {} users are created.'.format(num_created, len(report)))
+        return report
+
+    def get_collection_requests(self, collection_pins):
+        """
+        Read the collection requests the agents are associated with, by batches
+
+        :param collection_pins: collection request PIN codes
+        :return: {collectionPIN: {'collectionPIN': xx, 'collectionName': xx, 'routingInfo': xx}, ...}
+        """
+        collection_pins = list(collection_pins)
+        collection_requests = {}
+        for start in range(0, len(collection_pins), MAX_BATCH_GET_KEYS):
+            request_items = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE: {
+                'Keys': [{utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: str(collection_pin)}
+                         for collection_pin in collection_pins[start:start + MAX_BATCH_GET_KEYS]],
+                'ProjectionExpression': 'collectionPIN, collectionName, routingInfo'}}
+            while request_items:
+                response = self.dynamodb.batch_get_item(RequestItems=request_items)
+                for item in response['Responses'].get(utils.COLLECTION_REQUEST_DYNAMODB_TABLE, []):
+                    collection_requests[item[utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY]] = item
+                request_items = response.get('UnprocessedKeys')
+        return collection_requests
+
+    def create_agent_account(self, user_pin, collection_request, token_bucket=None):
+        """
+        Create the Amazon Connect account of an agent, the request is retried while it is throttled
+
+        :param user_pin: reserved 6-digit user PIN code
+        :param collection_request: collection request the agent is associated with, see get_collection_requests
+        :param token_bucket: token bucket shared by the requests to Amazon Connect
+        :return: account information of the agent
+        """
+        account = self.get_user_account(user_pin)
+        account['collectionPIN'] = collection_request[utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY]
+        response = call_with_retry(lambda: self.connect_create_user(
+            account['username'], account['password'], user_pin,
+            collection_request['routingInfo']['routingProfileID']), token_bucket)
+        account['collectionName'] = collection_request['collectionName']
+        account['userId'] = response['UserId']
+        return account
+
     def generate_user_pin(self):
         """
         Generate a unique 6-digit user PIN code for a customer or an agent
+        The PIN code is reserved in AWS Dynamo DB until the user is saved
 
         :return: generated 6-digit user PIN code
         """
-        num_digit = 6
-        PIN = utils.random_with_n_digits(num_digit)
-        while utils.is_user_pin_exists(self.ACCESS_KEY_ID, self.ACCESS_KEY, self.AWS_REGION_NAME, PIN):
-            PIN = utils.random_with_n_digits(num_digit)
-        return PIN
+        return self.user_pin_allocator.reserve()
 
     def save2db(self, name, user_pin, role, account):
         """
@@ -189,15 +331,27 @@ class UserManager:
             batch.put_item(Item=user_item)
         return
 
-    def list_all_user(self):
+    def iter_all_user(self, total_segments=1):
+        """
+        Stream all users page by page, with the listed attributes only
+
+        :param total_segments: number of segments of the table scanned in parallel
+        :return: generator of the users
+        """
+        table = self.dynamodb.Table('userAccount')
+        return utils.scan_table(table, USER_LIST_ATTRIBUTES, filter_expression=Attr(RESERVATION_ATTRIBUTE).not_exists(),
+                                total_segments=total_segments)
+
+    def list_all_user(self, total_segments=1):
         """
         List all users and their basic information
 
+        :param total_segments: number of segments of the table scanned in parallel
         """
         # Get all requests from the table
-        table = self.dynamodb.Table('userAccount')
-        user_list = table.scan()['Items']
-        for user in user_list:
+        user_list = []
+        for user in self.iter_all_user(total_segments):
+            user_list.append(user)
             name = user['name']
             PIN = user['PIN']
             role = user['type']
@@ -219,16 +373,25 @@ class UserManager:
         table = self.dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
         session = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: str(collection_pin)})
 
-        # Get parameters from session item
-        if 'Item' not in session:
+        # Get parameters from session item, a collection PIN only reserved has none
+        if 'Item' not in session or utils.PIN_RESERVATION_ATTRIBUTE in session['Item']:
             logging.error('Error: No collection request is found to associate the user account with.')
             return {'error': 'No collection request is found to associate the user account with.'}
 
         routing_profile_id = session['Item']['routingInfo']['routingProfileID']
-        connect = boto3.client('connect', region_name=self.AWS_REGION_NAME, aws_access_key_id=self.ACCESS_KEY_ID,
-                               aws_secret_access_key=self.ACCESS_KEY)
-        # Send request to Amazon Connect
-        response = connect.create_user(
+        return self.connect_create_user(username, password, PIN, routing_profile_id)
+
+    def connect_create_user(self, username, password, PIN, routing_profile_id):
+        """
+        Send the request creating a new user account to Amazon Connect
+
+        :param username: as named
+        :param password: as named
+        :param PIN: 6-digit user PIN code
+        :param routing_profile_id: routing profile of the queue of the collection request
+        :return: user account information sent from Amazon Connect, containing user account id
+        """
+        response = self.connect_client.create_user(
             Username=username,
             Password=password,
             IdentityInfo={
@@ -294,6 +457,9 @@ class UserManager:
         :param url: Amazon Connect URL
         :param user_account: user account information
         """
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
         # Default setting for the CCP popup window
         WINDOW_SIZE = "320,465"
         chrome_options = Options()
@@ -374,16 +540,116 @@ class UserManager:
             'Are you sure to delete all users? Y/N | ')
         if decision != 'Y' and decision != 'y':
             return
-        # Get all sessions from the table
-        table = self.dynamodb.Table('userAccount')
-        session_list = table.scan()['Items']
-        for item in session_list:
-            PIN = item[utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY]
-            self.delete_user_given_pin(PIN)
-            logging.info('User {} is deleted.'.format(PIN))
+        statistics = self.delete_users_bulk(self.iter_all_user())
+        for failure in statistics['failed']:
+            logging.error('User {} is not deleted, {}'.format(failure['PIN'], failure['error']))
+        if len(statistics['failed']) == 0:
+            logging.info('All users are deleted.')
+        return statistics
+
+    def delete_users_bulk(self, users, max_concurrency=DEFAULT_BULK_CONCURRENCY):
+        """
+        Delete many users at once, given their items so that none of them is read again
+        The Amazon Connect accounts of the agents are deleted concurrently within the rate limit of Amazon Connect,
+        then the users are deleted from AWS Dynamo DB by batches of 25 items.
+        An agent whose Amazon Connect account can not be deleted is kept in AWS Dynamo DB, to delete it later.
+
+        :param users: user items with their PIN, type and account, e.g. iter_all_user()
+        :param max_concurrency: maximum number of Amazon Connect accounts deleted at the same time
+        :return: {'deleted': number of users deleted, 'failed': [{'PIN': xx, 'error': xx}, ...]}
+        """
+        users = list(users)
+        agents = [user for user in users if user.get('type') == 'agent']
+        deletable_pins = [user[utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY] for user in users if user.get('type') != 'agent']
+        failures = []
+        token_bucket = TokenBucket(CONNECT_API_RATE, CONNECT_API_BURST)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {executor.submit(self.delete_agent_account, agent, token_bucket): agent for agent in agents}
+            for num_done, future in enumerate(as_completed(futures), start=1):
+                user_pin = futures[future][utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY]
+                try:
+                    future.result()
+                    deletable_pins.append(user_pin)
+                except Exception as e:
+                    failures.append({'PIN': user_pin,
+                                     'error': 'Error: Failed to delete user account on Amazon Connect: {}'.format(e)})
+                if num_done % PROGRESS_LOG_INTERVAL == 0 or num_done == len(agents):
+                    logging.info('Amazon Connect accounts: {}/{} processed, {} failed.'.format(
+                        num_done, len(agents), len(failures)))
+
+        num_deleted = 0
+        for start in range(0, len(deletable_pins), MAX_BATCH_WRITE_ITEMS):
+            chunk = deletable_pins[start:start + MAX_BATCH_WRITE_ITEMS]
+            try:
+                self.delete_user_items(chunk)
+                num_deleted += len(chunk)
+            except Exception as e:
+                failures.extend({'PIN': user_pin,
+                                 'error': 'Error: Failed to delete user information on AWS DynamoDB: {}'.format(e)}
+                                for user_pin in chunk)
+            logging.info('Users: {}/{} deleted.'.format(num_deleted, len(users)))
+        return {'deleted': num_deleted, 'failed': failures}
 
-        logging.info('All users are deleted.')
-        return
+    def delete_agent_account(self, agent, token_bucket=None):
+        """
+        Delete the Amazon Connect account of an agent, the request is retried while it is throttled
+        An account which does not exist anymore is considered as deleted
+
+        :param agent: user item of the agent
+        :param token_bucket: token bucket shared by the requests to Amazon Connect
+        """
+        user_id = agent.get('account', {}).get('userId')
+        if user_id is None:  # The account was never created on Amazon Connect
+            return
+        try:
+            call_with_retry(lambda: self.connect_delete_user(user_id), token_bucket)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+
+    def delete_user_items(self, user_pins):
+        """
+        Delete up to 25 users from AWS Dynamo DB by one batch write, the unprocessed items are sent again
+
+        :param user_pins: 6-digit user PIN codes
+        """
+        _, error = self.batch_write_user_items([{'DeleteRequest': {'Key': {
+            utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: user_pin}}} for user_pin in user_pins])
+        if error is not None:
+            raise error
+
+    def batch_write_user_items(self, write_requests):
+        """
+        Write up to 25 user items by one batch write, the unprocessed items are sent again
+
+        :param write_requests: PutRequest or DeleteRequest of every item
+        :return: (requests not processed, error), ([], None) if every request is processed
+        """
+        request_items = {utils.USER_ACCOUNT_DYNAMODB_TABLE: write_requests}
+        try:
+            for attempt in range(DEFAULT_MAX_ATTEMPTS):
+                response = call_with_retry(lambda: self.dynamodb.batch_write_item(RequestItems=request_items))
+                if not response.get('UnprocessedItems'):
+                    return [], None
+                request_items = response['UnprocessedItems']
+                time.sleep(DEFAULT_BACKOFF_SECONDS * 2 ** attempt)
+            error = RuntimeError('{} items are still unprocessed.'.format(len(request_items[
+                utils.USER_ACCOUNT_DYNAMODB_TABLE])))
+        except Exception as e:
+            # Rejected, e.g. a validation error, or still throttled, none of the requests sent is processed
+            error = e
+        return request_items[utils.USER_ACCOUNT_DYNAMODB_TABLE], error
+
+    def connect_delete_user(self, user_id):
+        """
+        Send the request deleting a user account to Amazon Connect
+
+        :param user_id: user account id on Amazon Connect
+        """
+        self.connect_client.delete_user(
+            InstanceId=self.CONNECT_INSTANCE_ID,
+            UserId=user_id
+        )
 
     def delete_user_given_pin(self, user_pin):
         """
@@ -407,13 +673,7 @@ class UserManager:
             if role == 'agent':
                 try:
                     user_id = session['Item']['account']['userId']
-                    connect = boto3.client('connect', region_name=self.AWS_REGION_NAME,
-                                           aws_access_key_id=self.ACCESS_KEY_ID,
-                                           aws_secret_access_key=self.ACCESS_KEY)
-                    connect.delete_user(
-                        InstanceId=self.CONNECT_INSTANCE_ID,
-                        UserId=user_id
-                    )
+                    self.connect_delete_user(user_id)
                 except:
                     error_message = 'Error: Failed to delete user account on Amazon Connect'
                     logging.error(error_message)
@@ -3,7 +3,11 @@
 
 import boto3
 from boto3.dynamodb.conditions import Key
+from botocore.config import Config
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from random import randint
 from zipfile import ZipFile, ZipInfo
 
@@ -20,8 +24,34 @@ COLLECTION_REQUEST_DYNAMODB_TABLE = 'collectionSession'
 COLLECTION_REQUEST_DYNAMODB_TABLE_KEY = 'collectionPIN'
 COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX = 'conversationPIN-index'
 COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY = 'conversationPIN'
+COLLECTION_CONTACT_DYNAMODB_TABLE = 'collectionContact'
+COLLECTION_CONTACT_DYNAMODB_TABLE_KEY = 'collectionPIN'
+# Time of the contact followed by its id, so that the contacts of a collection request are sorted by time
+COLLECTION_CONTACT_DYNAMODB_TABLE_SORT_KEY = 'contactTimestamp'
+COLLECTION_CONTACT_ID_ATTRIBUTE = 'contactId'
+COLLECTION_CONTACT_TIME_FORMAT = '%Y%m%dT%H%M%S%fZ'
+QUEUE_POOL_DYNAMODB_TABLE = 'connectQueuePool'
+QUEUE_POOL_DYNAMODB_TABLE_KEY = 'queueNumber'
 USER_ACCOUNT_DYNAMODB_TABLE = 'userAccount'
 USER_ACCOUNT_DYNAMODB_TABLE_KEY = 'PIN'
+# Attribute of the items which only reserve a PIN code, see PinAllocator
+PIN_RESERVATION_ATTRIBUTE = 'reservedAt'
+
+# Maximum number of connections kept in the connection pool of every shared AWS client
+MAX_POOL_CONNECTIONS = 32
+
+# Parsed configuration files, keyed by path, along with their modification time
+_config_cache_lock = threading.Lock()
+_config_cache = {}
+
+# Registry of AWS sessions and clients shared by the whole process, keyed by (service, region, credentials)
+_boto3_registry_lock = threading.Lock()
+_boto3_sessions = {}
+_boto3_clients = {}
+# AWS resources are not thread-safe, so they are shared per thread only
+_boto3_thread_local = threading.local()
+# Bumped to drop the resources of every thread, each thread drops its own ones when it gets a resource next time
+_boto3_resources_generation = 0
 
 
 def parse_config(config_file):
@@ -39,6 +69,24 @@ def parse_config(config_file):
     return config_dict
 
 
+def get_config(config_file):
+    """
+    Parse the aws_config file once, the parsed configuration is cached until the file is modified
+
+    :param config_file: path for configuration file
+    :return: information dict in the configuration file, shared by all callers
+    """
+    config_path = os.path.abspath(config_file)
+    modified_time = os.stat(config_path).st_mtime_ns
+    with _config_cache_lock:
+        if config_path in _config_cache and _config_cache[config_path][0] == modified_time:
+            return _config_cache[config_path][1]
+    config_dict = parse_config(config_path)
+    with _config_cache_lock:
+        _config_cache[config_path] = (modified_time, config_dict)
+    return config_dict
+
+
 def get_aws_access_key(config_file):
     """
     Parse the AWS Access Key from aws_config file
@@ -46,7 +94,7 @@ def get_aws_access_key(config_file):
     :param config_file: path for configuration file
     :return: Access credentials for AWS account
     """
-    config_dict = parse_config(config_file)
+    config_dict = get_config(config_file)
     ACCESS_KEY_ID = config_dict[ACCESS_KEY_ID__CONFIG_KEY]
     ACCESS_KEY = config_dict[ACCESS_KEY__CONFIG_KEY]
     return ACCESS_KEY_ID, ACCESS_KEY
@@ -59,7 +107,7 @@ def get_call_recordings_bucket_name(config_file):
     :param config_file: path for configuration file
     :return: AWS S3 bucket names for storing the call recordings
     """
-    config_dict = parse_config(config_file)
+    config_dict = get_config(config_file)
     CALL_RECORDINGS_BUCKET_NAME = config_dict[CALL_RECORDINGS_BUCKET_NAME__CONFIG_KEY]
 
     return CALL_RECORDINGS_BUCKET_NAME
@@ -72,7 +120,7 @@ def get_connect_info(config_file):
     :param config_file: path for configuration file
     :return: AWS Connect parameters
     """
-    config_dict = parse_config(config_file)
+    config_dict = get_config(config_file)
     CONNECT_INSTANCE_ID = config_dict[CONNECT_INSTANCE_ID__CONFIG_KEY]
     CONNECT_SECURITY_ID = config_dict[CONNECT_SECURITY_ID__CONFIG_KEY]
     CONNECT_PHONE_NUMBER = config_dict[CONNECT_PHONE_NUMBER__CONFIG_KEY]
@@ -87,11 +135,174 @@ def get_aws_region_name(config_file):
     :param config_file: path for configuration file
     :return: AWS Region name
     """
-    config_dict = parse_config(config_file)
+    config_dict = get_config(config_file)
     AWS_REGION_NAME = config_dict[AWS_REGION_NAME__CONFIG_KEY]
     return AWS_REGION_NAME
 
 
+def set_max_pool_connections(max_pool_connections):
+    """
+    Tune the connection pool size of the shared AWS clients
+    Clients and resources created before are dropped, so that the new size applies to all of them,
+    the resources of the other threads are dropped by the threads themselves when they get a resource next time
+
+    :param max_pool_connections: maximum number of connections kept in the pool of every client
+    """
+    global MAX_POOL_CONNECTIONS, _boto3_resources_generation
+    with _boto3_registry_lock:
+        MAX_POOL_CONNECTIONS = max_pool_connections
+        _boto3_sessions.clear()
+        _boto3_clients.clear()
+        _boto3_resources_generation += 1
+
+
+def get_boto3_session(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME):
+    """
+    Get the shared AWS session of given credentials, create one if not exists
+
+    :param ACCESS_KEY_ID: Access credential key id for AWS account
+    :param ACCESS_KEY: Access Credential key for AWS account
+    :param AWS_REGION_NAME: Region name for AWS services
+    :return: boto3 session
+    """
+    session_key = (AWS_REGION_NAME, ACCESS_KEY_ID, ACCESS_KEY)
+    with _boto3_registry_lock:
+        if session_key not in _boto3_sessions:
+            _boto3_sessions[session_key] = boto3.session.Session(aws_access_key_id=ACCESS_KEY_ID,
+                                                                 aws_secret_access_key=ACCESS_KEY,
+                                                                 region_name=AWS_REGION_NAME)
+        return _boto3_sessions[session_key]
+
+
+def get_boto3_client(service_name, ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME):
+    """
+    Get the shared AWS client of a service, create one if not exists
+    AWS clients are thread-safe, the same client is returned to every thread
+
+    :param service_name: AWS service name, e.g. 's3'
+    :param ACCESS_KEY_ID: Access credential key id for AWS account
+    :param ACCESS_KEY: Access Credential key for AWS account
+    :param AWS_REGION_NAME: Region name for AWS services
+    :return: boto3 client
+    """
+    client_key = (service_name, AWS_REGION_NAME, ACCESS_KEY_ID, ACCESS_KEY)
+    client = _boto3_clients.get(client_key)
+    if client is None:
+        session = get_boto3_session(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+        with _boto3_registry_lock:
+            if client_key not in _boto3_clients:
+                _boto3_clients[client_key] = session.client(
+                    service_name, config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
+            client = _boto3_clients[client_key]
+    return client
+
+
+def get_boto3_resource(service_name, ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME):
+    """
+    Get the shared AWS resource of a service for the current thread, create one if not exists
+
+    :param service_name: AWS service name, e.g. 'dynamodb'
+    :param ACCESS_KEY_ID: Access credential key id for AWS account
+    :param ACCESS_KEY: Access Credential key for AWS account
+    :param AWS_REGION_NAME: Region name for AWS services
+    :return: boto3 resource
+    """
+    resource_key = (service_name, AWS_REGION_NAME, ACCESS_KEY_ID, ACCESS_KEY)
+    if getattr(_boto3_thread_local, 'generation', None) != _boto3_resources_generation:
+        _boto3_thread_local.generation = _boto3_resources_generation
+        _boto3_thread_local.resources = {}
+    resources = _boto3_thread_local.resources
+    if resource_key not in resources:
+        session = get_boto3_session(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+        with _boto3_registry_lock:
+            resources[resource_key] = session.resource(
+                service_name, config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
+    return resources[resource_key]
+
+
+def scan_table(table, attribute_names=None, filter_expression=None, total_segments=1, page_size=None):
+    """
+    Scan all items of an AWS Dynamo DB table page by page, as a generator, so that memory is bounded by a few pages
+    With several segments, the segments are scanned in parallel and their pages are yielded as they arrive
+
+    :param table: boto3 Dynamo DB table
+    :param attribute_names: names of the attributes to return, all attributes if None
+    :param filter_expression: boto3 condition that the returned items match, e.g. Attr('mode').eq('human')
+    :param total_segments: number of segments scanned in parallel
+    :param page_size: maximum number of items evaluated per request
+    :return: generator of the items
+    """
+    scan_kwargs = {'TableName': table.name}
+    if attribute_names:
+        expression_attribute_names = {'#attr{}'.format(i): name for i, name in enumerate(attribute_names)}
+        scan_kwargs['ProjectionExpression'] = ','.join(expression_attribute_names)
+        scan_kwargs['ExpressionAttributeNames'] = expression_attribute_names
+    if filter_expression is not None:
+        scan_kwargs['FilterExpression'] = filter_expression
+    if page_size:
+        scan_kwargs['Limit'] = page_size
+    # The client of a resource is thread-safe, and converts the items to Python types as the resource does
+    client = table.meta.client
+
+    def scan_segment_pages(segment):
+        segment_kwargs = dict(scan_kwargs)
+        if total_segments > 1:
+            segment_kwargs.update(Segment=segment, TotalSegments=total_segments)
+        while True:
+            response = client.scan(**segment_kwargs)
+            yield response['Items']
+            if 'LastEvaluatedKey' not in response:
+                return
+            segment_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    if total_segments <= 1:
+        for items in scan_segment_pages(0):
+            yield from items
+        return
+
+    # A bounded queue of pages keeps the segment threads at most a few pages ahead of the consumer
+    pages = queue.Queue(maxsize=total_segments * 2)
+    stop_event = threading.Event()
+    end_of_segment = object()
+
+    def put(page):
+        while not stop_event.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def scan_segment(segment):
+        try:
+            for items in scan_segment_pages(segment):
+                if not put(items):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(end_of_segment)
+
+    executor = ThreadPoolExecutor(max_workers=total_segments)
+    try:
+        for segment in range(total_segments):
+            executor.submit(scan_segment, segment)
+        num_segments_left = total_segments
+        while num_segments_left:
+            page = pages.get()
+            if page is end_of_segment:
+                num_segments_left -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        # Also stops the segment threads if the consumer stops early
+        stop_event.set()
+        executor.shutdown(wait=True)
+
+
 def random_with_n_digits(n):
     """
     Generate a digit code randomly
@@ -146,13 +357,12 @@ def is_collection_pin_exists(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, PIN):
     :param ACCESS_KEY: Access Credential key for AWS account
     :param AWS_REGION_NAME: Region name for AWS services
     :param PIN: user-input collection PIN code
-    :return: boolean indicating if the user-input collection PIN code exists
+    :return: boolean indicating if the user-input collection PIN code exists, a PIN code only reserved does not
     """
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION_NAME, aws_access_key_id=ACCESS_KEY_ID,
-                              aws_secret_access_key=ACCESS_KEY)
+    dynamodb = get_boto3_resource('dynamodb', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
     table = dynamodb.Table(COLLECTION_REQUEST_DYNAMODB_TABLE)
     session = table.get_item(Key={COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: str(PIN)})
-    is_exists = 'Item' in session
+    is_exists = 'Item' in session and PIN_RESERVATION_ATTRIBUTE not in session['Item']
     return is_exists
 
 
@@ -166,8 +376,7 @@ def is_conversation_pin_exists(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, PIN):
     :param PIN: user-input conversation PIN code
     :return: boolean indicating if the user-input conversation PIN code exists
     """
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION_NAME, aws_access_key_id=ACCESS_KEY_ID,
-                              aws_secret_access_key=ACCESS_KEY)
+    dynamodb = get_boto3_resource('dynamodb', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
     table = dynamodb.Table(COLLECTION_REQUEST_DYNAMODB_TABLE)
     resp = table.query(
         # Add the name of the index you want to use in your query.
@@ -186,16 +395,86 @@ def is_user_pin_exists(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, PIN):
     :param ACCESS_KEY: Access Credential key for AWS account
     :param AWS_REGION_NAME: Region name for AWS services
     :param PIN: user-input user PIN code
-    :return: boolean indicating if the user-input user PIN code exists
+    :return: boolean indicating if the user-input user PIN code exists, a PIN code only reserved does not
     """
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION_NAME, aws_access_key_id=ACCESS_KEY_ID,
-                              aws_secret_access_key=ACCESS_KEY)
+    dynamodb = get_boto3_resource('dynamodb', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
     table = dynamodb.Table(USER_ACCOUNT_DYNAMODB_TABLE)
     session = table.get_item(Key={USER_ACCOUNT_DYNAMODB_TABLE_KEY: str(PIN)})
-    is_exists = 'Item' in session
+    is_exists = 'Item' in session and PIN_RESERVATION_ATTRIBUTE not in session['Item']
     return is_exists
 
 
+def get_contact_sort_key(contact_time, contact_id):
+    """
+    :param contact_time: datetime of the contact
+    :param contact_id: contact id
+    :return: sort key of the contact in the contact table
+    """
+    return '{}_{}'.format(contact_time.strftime(COLLECTION_CONTACT_TIME_FORMAT), contact_id)
+
+
+def query_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, collection_pin, page_size=None, start_key=None):
+    """
+    Query one page of the contact ids of a collection request from the contact table, in the order of the contacts
+
+    :param ACCESS_KEY_ID: Access credential key id for AWS account
+    :param ACCESS_KEY: Access Credential key for AWS account
+    :param AWS_REGION_NAME: Region name for AWS services
+    :param collection_pin: user-input collection PIN code
+    :param page_size: maximum number of contact ids of the page, None for a page of up to 1 MB
+    :param start_key: sort key of the last contact of the previous page, None for the first page
+    :return: contact ids of the page, sort key to start the next page from (None after the last page)
+    """
+    dynamodb = get_boto3_resource('dynamodb', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+    table = dynamodb.Table(COLLECTION_CONTACT_DYNAMODB_TABLE)
+    query_kwargs = {'KeyConditionExpression': Key(COLLECTION_CONTACT_DYNAMODB_TABLE_KEY).eq(str(collection_pin)),
+                    'ProjectionExpression': COLLECTION_CONTACT_ID_ATTRIBUTE}
+    if page_size is not None:
+        query_kwargs['Limit'] = page_size
+    if start_key is not None:
+        query_kwargs['ExclusiveStartKey'] = {COLLECTION_CONTACT_DYNAMODB_TABLE_KEY: str(collection_pin),
+                                             COLLECTION_CONTACT_DYNAMODB_TABLE_SORT_KEY: start_key}
+    response = table.query(**query_kwargs)
+    next_key = response.get('LastEvaluatedKey', {}).get(COLLECTION_CONTACT_DYNAMODB_TABLE_SORT_KEY)
+    return [item[COLLECTION_CONTACT_ID_ATTRIBUTE] for item in response['Items']], next_key
+
+
+def iter_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, collection_pin):
+    """
+    Stream the contact ids of a collection request from the contact table page by page
+
+    :param ACCESS_KEY_ID: Access credential key id for AWS account
+    :param ACCESS_KEY: Access Credential key for AWS account
+    :param AWS_REGION_NAME: Region name for AWS services
+    :param collection_pin: user-input collection PIN code
+    :return: generator of the contact ids, in the order of the contacts
+    """
+    start_key = None
+    while True:
+        contact_ids, start_key = query_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, collection_pin,
+                                                   start_key=start_key)
+        yield from contact_ids
+        if start_key is None:
+            return
+
+
+def get_legacy_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, collection_pin):
+    """
+    Get the contact ids still kept in the collection request item, by a collection request not migrated yet
+
+    :param ACCESS_KEY_ID: Access credential key id for AWS account
+    :param ACCESS_KEY: Access Credential key for AWS account
+    :param AWS_REGION_NAME: Region name for AWS services
+    :param collection_pin: user-input collection PIN code
+    :return: contact ids of the collection request item, empty if it has none
+    """
+    dynamodb = get_boto3_resource('dynamodb', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+    table = dynamodb.Table(COLLECTION_REQUEST_DYNAMODB_TABLE)
+    session = table.get_item(Key={COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: str(collection_pin)},
+                             ProjectionExpression='contactIDs')
+    return session.get('Item', {}).get('contactIDs', [])
+
+
 def get_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, collection_pin):
     """
     Get all contact ids from given PIN code
@@ -206,13 +485,8 @@ def get_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, collection_pin):
     :param collection_pin: user-input collection PIN code
     :return: All contact ids associated with this collection request
     """
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION_NAME, aws_access_key_id=ACCESS_KEY_ID,
-                              aws_secret_access_key=ACCESS_KEY)
-    table = dynamodb.Table(COLLECTION_REQUEST_DYNAMODB_TABLE)
-    session = table.get_item(Key={COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: str(collection_pin)})
-    list_ids = []
-    if 'Item' in session:
-        list_ids = session['Item']['contactIDs']
+    list_ids = get_legacy_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, collection_pin)
+    list_ids.extend(iter_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, collection_pin))
     return list_ids
 
 
@@ -226,8 +500,7 @@ def check_collection_request_mode(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, co
     :param collection_pin: user-input collection PIN code
     :return: Human/Human collection mode (return 'human') | Human/Bot collection mode (return 'bot') | (return 'none')
     """
-    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION_NAME, aws_access_key_id=ACCESS_KEY_ID,
-                              aws_secret_access_key=ACCESS_KEY)
+    dynamodb = get_boto3_resource('dynamodb', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
     table = dynamodb.Table(COLLECTION_REQUEST_DYNAMODB_TABLE)
     session = table.get_item(Key={COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: str(collection_pin)})
     mode = 'none'
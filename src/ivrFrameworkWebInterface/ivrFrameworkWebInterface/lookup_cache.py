@@ -0,0 +1,112 @@
+# lookup_cache.py: Cache the lookups rendered by the views (users, collection requests, bots, queues) in the Django
+#                  cache, and fetch the missing ones concurrently
+
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+
+LOOKUP_KEY_PREFIX = 'lookup'
+DEFAULT_LOOKUP_TIMEOUT_SECONDS = 30
+DEFAULT_LOOKUP_MAX_WORKERS = 5
+
+
+class LookupCache:
+    """
+    Cache the results of registered lookups, each one is a function without argument scanning AWS Dynamo DB.
+    The lookups missing from the cache are fetched concurrently, as they are independent of each other.
+    A lookup is invalidated by the writes made through the managers, and expires after a timeout anyway,
+    since the lambda functions write to the same tables.
+    Every lookup has a version, bumped by an invalidation, which is part of its cache key,
+    so that a result fetched before a write is never read after it.
+
+    :param timeout: seconds a lookup is cached, settings.LOOKUP_CACHE_TIMEOUT by default
+    :param max_workers: maximum number of lookups fetched at the same time
+    """
+
+    def __init__(self, timeout=None, max_workers=DEFAULT_LOOKUP_MAX_WORKERS):
+        self.timeout = getattr(settings, 'LOOKUP_CACHE_TIMEOUT', DEFAULT_LOOKUP_TIMEOUT_SECONDS) \
+            if timeout is None else timeout
+        self.lookups = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def register(self, name, function):
+        """
+        :param name: lookup name
+        :param function: function without argument returning the result of the lookup
+        """
+        self.lookups[name] = function
+
+    @staticmethod
+    def get_version_key(name):
+        return '{}:{}:version'.format(LOOKUP_KEY_PREFIX, name)
+
+    def get_keys(self, names):
+        """
+        :param names: lookup names
+        :return: {name: cache key of the current version of the lookup}
+        """
+        versions = cache.get_many([self.get_version_key(name) for name in names])
+        return {name: '{}:{}:{}'.format(LOOKUP_KEY_PREFIX, name, versions.get(self.get_version_key(name), 0))
+                for name in names}
+
+    def invalidate(self, *names):
+        """
+        :param names: names of the lookups whose data are changed
+        """
+        for name in names:
+            version_key = self.get_version_key(name)
+            cache.add(version_key, 0, timeout=None)
+            try:
+                cache.incr(version_key)
+            except ValueError:  # Evicted meanwhile
+                cache.set(version_key, 1, timeout=None)
+
+    def invalidate_after_writes(self, manager, method_names, names):
+        """
+        Invalidate lookups after every call of the write methods of a manager, whichever view calls them
+
+        :param manager: manager instance used by the views
+        :param method_names: names of the methods of the manager writing data
+        :param names: names of the lookups reading these data
+        """
+        for method_name in method_names:
+            method = getattr(manager, method_name)
+
+            @functools.wraps(method)
+            def write(*args, method=method, **kwargs):
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    self.invalidate(*names)
+
+            setattr(manager, method_name, write)
+
+    def fetch(self, name):
+        start_time = time.monotonic()
+        return self.lookups[name](), time.monotonic() - start_time
+
+    def get_many(self, names, request=None):
+        """
+        Get the results of lookups, from the cache, or fetched concurrently and cached
+
+        :param names: lookup names
+        :param request: request of the view, the duration of every lookup is added to request.lookup_timings
+        :return: {name: result of the lookup}
+        """
+        start_time = time.monotonic()
+        keys = self.get_keys(names)
+        cached_results = cache.get_many(list(keys.values()))
+        results = {name: cached_results[key] for name, key in keys.items() if key in cached_results}
+        timings = {name: ('hit', time.monotonic() - start_time) for name in results}
+
+        futures = {name: self.executor.submit(self.fetch, name) for name in names if name not in results}
+        for name, future in futures.items():
+            results[name], duration = future.result()
+            timings[name] = ('miss', duration)
+        cache.set_many({keys[name]: results[name] for name in futures}, timeout=self.timeout)
+
+        if request is not None:
+            request.lookup_timings = dict(getattr(request, 'lookup_timings', {}), **timings)
+        return results
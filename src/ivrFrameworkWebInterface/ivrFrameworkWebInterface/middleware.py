@@ -0,0 +1,26 @@
+# middleware.py: Expose the duration of every view, and of the lookups it made, in a Server-Timing header
+
+import time
+from django.conf import settings
+
+
+class ViewTimingMiddleware:
+    """
+    Add a Server-Timing header in debug mode, shown by the network panel of the browser, e.g.
+    Server-Timing: view;dur=120.5, user_list;dur=80.2;desc="miss", collection_request_options;dur=0.4;desc="hit"
+    The lookups are the ones made through the LookupCache, which records them on the request
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DEBUG:
+            return self.get_response(request)
+        start_time = time.monotonic()
+        response = self.get_response(request)
+        timings = ['view;dur={:.1f}'.format((time.monotonic() - start_time) * 1000)]
+        for name, (cache_status, duration) in getattr(request, 'lookup_timings', {}).items():
+            timings.append('{};dur={:.1f};desc="{}"'.format(name, duration * 1000, cache_status))
+        response['Server-Timing'] = ', '.join(timings)
+        return response
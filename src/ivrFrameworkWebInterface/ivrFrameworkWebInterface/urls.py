@@ -10,7 +10,9 @@ urlpatterns = [
     path('userManage', views.user_manage_action, name='userManage'),
     path('collectionRequest', views.collection_request_action, name='collectionRequest'),
     path('downloadCallRecordings', views.download_call_recordings, name='downloadCallRecordings'),
+    path('streamCallRecordings/<str:collection_pin>', views.stream_call_recordings, name='streamCallRecordings'),
     path('transcribeJobRequest', views.transcribe_job_request, name='transcribeJobRequest'),
+    path('transcribeStatus/<str:collection_pin>', views.transcribe_status, name='transcribeStatus'),
     path('about', views.about_action, name='about'),
     path('changeCollectionStatus', views.change_collection_status, name='changeCollectionStatus'),
 ]
@@ -1,8 +1,9 @@
-import sys, os, re, json, boto3
+import sys, os, re, json
 
 sys.path.insert(0, os.path.join('..'))
 
 from django.shortcuts import render, redirect, get_object_or_404, HttpResponse, HttpResponseRedirect, Http404
+from django.http import StreamingHttpResponse, JsonResponse
 from django.urls import reverse
 
 from django.contrib.auth.decorators import login_required
@@ -11,11 +12,17 @@ from django.contrib.auth import authenticate, login, logout
 from django.utils.encoding import smart_str
 from ivrFrameworkWebInterface.forms import *
 from ivrFrameworkWebInterface.models import *
+from ivrFrameworkWebInterface.lookup_cache import LookupCache
 
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
 from zipfile import ZipFile
+from botocore.exceptions import ClientError
 from aws_deep_sense_spoken_data_collection_framework import call_recordings_manager, collection_request_manager, \
     user_manager, utils
+from aws_deep_sense_spoken_data_collection_framework.streaming_zip import parse_range_header
+from aws_deep_sense_spoken_data_collection_framework.call_recordings_manager import TRANSCRIBE_JOB_STATUS_NOT_START, \
+    TRANSCRIBE_JOB_STATUS_IN_PROGRESS, TRANSCRIBE_JOB_STATUS_COMPLETED, TRANSCRIBE_JOB_STATUS_FAILED
+from aws_deep_sense_spoken_data_collection_framework.transcription_orchestrator import TranscribeStatusResolver
 
 # Change to your desired configuration file
 config_path = os.path.join('..', '..', 'configurations', 'aws_config_isengard')
@@ -34,6 +41,25 @@ collection_request_manager = collection_request_manager.CollectionRequestManager
                                                                                  CALL_RECORDINGS_BUCKET_NAME)
 call_recordings_manager = call_recordings_manager.CallRecordingsManager(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME,
                                                                         CALL_RECORDINGS_BUCKET_NAME)
+transcribe_status_resolver = TranscribeStatusResolver(call_recordings_manager.transcribe_client)
+
+# Lookups rendered by the views, cached and fetched concurrently, and invalidated by the writes of the managers
+lookup_cache = LookupCache()
+lookup_cache.register('collection_request_options', user_manager.list_collection_request_option)
+lookup_cache.register('user_list', user_manager.list_all_user)
+lookup_cache.register('bot_list', collection_request_manager.get_available_collection_bot)
+lookup_cache.register('collection_request_list', collection_request_manager.list_collect_requests)
+lookup_cache.register('num_available_queue', collection_request_manager.get_num_available_queue)
+lookup_cache.invalidate_after_writes(user_manager, ['create_user_given_info', 'create_users_bulk',
+                                                    'delete_user_given_pin', 'delete_users_bulk'], ['user_list'])
+lookup_cache.invalidate_after_writes(collection_request_manager, ['generate_collection_request_given_info',
+                                                                  'change_collection_status_given_info'],
+                                     ['collection_request_options', 'collection_request_list', 'num_available_queue'])
+
+# Status shown while the transcribe job status is not known yet, the page polls for it
+TRANSCRIBE_STATUS_LOADING = 'LOADING'
+# Number of conversations shown on one page of the collection request details
+CONTACT_IDS_PAGE_SIZE = 100
 
 
 def login_action(request):
@@ -114,6 +140,9 @@ def user_manage_action(request):
                     response_list['new_user_name'] = name
             else:
                 error_list.append('Invalid user role input.')
+        if 'new_users_csv' in request.FILES:
+            users = user_manager.read_users_csv(TextIOWrapper(request.FILES['new_users_csv'], encoding='utf-8'))
+            response_list['new_users_report'] = user_manager.create_users_bulk(users)
         if 'delete_user_pin' in request.POST:
             user_pin = request.POST['delete_user_pin']
             delete_error_list = user_manager.delete_user_given_pin(user_pin)
@@ -126,8 +155,9 @@ def user_manage_action(request):
         context['error_list'] = error_list
         context['response_list'] = response_list
 
-    context['collection_request_list'] = user_manager.list_collection_request_option()
-    context['user_list'] = user_manager.list_all_user()
+    lookups = lookup_cache.get_many(['collection_request_options', 'user_list'], request)
+    context['collection_request_list'] = lookups['collection_request_options']
+    context['user_list'] = lookups['user_list']
     context['amazon_connect_phone_number'] = user_manager.get_phone_number()
     context['amazon_connect_ccp_link'] = user_manager.get_URL()
     return render(request, 'ivrFrameworkWebInterface/user_manage.html', context)
@@ -187,24 +217,29 @@ def collection_request_action(request):
                 context['new_collection_request'] = new_collection_request
         elif 'get_collection_pin' in request.POST:
             collection_pin = request.POST['get_collection_pin']
-            get_collection_pin_response = collection_request_manager.get_collection_request_given_pin(collection_pin)
-            transcribe = boto3.client('transcribe', aws_access_key_id=ACCESS_KEY_ID,
-                                      aws_secret_access_key=ACCESS_KEY)
-            contact_ids = get_collection_pin_response['contact_ids']
-            contact_ids_transcribe_status = {}
-            for contact_id in contact_ids:
-                transcribe_status = call_recordings_manager.check_transcribe_given_contact_id(transcribe, contact_id)
-                contact_ids_transcribe_status[contact_id] = transcribe_status
-            if len(contact_ids) == 0:
-                get_collection_pin_response['contact_ids'] = {}
-            else:
+            # The conversations are shown page by page, the next page starts after the last contact shown
+            contact_start_key = request.POST.get('contact_start_key') or None
+            contact_offset = parse_positive_int_without_exception(request.POST.get('contact_offset', '0'))
+            get_collection_pin_response = collection_request_manager.get_collection_request_given_pin(
+                collection_pin, CONTACT_IDS_PAGE_SIZE, contact_start_key)
+            if 'error' not in get_collection_pin_response:
+                get_collection_pin_response['contact_start_key'] = contact_start_key
+                get_collection_pin_response['contact_offset'] = max(contact_offset, 0)
+                get_collection_pin_response['next_contact_offset'] = max(contact_offset, 0) + len(
+                    get_collection_pin_response['contact_ids'])
+                # Render the cached statuses only, the page polls transcribeStatus for the others
+                contact_ids = get_collection_pin_response['contact_ids']
+                contact_ids_transcribe_status = transcribe_status_resolver.get_cached_statuses(contact_ids)
+                for contact_id, transcribe_status in contact_ids_transcribe_status.items():
+                    if transcribe_status is None:
+                        contact_ids_transcribe_status[contact_id] = TRANSCRIBE_STATUS_LOADING
                 get_collection_pin_response['contact_ids'] = contact_ids_transcribe_status
             context['get_collection_pin_response'] = get_collection_pin_response
 
-    bot_list = collection_request_manager.get_available_collection_bot()
-    context['bot_list'] = bot_list
-    context['collection_request_list'] = collection_request_manager.list_collect_requests()
-    context['num_available_queue'] = collection_request_manager.get_num_available_queue()
+    lookups = lookup_cache.get_many(['bot_list', 'collection_request_list', 'num_available_queue'], request)
+    context['bot_list'] = lookups['bot_list']
+    context['collection_request_list'] = lookups['collection_request_list']
+    context['num_available_queue'] = lookups['num_available_queue']
 
     context['error_list'] = error_list
     return render(request, 'ivrFrameworkWebInterface/collection_request.html', context)
@@ -251,12 +286,41 @@ def download_call_recordings(request):
     return response
 
 
+@login_required
+def stream_call_recordings(request, collection_pin):
+    # Stream the call recordings from AWS S3 as a ZIP archive, a byte range of the archive can be requested to resume
+    archive = call_recordings_manager.get_call_recordings_archive(collection_pin)
+    if len(archive.entries) == 0:
+        return HttpResponse(status=204)
+
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', archive.etag) == archive.etag:
+        try:
+            byte_range = parse_range_header(request.META['HTTP_RANGE'], archive.size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(archive.size)
+            return response
+
+    if byte_range is None:
+        response = StreamingHttpResponse(archive.iter_bytes(), content_type='application/zip')
+        response['Content-Length'] = archive.size
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(archive.iter_bytes(start, end), status=206, content_type='application/zip')
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, archive.size)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = archive.etag
+    response['Content-Disposition'] = 'attachment; filename=%s' % 'call_recordings_{}.zip'.format(collection_pin)
+    return response
+
+
 @login_required
 def transcribe_job_request(request):
     if request.method == 'GET':
         return
-    transcribe = boto3.client('transcribe', aws_access_key_id=ACCESS_KEY_ID,
-                              aws_secret_access_key=ACCESS_KEY)
+    transcribe = call_recordings_manager.transcribe_client
     response = HttpResponse()
     if 'download_contact_id' in request.POST:
         contact_id = request.POST['download_contact_id']
@@ -265,11 +329,33 @@ def transcribe_job_request(request):
         return HttpResponseRedirect(transcript_file_url)
     if 'start_contact_id' in request.POST:
         contact_id = request.POST['start_contact_id']
-        if not call_recordings_manager.start_transcribe_job(transcribe, 'human', contact_id):
-            call_recordings_manager.start_transcribe_job(transcribe, 'bot', contact_id)
+        try:
+            if call_recordings_manager.start_transcribe_job(transcribe, 'human', contact_id) or \
+                    call_recordings_manager.start_transcribe_job(transcribe, 'bot', contact_id):
+                transcribe_status_resolver.set_status(contact_id, TRANSCRIBE_JOB_STATUS_IN_PROGRESS)
+        except ClientError:
+            # Not started for now, e.g. throttled, the job can be started again from the page
+            return HttpResponse(status=503)
         return HttpResponse(status=204)
 
 
+@login_required
+def transcribe_status(request, collection_pin):
+    # Transcribe job statuses of all the conversations of a collection request, polled by the collection request page
+    # Only the page of conversations shown, given by the key it starts after
+    contact_start_key = request.GET.get('start') or None
+    contact_ids = []
+    if contact_start_key is None:
+        contact_ids = utils.get_legacy_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, collection_pin)
+    contact_ids.extend(utils.query_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, collection_pin,
+                                               CONTACT_IDS_PAGE_SIZE, contact_start_key)[0])
+    contact_ids_transcribe_status = transcribe_status_resolver.get_statuses(contact_ids)
+    is_pending = any(transcribe_status not in [TRANSCRIBE_JOB_STATUS_COMPLETED, TRANSCRIBE_JOB_STATUS_FAILED,
+                                               TRANSCRIBE_JOB_STATUS_NOT_START]
+                     for transcribe_status in contact_ids_transcribe_status.values())
+    return JsonResponse({'contact_ids': contact_ids_transcribe_status, 'pending': is_pending})
+
+
 @login_required
 def about_action(request):
     context = {}
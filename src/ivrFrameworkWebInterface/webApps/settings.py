@@ -48,10 +48,22 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ivrFrameworkWebInterface.middleware.ViewTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'webApps.urls'
 
+# Cache of the lookups rendered by the views, local to the process by default,
+# use a shared backend (e.g. memcached) when several processes serve the web interface
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ivr-framework-lookups',
+    }
+}
+# Seconds a lookup is cached, the data written by the lambda functions (e.g. collection progress) show up after it
+LOOKUP_CACHE_TIMEOUT = 30
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -0,0 +1,61 @@
+# benchmark_boto3_registry.py: Micro-benchmark of the per-call latency of utils lookups
+#                              with a new AWS resource per call (before) and the shared registry (after)
+#
+# Usage: python test/benchmark_boto3_registry.py [number of calls]
+
+import os
+import sys
+import time
+import boto3
+from moto import mock_dynamodb2
+import aws_deep_sense_spoken_data_collection_framework.utils as utils
+import unittest_helper_methods as helper
+
+test_data_directory = os.path.join(os.path.dirname(__file__), '..', 'test-data')
+config_test_path = os.path.join(test_data_directory, 'aws_config_test')
+
+ACCESS_KEY_ID, ACCESS_KEY = utils.get_aws_access_key(config_test_path)
+AWS_REGION_NAME = utils.get_aws_region_name(config_test_path)
+
+
+def is_collection_pin_exists_with_new_resource(PIN):
+    """
+    The lookup as implemented before the registry, a new AWS resource is created per call
+    """
+    dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION_NAME, aws_access_key_id=ACCESS_KEY_ID,
+                              aws_secret_access_key=ACCESS_KEY)
+    table = dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+    session = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: str(PIN)})
+    return 'Item' in session
+
+
+def is_collection_pin_exists_with_registry(PIN):
+    return utils.is_collection_pin_exists(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, PIN)
+
+
+def measure_per_call_latency(lookup, num_calls):
+    """
+    :return: average latency of one call in milliseconds
+    """
+    lookup('12345')  # Warm up
+    start_time = time.perf_counter()
+    for i in range(num_calls):
+        lookup(str(10000 + i))
+    return (time.perf_counter() - start_time) * 1000 / num_calls
+
+
+@mock_dynamodb2
+def main():
+    num_calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    helper.create_mock_dynamodb_collection_session_table()
+    before = measure_per_call_latency(is_collection_pin_exists_with_new_resource, num_calls)
+    after = measure_per_call_latency(is_collection_pin_exists_with_registry, num_calls)
+    # The backend is mocked in memory, so the numbers only reflect the client-side overhead
+    print('is_collection_pin_exists, {} calls'.format(num_calls))
+    print('Before (new resource per call): {:.3f} ms/call'.format(before))
+    print('After (shared registry): {:.3f} ms/call'.format(after))
+    print('Speedup: {:.1f}x'.format(before / after))
+
+
+if __name__ == '__main__':
+    main()
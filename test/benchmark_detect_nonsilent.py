@@ -0,0 +1,65 @@
+# benchmark_detect_nonsilent.py: Benchmark of the silence detection of human/bot customer recordings
+#                                 with pydub.silence.detect_nonsilent (before) and the NumPy analyser (after)
+#
+# Usage: python test/benchmark_detect_nonsilent.py [minutes of audio]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import scipy.io.wavfile as wavfile
+from aws_deep_sense_spoken_data_collection_framework.call_recordings_manager import CallRecordingsManager, \
+    AUDIO_MEDIA_SAMPLE_RATE_HERTZ, MINIMUM_SILENCE_LENGTH_MS, SILENCE_THRESHOLD_DB
+
+
+def generate_customer_recording(audio_file, minutes):
+    """
+    Write a synthetic mono 16-bit customer recording, answers of 1-4 s separated by pauses of 1-5 s
+    """
+    random_state = np.random.RandomState(0)
+    parts = []
+    num_frames = 0
+    while num_frames < minutes * 60 * AUDIO_MEDIA_SAMPLE_RATE_HERTZ:
+        for seconds, amplitude in [(random_state.uniform(1, 5), 1), (random_state.uniform(1, 4), 3000)]:
+            part = random_state.normal(0, amplitude, int(seconds * AUDIO_MEDIA_SAMPLE_RATE_HERTZ))
+            parts.append(np.clip(part, -32768, 32767).astype(np.int16))
+            num_frames += len(part)
+    wavfile.write(audio_file, AUDIO_MEDIA_SAMPLE_RATE_HERTZ, np.concatenate(parts))
+
+
+def main():
+    from pydub import AudioSegment
+    from pydub.silence import detect_nonsilent
+
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    work_directory = tempfile.mkdtemp()
+    try:
+        audio_file = os.path.join(work_directory, 'customer.wav')
+        generate_customer_recording(audio_file, minutes)
+
+        start_time = time.perf_counter()
+        expected_chunks = detect_nonsilent(AudioSegment.from_wav(audio_file), min_silence_len=MINIMUM_SILENCE_LENGTH_MS,
+                                           silence_thresh=SILENCE_THRESHOLD_DB)
+        before = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        fs, data = wavfile.read(audio_file, mmap=True)
+        chunks = CallRecordingsManager.detect_nonsilent(data, fs, min_silence_len=MINIMUM_SILENCE_LENGTH_MS,
+                                                        silence_thresh=SILENCE_THRESHOLD_DB)
+        after = time.perf_counter() - start_time
+        del data
+
+        print('{} minutes of {} Hz audio, {} non-silent chunks'.format(minutes, AUDIO_MEDIA_SAMPLE_RATE_HERTZ,
+                                                                        len(chunks)))
+        print('Same chunks: {}'.format(chunks == expected_chunks))
+        print('Before (pydub): {:.3f} s'.format(before))
+        print('After (NumPy): {:.3f} s'.format(after))
+        print('Speedup: {:.1f}x'.format(before / after))
+    finally:
+        shutil.rmtree(work_directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# benchmark_split_audio_by_channel.py: Benchmark of the peak memory and throughput of splitting
+#                                      human/human recordings by channel, loading the whole file (before)
+#                                      and memory-mapping it block by block (after)
+#
+# Usage: python test/benchmark_split_audio_by_channel.py [hours per recording] [number of recordings]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import resource
+import multiprocessing
+import numpy as np
+import scipy.io.wavfile as wavfile
+from aws_deep_sense_spoken_data_collection_framework.call_recordings_manager import CallRecordingsManager
+
+SAMPLE_RATE_HERTZ = 8000
+
+
+def split_audio_by_channel_in_memory(audio_file):
+    """
+    The splitter as implemented before, the whole file is loaded in memory
+    """
+    audio_file_name = audio_file.split('.')[0]
+    fs, data = wavfile.read(audio_file)
+    wavfile.write('{}_customer.wav'.format(audio_file_name), fs, data[:, 0])
+    wavfile.write('{}_agent.wav'.format(audio_file_name), fs, data[:, 1])
+
+
+def generate_recording(audio_file, hours):
+    """
+    Write a synthetic stereo 16-bit recording block by block
+    """
+    num_frames = int(hours * 3600 * SAMPLE_RATE_HERTZ)
+    block_num_frames = SAMPLE_RATE_HERTZ * 60
+    data = np.lib.format.open_memmap(audio_file + '.npy', mode='w+', dtype=np.int16, shape=(num_frames, 2))
+    for start in range(0, num_frames, block_num_frames):
+        end = min(start + block_num_frames, num_frames)
+        t = np.arange(start, end) / SAMPLE_RATE_HERTZ
+        data[start:end, 0] = (3000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+        data[start:end, 1] = (3000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+    wavfile.write(audio_file, SAMPLE_RATE_HERTZ, data)
+    del data
+    os.remove(audio_file + '.npy')
+
+
+def generate_recordings_then_notify(audio_files, hours, result_queue):
+    for audio_file in audio_files:
+        generate_recording(audio_file, hours)
+    result_queue.put(None)
+
+
+def get_peak_rss_mb():
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def measure(split, audio_files, result_queue):
+    # Run in a fresh process, so that the peak RSS only covers this splitter and the imports
+    baseline_rss_mb = get_peak_rss_mb()
+    start_time = time.perf_counter()
+    split(audio_files)
+    seconds = time.perf_counter() - start_time
+    result_queue.put((seconds, baseline_rss_mb, get_peak_rss_mb()))
+
+
+def run_in_process(target, *args):
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=target, args=args + (result_queue,))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+
+def split_sequentially_in_memory(audio_files):
+    for audio_file in audio_files:
+        split_audio_by_channel_in_memory(audio_file)
+
+
+def split_sequentially_memory_mapped(audio_files):
+    for audio_file in audio_files:
+        CallRecordingsManager.split_audio_by_channel(audio_file)
+
+
+def split_in_process_pool(audio_files):
+    CallRecordingsManager.split_audio_files_by_channel(audio_files)
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    num_recordings = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    work_directory = tempfile.mkdtemp()
+    try:
+        audio_files = [os.path.join(work_directory, 'call_recordings_{}.wav'.format(i)) for i in range(num_recordings)]
+        # Generated in another process, so that the memory used to generate them is not inherited by the splitters
+        run_in_process(generate_recordings_then_notify, audio_files, hours)
+        total_mb = sum(os.path.getsize(audio_file) for audio_file in audio_files) / 1e6
+        print('{} recordings of {} hours at {} Hz, {:.1f} MB in total'.format(num_recordings, hours,
+                                                                              SAMPLE_RATE_HERTZ, total_mb))
+        for label, split in [('Before (whole file in memory)', split_sequentially_in_memory),
+                             ('After (memory-mapped blocks)', split_sequentially_memory_mapped),
+                             ('After (memory-mapped blocks, process pool)', split_in_process_pool)]:
+            seconds, baseline_rss_mb, peak_rss_mb = run_in_process(measure, split, audio_files)
+            print('{}: {:.2f} s, {:.1f} MB/s, peak RSS {:.1f} MB ({:.1f} MB before splitting)'.format(
+                label, seconds, total_mb / seconds, peak_rss_mb, baseline_rss_mb))
+    finally:
+        shutil.rmtree(work_directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# test_batch_runner.py: Unit test for the operations run without any prompt, and the subcommands running them
+
+import unittest
+import os
+import io
+import json
+import tempfile
+import importlib.util
+import boto3
+import mock
+from moto import mock_dynamodb2
+import aws_deep_sense_spoken_data_collection_framework.utils as utils
+import aws_deep_sense_spoken_data_collection_framework.collection_request_manager as collection_request_manager
+from aws_deep_sense_spoken_data_collection_framework import framework_runner
+from aws_deep_sense_spoken_data_collection_framework.batch_runner import BatchRunner, load_batch_file
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
+
+test_data_directory = os.path.join(os.path.dirname(__file__), '..', 'test-data')
+config_test_path = os.path.join(test_data_directory, 'aws_config_test')
+
+
+def put_collection_request(collection_pin, collection_status):
+    table = boto3.resource('dynamodb', region_name=helper.AWS_REGION_NAME).Table(
+        utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+    table.put_item(Item={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: collection_pin, 'conversationPIN': '54321',
+                         'mode': 'bot', 'collectionBot': 'test_bot', 'collectionGoal': 10, 'collectedCount': 2,
+                         'collectionStatus': collection_status, 'collectionName': 'test_collection'})
+
+
+def run_batch(operations, fail_fast=False):
+    output = io.StringIO()
+    num_failed = BatchRunner(config_test_path, output).run(operations, fail_fast)
+    return num_failed, [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+class TestBatchRunner(unittest.TestCase):
+    @mock_dynamodb2
+    def test_run(self):
+        helper.create_mock_dynamodb_collection_session_table()
+        helper.create_mock_dynamodb_collection_contact_table()
+        put_collection_request('12345', 'START')
+        put_collection_request('23456', 'STOP')
+        helper.put_mock_dynamodb_collection_contacts('12345', ['test_contact_id_1', 'test_contact_id_2'])
+
+        operations = [{'operation': 'get-collection', 'id': 'nightly-1', 'pin': '12345'},
+                      {'operation': 'change-collection-status', 'pin': '12345', 'status': 'PAUSE'},
+                      {'operation': 'change-collection-status', 'pin': '23456', 'status': 'PAUSE'},
+                      {'operation': 'change-collection-status', 'pin': '34567', 'status': 'PAUSE'},
+                      {'operation': 'list-collections'}]
+        with mock.patch.object(collection_request_manager, 'CollectionRequestManager',
+                               wraps=collection_request_manager.CollectionRequestManager) as manager_class:
+            num_failed, lines = run_batch(operations)
+
+        # test 1: the operations share one manager, and a failure does not stop the batch
+        manager_class.assert_called_once()
+        self.assertEqual(num_failed, 1)
+        self.assertEqual([line['status'] for line in lines], ['ok', 'ok', 'ok', 'error', 'ok'])
+
+        # test 2: the results are serialized, Decimal included
+        self.assertEqual(lines[0]['id'], 'nightly-1')
+        self.assertEqual(lines[0]['result']['contact_ids'], ['test_contact_id_1', 'test_contact_id_2'])
+        self.assertEqual(lines[0]['result']['collected_count'], 2)
+        self.assertEqual(lines[1]['result'], {'collection_pin': '12345', 'collection_status': 'PAUSE'})
+        # A stopped collection request is not started again
+        self.assertEqual(lines[2]['result'], {'collection_pin': '23456', 'collection_status': 'STOP'})
+        self.assertEqual(len(lines[4]['result']), 2)
+
+    @mock_dynamodb2
+    def test_run_invalid_operation(self):
+        helper.create_mock_dynamodb_collection_session_table()
+        operations = [{'operation': 'start-collection', 'mode': 'human', 'goal': 10},
+                      {'operation': 'end-collection', 'pin': '12345'},
+                      {'operation': 'list-collections'}]
+        num_failed, lines = run_batch(operations)
+        self.assertEqual(num_failed, 2)
+        self.assertIn('name', lines[0]['error'])
+        self.assertIn('Invalid operation', lines[1]['error'])
+
+        # test 2: the batch stops at the first failed operation
+        num_failed, lines = run_batch(operations, fail_fast=True)
+        self.assertEqual(num_failed, 1)
+        self.assertEqual(len(lines), 1)
+
+    def test_load_batch_file(self):
+        operations = [{'operation': 'download', 'pin': '12345', 'output': 'recordings'}]
+        with tempfile.TemporaryDirectory() as directory:
+            json_batch_file = os.path.join(directory, 'batch.json')
+            with open(json_batch_file, 'w') as file:
+                json.dump(operations, file)
+            self.assertEqual(load_batch_file(json_batch_file), operations)
+
+            with open(json_batch_file, 'w') as file:
+                json.dump({'operation': 'download'}, file)
+            with self.assertRaises(ValueError):
+                load_batch_file(json_batch_file)
+
+    @unittest.skipUnless(importlib.util.find_spec('yaml'), 'PyYAML is not installed')
+    def test_load_yaml_batch_file(self):
+        operations = [{'operation': 'download', 'pin': '12345', 'output': 'recordings'}]
+        with tempfile.TemporaryDirectory() as directory:
+            yaml_batch_file = os.path.join(directory, 'batch.yaml')
+            with open(yaml_batch_file, 'w') as file:
+                file.write('operations:\n  - operation: download\n    pin: "12345"\n    output: recordings\n')
+            self.assertEqual(load_batch_file(yaml_batch_file), operations)
+
+    def test_framework_runner_subcommand(self):
+        statistics = {'conversations': 1, 'objects': 3, 'bytes': 100, 'seconds': 0.1, 'failed': []}
+        argv = ['framework_runner.py', 'download', '--pin', '12345', '--output', 'recordings']
+        with mock.patch('sys.argv', argv), mock.patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                mock.patch.object(framework_runner, 'config_path', config_test_path), \
+                mock.patch('aws_deep_sense_spoken_data_collection_framework.call_recordings_manager.'
+                           'CallRecordingsManager.download_call_recordings_given_pin',
+                           return_value=statistics) as download:
+            with self.assertRaises(SystemExit) as exit_context:
+                framework_runner.main()
+        self.assertEqual(exit_context.exception.code, 0)
+        download.assert_called_once_with('12345', os.path.join(os.path.abspath('recordings'), '12345'))
+        line = json.loads(stdout.getvalue())
+        self.assertEqual((line['operation'], line['status'], line['result']), ('download', 'ok', statistics))
+
+        # test 2: the command fails if a conversation is not downloaded
+        statistics['failed'] = ['test_contact_id_1']
+        with mock.patch('sys.argv', argv), mock.patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                mock.patch.object(framework_runner, 'config_path', config_test_path), \
+                mock.patch('aws_deep_sense_spoken_data_collection_framework.call_recordings_manager.'
+                           'CallRecordingsManager.download_call_recordings_given_pin', return_value=statistics):
+            with self.assertRaises(SystemExit) as exit_context:
+                framework_runner.main()
+        self.assertEqual(exit_context.exception.code, 1)
+        line = json.loads(stdout.getvalue())
+        self.assertEqual(line['status'], 'error')
+        self.assertIn('test_contact_id_1', line['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
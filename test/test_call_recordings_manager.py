@@ -2,9 +2,24 @@
 
 import unittest
 import mock
+import io
 import os
+import json
+import shutil
+import tempfile
+import zipfile
+import zlib
+import boto3
+import numpy as np
+import scipy.io.wavfile as wavfile
+from moto import mock_dynamodb2, mock_s3
 from aws_deep_sense_spoken_data_collection_framework.call_recordings_manager import CallRecordingsManager
+import aws_deep_sense_spoken_data_collection_framework.streaming_zip as streaming_zip
 import aws_deep_sense_spoken_data_collection_framework.utils as utils
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
 
 # Retrieve AWS Access Key
 test_data_directory = os.path.join(os.path.dirname(__file__), '..', 'test-data')
@@ -16,6 +31,9 @@ CALL_RECORDINGS_BUCKET_NAME = utils.get_call_recordings_bucket_name(config_test_
 
 # Create Class Objects
 call_recordings_manager = CallRecordingsManager(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, CALL_RECORDINGS_BUCKET_NAME)
+call_recordings_manager_method_prefix_list = ['aws_deep_sense_spoken_data_collection_framework',
+                                              'call_recordings_manager', 'CallRecordingsManager']
+call_recordings_manager_method_prefix = '.'.join(call_recordings_manager_method_prefix_list)
 
 
 class TestCallRecordingsManage(unittest.TestCase):
@@ -57,6 +75,222 @@ class TestCallRecordingsManage(unittest.TestCase):
             actual_response = call_recordings_manager.ask_output_directory(test_collection_pin)
             self.assertEqual(actual_response, expected_response)
 
+    @mock_s3
+    @mock_dynamodb2
+    @mock.patch('{}.get_transcribe_given_pin'.format(call_recordings_manager_method_prefix))
+    def test_download_call_recordings_given_pin(self, get_transcribe_given_pin):
+        helper.create_mock_dynamodb_collection_session_table()
+        helper.create_mock_dynamodb_collection_contact_table()
+        dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION_NAME)
+        table = dynamodb_resource.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        contact_ids = ['test_contact_id_1', 'test_contact_id_2']
+        helper.put_mock_dynamodb_collection_contacts('12345', contact_ids)
+        with table.batch_writer() as batch:
+            user_item = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345',
+                         utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: '98765', 'mode': 'human',
+                         'collectedCount': 2, 'collectionGoal': 2, 'collectionStatus': 'STOP',
+                         'collectionName': 'test_collection_name', 'routingInfo': {}}
+            batch.put_item(Item=user_item)
+        s3_client = boto3.client('s3', region_name=AWS_REGION_NAME)
+        s3_client.create_bucket(Bucket=CALL_RECORDINGS_BUCKET_NAME)
+        ctr = {'Attributes': {'customerPin': '111111'}, 'Agent': {'Username': 'agent_222222'}}
+        for contact_id in contact_ids:
+            s3_client.put_object(Bucket=CALL_RECORDINGS_BUCKET_NAME, Key='{0}/ctr_{0}.json'.format(contact_id),
+                                 Body=json.dumps(ctr))
+            s3_client.put_object(Bucket=CALL_RECORDINGS_BUCKET_NAME, Key='{0}/lex_bot_{0}.json'.format(contact_id),
+                                 Body='{}')
+        output_file_path = tempfile.mkdtemp()
+        try:
+            # test 1: download everything
+            statistics = call_recordings_manager.download_call_recordings_given_pin('12345', output_file_path)
+            self.assertEqual(statistics['conversations'], 2)
+            self.assertEqual(statistics['objects'], 4)
+            for contact_id in contact_ids:
+                output_file_path_with_contact_id = os.path.join(output_file_path, contact_id)
+                self.assertTrue(os.path.isfile(os.path.join(output_file_path_with_contact_id,
+                                                            'ctr_{}.json'.format(contact_id))))
+                self.assertTrue(os.path.isfile(os.path.join(output_file_path_with_contact_id,
+                                                            'conversation_report_{}'.format(contact_id))))
+
+            # test 2: resume, nothing is downloaded again
+            statistics = call_recordings_manager.download_call_recordings_given_pin('12345', output_file_path)
+            self.assertEqual(statistics['conversations'], 0)
+            self.assertEqual(statistics['objects'], 0)
+
+            # test 3: only the object changed on S3 or missing locally is downloaded again
+            s3_client.put_object(Bucket=CALL_RECORDINGS_BUCKET_NAME, Key='test_contact_id_1/lex_bot_test_contact_id_1.json',
+                                 Body='{\"conversationResult\": \"Fulfilled\"}')
+            os.remove(os.path.join(output_file_path, 'test_contact_id_2', 'ctr_test_contact_id_2.json'))
+            statistics = call_recordings_manager.download_call_recordings_given_pin('12345', output_file_path)
+            self.assertEqual(statistics['conversations'], 2)
+            self.assertEqual(statistics['objects'], 2)
+            self.assertEqual(statistics['failed'], [])
+
+            # test 4: a conversation interrupted before its processing completed is processed again by the next run
+            s3_client.put_object(Bucket=CALL_RECORDINGS_BUCKET_NAME,
+                                 Key='test_contact_id_2/lex_bot_test_contact_id_2.json',
+                                 Body='{\"conversationResult\": \"Failed\"}')
+            with mock.patch.object(call_recordings_manager, 'generate_conversation_report',
+                                   side_effect=IOError('No space left on device')):
+                statistics = call_recordings_manager.download_call_recordings_given_pin('12345', output_file_path)
+            self.assertEqual(statistics['objects'], 1)
+            with mock.patch.object(call_recordings_manager, 'process_downloaded_conversation',
+                                   wraps=call_recordings_manager.process_downloaded_conversation) as process:
+                statistics = call_recordings_manager.download_call_recordings_given_pin('12345', output_file_path)
+            self.assertEqual(statistics['objects'], 0)
+            is_new_downloads = {call[0][1]: call[0][3] for call in process.call_args_list}
+            self.assertEqual(is_new_downloads, {'test_contact_id_1': False, 'test_contact_id_2': True})
+
+            # test 5: a conversation whose objects are not all downloaded is reported
+            s3_client.put_object(Bucket=CALL_RECORDINGS_BUCKET_NAME,
+                                 Key='test_contact_id_1/lex_bot_test_contact_id_1.json', Body='{}')
+            with mock.patch.object(call_recordings_manager.s3_client, 'download_file',
+                                   side_effect=IOError('Connection reset')):
+                statistics = call_recordings_manager.download_call_recordings_given_pin('12345', output_file_path)
+            self.assertEqual(statistics['conversations'], 0)
+            self.assertEqual(statistics['failed'], ['test_contact_id_1'])
+        finally:
+            shutil.rmtree(output_file_path)
+
+    @mock_s3
+    @mock_dynamodb2
+    def test_get_call_recordings_archive(self):
+        helper.create_mock_dynamodb_collection_session_table()
+        helper.create_mock_dynamodb_collection_contact_table()
+        dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION_NAME)
+        table = dynamodb_resource.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        contact_ids = ['test_contact_id_1', 'test_contact_id_2']
+        helper.put_mock_dynamodb_collection_contacts('12345', contact_ids)
+        table.put_item(Item={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345',
+                             utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: '98765', 'mode': 'human',
+                             'collectedCount': 2, 'collectionGoal': 2, 'collectionStatus': 'STOP',
+                             'collectionName': 'test_collection_name', 'routingInfo': {}})
+        s3_client = boto3.client('s3', region_name=AWS_REGION_NAME)
+        s3_client.create_bucket(Bucket=CALL_RECORDINGS_BUCKET_NAME)
+        for contact_id in contact_ids:
+            s3_client.put_object(Bucket=CALL_RECORDINGS_BUCKET_NAME, Key='{0}/ctr_{0}.json'.format(contact_id),
+                                 Body=contact_id * 100)
+
+        archive = call_recordings_manager.get_call_recordings_archive('12345')
+        archive_bytes = b''.join(archive.iter_bytes())
+        self.assertEqual(len(archive_bytes), archive.size)
+        with zipfile.ZipFile(io.BytesIO(archive_bytes)) as zip_file:
+            for contact_id in contact_ids:
+                arcname = 'call_recordings_12345/12345/{0}/ctr_{0}.json'.format(contact_id)
+                self.assertEqual(zip_file.read(arcname), (contact_id * 100).encode())
+        # A range in the middle of an object is read with a ranged request
+        self.assertEqual(b''.join(archive.iter_bytes(500, 1500)), archive_bytes[500:1501])
+
+        # The CRC-32 of the objects are saved in their tags, a range request in another process reads no other object
+        for contact_id in contact_ids:
+            tag_set = s3_client.get_object_tagging(Bucket=CALL_RECORDINGS_BUCKET_NAME,
+                                                   Key='{0}/ctr_{0}.json'.format(contact_id))['TagSet']
+            self.assertEqual([tag['Value'].split(':')[0] for tag in tag_set],
+                             [str(zlib.crc32((contact_id * 100).encode()))])
+        streaming_zip.clear_crc_cache()
+        archive = call_recordings_manager.get_call_recordings_archive('12345')
+        start = archive_bytes.index(b'test_contact_id_2' * 100) + 100
+        with mock.patch.object(call_recordings_manager.s3_client, 'get_object',
+                               wraps=call_recordings_manager.s3_client.get_object) as get_object:
+            self.assertEqual(b''.join(archive.iter_bytes(start)), archive_bytes[start:])
+        get_object.assert_called_once_with(Bucket=CALL_RECORDINGS_BUCKET_NAME,
+                                           Key='test_contact_id_2/ctr_test_contact_id_2.json', Range='bytes=100-')
+
+    def test_split_audio_by_channel(self):
+        output_file_path = tempfile.mkdtemp(suffix='.with.dots')
+        try:
+            audio_files = []
+            for i, dtype in enumerate([np.int16, np.uint8, np.float32]):
+                data = (np.arange(2 * 10001).reshape(-1, 2) % 200).astype(dtype)
+                audio_file = os.path.join(output_file_path, 'call_recordings_{}.wav'.format(i))
+                wavfile.write(audio_file, 8000, data)
+                audio_files.append(audio_file)
+                CallRecordingsManager.split_audio_by_channel(audio_file, block_num_frames=1000)
+                for channel, role in enumerate(['customer', 'agent']):
+                    fs, channel_data = wavfile.read(os.path.join(output_file_path,
+                                                                 'call_recordings_{}_{}.wav'.format(i, role)))
+                    self.assertEqual(fs, 8000)
+                    self.assertEqual(channel_data.dtype, data.dtype)
+                    np.testing.assert_array_equal(channel_data, data[:, channel])
+
+            # Split in a pool of processes, a missing file is skipped
+            audio_files.append(os.path.join(output_file_path, 'missing.wav'))
+            self.assertEqual(CallRecordingsManager.split_audio_files_by_channel(audio_files, max_workers=2), 3)
+        finally:
+            shutil.rmtree(output_file_path)
+
+    def test_detect_nonsilent(self):
+        from pydub import AudioSegment
+        from pydub.silence import detect_nonsilent
+        output_file_path = tempfile.mkdtemp()
+        random_state = np.random.RandomState(0)
+        try:
+            audio_file = os.path.join(output_file_path, 'customer.wav')
+            for fs, num_channels, dtype in [(8000, 1, np.int16), (11025, 2, np.int16), (16000, 1, np.uint8)]:
+                # Speech-like bursts separated by pauses of various lengths, on top of a low background noise
+                parts = [random_state.normal(0, amplitude, (int(fs * seconds), num_channels))
+                         for seconds, amplitude in [(0.3, 2), (0.8, 3000), (0.05, 2), (0.4, 3000), (1.2, 2),
+                                                    (0.5, 300), (0.6, 2), (0.2, 3000)]]
+                data = np.concatenate(parts)
+                if dtype == np.uint8:
+                    data = np.clip(data / 128 + 128, 0, 255)
+                data = np.clip(data, np.iinfo(dtype).min, np.iinfo(dtype).max).astype(dtype)
+                wavfile.write(audio_file, fs, data[:, 0] if num_channels == 1 else data)
+                for min_silence_len, silence_thresh in [(100, -40), (500, -30), (2000, -60)]:
+                    expected_response = detect_nonsilent(AudioSegment.from_wav(audio_file), min_silence_len,
+                                                         silence_thresh)
+                    _, data = wavfile.read(audio_file, mmap=True)
+                    actual_response = CallRecordingsManager.detect_nonsilent(data, fs, min_silence_len,
+                                                                             silence_thresh)
+                    self.assertEqual(actual_response, expected_response)
+                    del data
+
+            # The chunk is written as is between 500ms of silence
+            chunk_file = os.path.join(output_file_path, 'chunk.wav')
+            data = np.arange(-500, 500, dtype=np.int16)
+            CallRecordingsManager.write_audio_chunk(chunk_file, 8000, data[100:900])
+            fs, chunk_data = wavfile.read(chunk_file)
+            self.assertEqual(fs, 8000)
+            np.testing.assert_array_equal(chunk_data, np.concatenate([np.zeros(4000, dtype=np.int16), data[100:900],
+                                                                      np.zeros(4000, dtype=np.int16)]))
+        finally:
+            shutil.rmtree(output_file_path)
+
+    @mock_s3
+    @mock_dynamodb2
+    def test_delete_call_recordings_given_pin(self):
+        helper.create_mock_dynamodb_collection_session_table()
+        helper.create_mock_dynamodb_collection_contact_table()
+        table = boto3.resource('dynamodb', region_name=AWS_REGION_NAME).Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        contact_ids = ['test_contact_id_1', 'test_contact_id_2']
+        helper.put_mock_dynamodb_collection_contacts('12345', contact_ids)
+        table.put_item(Item={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345',
+                             utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: '98765', 'mode': 'human',
+                             'collectedCount': 2, 'collectionGoal': 2, 'collectionStatus': 'STOP',
+                             'collectionName': 'test_collection_name', 'routingInfo': {}})
+        s3_client = boto3.client('s3', region_name=AWS_REGION_NAME)
+        s3_client.create_bucket(Bucket=CALL_RECORDINGS_BUCKET_NAME)
+        # More objects than a single delete_objects request can take, and objects of other collection requests
+        for i in range(1005):
+            s3_client.put_object(Bucket=CALL_RECORDINGS_BUCKET_NAME, Key='test_contact_id_1/part_{}'.format(i),
+                                 Body=b'x')
+        s3_client.put_object(Bucket=CALL_RECORDINGS_BUCKET_NAME, Key='test_contact_id_2/ctr_test_contact_id_2.json',
+                             Body=b'12345')
+        s3_client.put_object(Bucket=CALL_RECORDINGS_BUCKET_NAME, Key='test_contact_id_10/ctr_test_contact_id_10.json',
+                             Body=b'12345')
+
+        # test 1: dry run
+        statistics = call_recordings_manager.delete_call_recordings_given_pin('12345', dry_run=True)
+        self.assertEqual(statistics, {'objects': 1006, 'bytes': 1010, 'errors': 0})
+        self.assertEqual(len(call_recordings_manager.list_objects_given_contact_id('test_contact_id_1')), 1005)
+
+        # test 2: delete
+        statistics = call_recordings_manager.delete_call_recordings_given_pin('12345')
+        self.assertEqual(statistics, {'objects': 1006, 'bytes': 1010, 'errors': 0})
+        for contact_id in contact_ids:
+            self.assertEqual(call_recordings_manager.list_objects_given_contact_id(contact_id), [])
+        self.assertEqual(len(call_recordings_manager.list_objects_given_contact_id('test_contact_id_10')), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
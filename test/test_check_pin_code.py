@@ -0,0 +1,178 @@
+# test_check_pin_code.py: Unit test for the check_pin_code lambda function
+
+import unittest
+from moto import mock_dynamodb2
+import moto.dynamodb2.models
+import mock
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+import aws_deep_sense_spoken_data_collection_framework.utils as utils
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
+
+helper.set_mock_lambda_environment()
+import check_pin_code
+
+ROUTING_INFO = {'queueNumber': 1, 'queueID': 'test_queue_id', 'queueArn': 'test_queue_arn'}
+
+
+def get_event(contact_id, conversation_pin='98765'):
+    return {'Details': {'ContactData': {'ContactId': contact_id},
+                        'Parameters': {'conversationPIN': conversation_pin}}}
+
+
+class TestCheckPinCode(unittest.TestCase):
+    def setUp(self):
+        check_pin_code.get_conversation_session.cache_clear()
+        check_pin_code.get_user_type.cache_clear()
+
+    def put_collection_request(self, collection_goal, mode='human'):
+        helper.create_mock_dynamodb_collection_session_table()
+        helper.create_mock_dynamodb_collection_contact_table()
+        helper.create_mock_dynamodb_queue_pool_table()
+        table = boto3.resource('dynamodb', region_name=helper.AWS_REGION_NAME).Table(
+            utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        table.put_item(Item={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345',
+                             utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: '98765', 'mode': mode,
+                             'collectedCount': 0, 'collectionGoal': collection_goal, 'collectionStatus': 'START',
+                             'collectionName': 'test_collection_name', 'routingInfo': ROUTING_INFO,
+                             'collectionBot': 'test_bot'})
+        return table
+
+    @mock_dynamodb2
+    def test_check_conversation_pin(self):
+        table = self.put_collection_request(collection_goal=2)
+        queue_pool_table = boto3.resource('dynamodb', region_name=helper.AWS_REGION_NAME).Table('connectQueuePool')
+
+        # test 1: invalid conversation PIN
+        self.assertEqual(check_pin_code.lambda_handler(get_event('contact_id_0', '00000'), None),
+                         {'response': 'False'})
+
+        # test 2: the contact is saved into the contact table, the collection is still running
+        self.assertEqual(check_pin_code.lambda_handler(get_event('contact_id_1'), None),
+                         {'response': 'human', 'queueID': 'test_queue_id'})
+        item = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345'})['Item']
+        self.assertNotIn('contactIDs', item)
+        self.assertEqual(item['collectedCount'], 1)
+        self.assertEqual(item['collectionStatus'], 'START')
+        self.assertEqual(utils.get_contact_ids(helper.ACCESS_KEY_ID, helper.ACCESS_KEY, helper.AWS_REGION_NAME,
+                                               '12345'), ['contact_id_1'])
+
+        # test 3: the collection stops at its goal and releases its queue
+        self.assertEqual(check_pin_code.lambda_handler(get_event('contact_id_2'), None)['response'], 'human')
+        item = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345'})['Item']
+        self.assertEqual(utils.get_contact_ids(helper.ACCESS_KEY_ID, helper.ACCESS_KEY, helper.AWS_REGION_NAME,
+                                               '12345'), ['contact_id_1', 'contact_id_2'])
+        self.assertEqual(item['collectedCount'], 2)
+        self.assertEqual(item['collectionStatus'], 'STOP')
+        self.assertEqual(queue_pool_table.scan()['Items'], [ROUTING_INFO])
+
+        # test 4: no caller is accepted once stopped, although the collection request is still cached
+        self.assertEqual(check_pin_code.lambda_handler(get_event('contact_id_3'), None), {'response': 'False'})
+        self.assertIsNotNone(check_pin_code.get_conversation_session('98765'))
+
+    @mock_dynamodb2
+    def test_check_conversation_pin_contact_not_saved(self):
+        table = self.put_collection_request(collection_goal=2)
+        boto3.client('dynamodb', region_name=helper.AWS_REGION_NAME).delete_table(
+            TableName=utils.COLLECTION_CONTACT_DYNAMODB_TABLE)
+
+        # A contact that cannot be saved is not counted
+        with self.assertRaises(ClientError):
+            check_pin_code.lambda_handler(get_event('contact_id_1'), None)
+        item = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345'})['Item']
+        self.assertEqual(item['collectedCount'], 0)
+        self.assertEqual(item['collectionStatus'], 'START')
+
+    @mock_dynamodb2
+    def test_check_conversation_pin_legacy(self):
+        table = self.put_collection_request(collection_goal=2)
+        # Saved before the counter existed, with the contact ids in a list
+        table.update_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345'},
+                          UpdateExpression='SET contactIDs = :contact_ids REMOVE collectedCount',
+                          ExpressionAttributeValues={':contact_ids': ['contact_id_0']})
+
+        # test 1: the counter starts from the contact ids of the list
+        self.assertEqual(check_pin_code.lambda_handler(get_event('contact_id_1'), None)['response'], 'human')
+        item = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345'})['Item']
+        self.assertEqual(item['collectedCount'], 2)
+        self.assertEqual(item['collectionStatus'], 'STOP')
+
+        # test 2: a legacy collection request that has met its goal accepts no caller
+        check_pin_code.get_conversation_session.cache_clear()
+        table.update_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345'},
+                          UpdateExpression='SET contactIDs = :contact_ids, collectionStatus = :start '
+                                           'REMOVE collectedCount',
+                          ExpressionAttributeValues={':contact_ids': ['contact_id_0', 'contact_id_1'],
+                                                     ':start': 'START'})
+        self.assertEqual(check_pin_code.lambda_handler(get_event('contact_id_2'), None), {'response': 'False'})
+        item = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345'})['Item']
+        self.assertNotIn('collectedCount', item)
+
+    @mock_dynamodb2
+    def test_check_user_pin(self):
+        helper.create_mock_dynamodb_user_account_table()
+        table = boto3.resource('dynamodb', region_name=helper.AWS_REGION_NAME).Table(
+            utils.USER_ACCOUNT_DYNAMODB_TABLE)
+        table.put_item(Item={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: '111111', 'type': 'customer'})
+        table.put_item(Item={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: '222222', 'type': 'agent'})
+        table.put_item(Item={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: '444444',
+                             utils.PIN_RESERVATION_ATTRIBUTE: '2020-01-01T00:00:00Z'})
+
+        def get_event(user_pin):
+            return {'Details': {'Parameters': {'userPIN': user_pin}}}
+
+        # test 1: only a customer PIN is valid
+        self.assertEqual(check_pin_code.lambda_handler(get_event('111111'), None), {'response': 'True'})
+        self.assertEqual(check_pin_code.lambda_handler(get_event('222222'), None), {'response': 'False'})
+        self.assertEqual(check_pin_code.lambda_handler(get_event('333333'), None), {'response': 'False'})
+        self.assertEqual(check_pin_code.lambda_handler(get_event('444444'), None), {'response': 'False'})
+
+        # test 2: a user is looked up once by a warm container, a new user is found at once
+        table.delete_item(Key={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: '111111'})
+        table.put_item(Item={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: '333333', 'type': 'customer'})
+        self.assertEqual(check_pin_code.lambda_handler(get_event('111111'), None), {'response': 'True'})
+        self.assertEqual(check_pin_code.lambda_handler(get_event('333333'), None), {'response': 'True'})
+
+    @mock_dynamodb2
+    def test_check_conversation_pin_concurrent_callers(self):
+        collection_goal = 10
+        num_callers = 40
+        table = self.put_collection_request(collection_goal=collection_goal)
+        queue_pool_table = boto3.resource('dynamodb', region_name=helper.AWS_REGION_NAME).Table('connectQueuePool')
+
+        # DynamoDB applies the writes on one item one at a time, moto's in-memory backend does not lock
+        update_lock = threading.Lock()
+        update_item = moto.dynamodb2.models.DynamoDBBackend.update_item
+
+        def locked_update_item(*args, **kwargs):
+            with update_lock:
+                return update_item(*args, **kwargs)
+
+        start_barrier = threading.Barrier(num_callers)
+
+        def call(contact_id):
+            start_barrier.wait()
+            return contact_id, check_pin_code.check_conversation_pin('98765', get_event(contact_id))
+
+        with mock.patch.object(moto.dynamodb2.models.DynamoDBBackend, 'update_item', locked_update_item), \
+                ThreadPoolExecutor(max_workers=num_callers) as executor:
+            results = list(executor.map(call, ['contact_id_{}'.format(i) for i in range(num_callers)]))
+
+        accepted_contact_ids = [contact_id for contact_id, response in results if response['response'] == 'human']
+        item = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345'})['Item']
+        # Exactly the goal is collected, no contact id is lost and the queue is released once
+        self.assertEqual(len(accepted_contact_ids), collection_goal)
+        self.assertEqual(sorted(utils.get_contact_ids(helper.ACCESS_KEY_ID, helper.ACCESS_KEY, helper.AWS_REGION_NAME,
+                                                      '12345')), sorted(accepted_contact_ids))
+        self.assertEqual(item['collectedCount'], collection_goal)
+        self.assertEqual(item['collectionStatus'], 'STOP')
+        self.assertEqual(queue_pool_table.scan()['Items'], [ROUTING_INFO])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -109,25 +109,45 @@ class TestCollectionRequestManage(unittest.TestCase):
     @mock_dynamodb2
     def test_list_collect_requests(self):
         helper.create_mock_dynamodb_collection_session_table()
+        helper.create_mock_dynamodb_collection_contact_table()
         dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION_NAME)
         table = dynamodb_resource.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
 
         with table.batch_writer() as batch:
             user_item_1 = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '123456',
                            utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: '987654', 'mode': 'human',
-                           'contactIDs': [], 'collectionGoal': 1, 'collectionStatus': 'START',
+                           'collectedCount': 0, 'collectionGoal': 1, 'collectionStatus': 'START',
                            'collectionName': 'test_collection_name',
                            'routingInfo': {'queueNumber': '1', 'queueID': 'test_queue_id',
                                            'routingProfileID': 'test_routing_profile_id'}}
             batch.put_item(Item=user_item_1)
 
-        expected_response = [user_item_1]
+            # Saved before the collected conversation counter and the contact table
+            user_item_2 = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '234567',
+                           utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: '876543', 'mode': 'bot',
+                           'contactIDs': ['1', '2'], 'collectionGoal': 3, 'collectionStatus': 'START',
+                           'collectionName': 'test_collection_name', 'collectionBot': 'OrderFlowers'}
+            batch.put_item(Item=user_item_2)
+
+        # test 1: only the listed attributes are returned, the contact ids are only counted without a counter
+        expected_response = [{key: value for key, value in item.items() if key not in ['routingInfo', 'contactIDs']}
+                             for item in [user_item_1, user_item_2]]
+        expected_response[1]['collectedCount'] = 2
         actual_response = collection_request_manager.list_collect_requests()
-        self.assertEqual(actual_response, expected_response)
+        self.assertEqual(sorted(actual_response, key=lambda item: item['collectionPIN']), expected_response)
+
+        # test 2: move the contact ids into the contact table, the migration can be run again
+        self.assertEqual(collection_request_manager.migrate_contact_ids(), 1)
+        item = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '234567'})['Item']
+        self.assertEqual(item['collectedCount'], 2)
+        self.assertNotIn('contactIDs', item)
+        self.assertEqual(utils.get_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, '234567'), ['1', '2'])
+        self.assertEqual(collection_request_manager.migrate_contact_ids(), 0)
 
     @mock_dynamodb2
     def test_get_collection_request_given_pin(self):
         helper.create_mock_dynamodb_collection_session_table()
+        helper.create_mock_dynamodb_collection_contact_table()
         dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION_NAME)
         table = dynamodb_resource.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
 
@@ -135,19 +155,30 @@ class TestCollectionRequestManage(unittest.TestCase):
         with table.batch_writer() as batch:
             user_item = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '123456',
                          utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: '987654', 'mode': 'human',
-                         'contactIDs': [], 'collectionGoal': 1, 'collectionStatus': 'START',
+                         'collectedCount': 3, 'collectionGoal': 5, 'collectionStatus': 'START',
                          'collectionName': 'test_collection_name',
                          'routingInfo': {'queueNumber': '1', 'queueID': 'test_queue_id',
                                          'routingProfileID': 'test_routing_profile_id'}}
             batch.put_item(Item=user_item)
+        helper.put_mock_dynamodb_collection_contacts('123456', ['contact_id_1', 'contact_id_2', 'contact_id_3'])
 
         expected_response = {'collection_pin': '123456', 'conversation_pin': '987654', 'mode': 'human',
-                             'contact_ids': [], 'collection_goal': 1, 'collection_status': 'START',
+                             'contact_ids': ['contact_id_1', 'contact_id_2', 'contact_id_3'],
+                             'next_contact_key': None, 'collected_count': 3, 'collection_goal': 5,
+                             'collection_status': 'START',
                              'collection_name': 'test_collection_name', 'collection_info': None}
         actual_response = collection_request_manager.get_collection_request_given_pin('123456')
         self.assertEqual(actual_response, expected_response)
 
-        # test 2
+        # test 2: the contact ids page by page
+        first_page = collection_request_manager.get_collection_request_given_pin('123456', page_size=2)
+        self.assertEqual(first_page['contact_ids'], ['contact_id_1', 'contact_id_2'])
+        second_page = collection_request_manager.get_collection_request_given_pin(
+            '123456', page_size=2, start_key=first_page['next_contact_key'])
+        self.assertEqual(second_page['contact_ids'], ['contact_id_3'])
+        self.assertIsNone(second_page['next_contact_key'])
+
+        # test 3: not migrated yet
         with table.batch_writer() as batch:
             user_item = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '987654', 'conversationPIN': '123456',
                          'mode': 'bot', 'contactIDs': ['123'], 'collectionGoal': 1, 'collectionStatus': 'PAUSE',
@@ -155,12 +186,13 @@ class TestCollectionRequestManage(unittest.TestCase):
             batch.put_item(Item=user_item)
 
         expected_response = {'collection_pin': '987654', 'conversation_pin': '123456', 'mode': 'bot',
-                             'collection_info': 'OrderFlowers', 'contact_ids': ['123'], 'collection_goal': 1,
+                             'collection_info': 'OrderFlowers', 'contact_ids': ['123'], 'next_contact_key': None,
+                             'collected_count': 1, 'collection_goal': 1,
                              'collection_status': 'PAUSE', 'collection_name': 'test_collection_name'}
         actual_response = collection_request_manager.get_collection_request_given_pin('987654')
         self.assertEqual(actual_response, expected_response)
 
-        # test 3
+        # test 4
         expected_response = True
         response = collection_request_manager.get_collection_request_given_pin('invalid_collection_pin')
         actual_response = 'error' in response
@@ -186,8 +218,9 @@ class TestCollectionRequestManage(unittest.TestCase):
         session = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: collection_pin})
         if 'Item' not in session:
             raise AssertionError
-        expected_response = {'collectionPIN': '123456', 'conversationPIN': '987654', 'mode': 'human', 'contactIDs': [],
-                             'collectionGoal': 10, 'collectionStatus': 'START', 'collectionName': collection_name,
+        expected_response = {'collectionPIN': '123456', 'conversationPIN': '987654', 'mode': 'human',
+                             'collectedCount': 0, 'collectionGoal': 10, 'collectionStatus': 'START',
+                             'collectionName': collection_name,
                              'routingInfo': {}}
         actual_response = session['Item']
         self.assertEqual(actual_response, expected_response)
@@ -208,8 +241,8 @@ class TestCollectionRequestManage(unittest.TestCase):
         session = table.get_item(Key={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: collection_pin})
         if 'Item' not in session:
             raise AssertionError
-        expected_response = {'collectionPIN': '987654', 'conversationPIN': '123456', 'mode': 'bot', 'contactIDs': [],
-                             'collectionGoal': 1, 'collectionStatus': 'START',
+        expected_response = {'collectionPIN': '987654', 'conversationPIN': '123456', 'mode': 'bot',
+                             'collectedCount': 0, 'collectionGoal': 1, 'collectionStatus': 'START',
                              'collectionBot': 'OrderFlowers', 'collectionName': collection_name}
         actual_response = session['Item']
         self.assertEqual(actual_response, expected_response)
@@ -300,7 +333,7 @@ class TestCollectionRequestManage(unittest.TestCase):
             raise AssertionError
         expected_response = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: collection_pin,
                              utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: conversation_pin, 'mode': 'human',
-                             'contactIDs': [], 'collectionGoal': 1, 'collectionStatus': 'START',
+                             'collectedCount': 0, 'collectionGoal': 1, 'collectionStatus': 'START',
                              'collectionName': 'test_collection_name',
                              'routingInfo': {'queueNumber': '1', 'queueID': 'test_queue_id',
                                              'routingProfileID': 'test_routing_profile_id'}}
@@ -328,11 +361,19 @@ class TestCollectionRequestManage(unittest.TestCase):
         if 'Item' not in session:
             raise AssertionError
         expected_response = {'collectionPIN': collection_pin, 'conversationPIN': conversation_pin, 'mode': mode,
-                             'contactIDs': [], 'collectionGoal': collection_goal, 'collectionStatus': 'START',
+                             'collectedCount': 0, 'collectionGoal': collection_goal,
+                             'collectionStatus': 'START',
                              'collectionBot': collection_bot, 'collectionName': 'test_collection_name'}
         actual_response = session['Item']
         self.assertEqual(actual_response, expected_response)
 
+        # test 3: the collection PIN is released if the collection request is not saved
+        with mock.patch.object(collection_request_manager, 'save2db', side_effect=IOError('Connection reset')):
+            with self.assertRaises(IOError):
+                collection_request_manager.generate_collection_request_given_info(mode, collection_bot,
+                                                                                  collection_goal, collection_name)
+        self.assertFalse(any(utils.PIN_RESERVATION_ATTRIBUTE in item for item in table.scan()['Items']))
+
     @mock_dynamodb2
     @mock.patch('{}.generate_collection_pin'.format(collection_request_manager_method_prefix), return_value='123456')
     @mock.patch('{}.generate_conversation_pin'.format(collection_request_manager_method_prefix), return_value='987654')
@@ -344,8 +385,9 @@ class TestCollectionRequestManage(unittest.TestCase):
     def test1_generate_collection_request(self, input1, input2, input3, input4, input5, input6, input7):
         helper.create_mock_dynamodb_collection_session_table()
         collection_request_manager.generate_collect_request()
-        expected_response = {'collectionPIN': '123456', 'conversationPIN': '987654', 'mode': 'human', 'contactIDs': [],
-                             'collectionGoal': 10, 'collectionStatus': 'START', 'collectionName': 'name',
+        expected_response = {'collectionPIN': '123456', 'conversationPIN': '987654', 'mode': 'human',
+                             'collectedCount': 0, 'collectionGoal': 10, 'collectionStatus': 'START',
+                             'collectionName': 'name',
                              'routingInfo': {}}
 
         dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION_NAME)
@@ -366,8 +408,8 @@ class TestCollectionRequestManage(unittest.TestCase):
     def test2_generate_collection_request(self, input1, input2, input3, input4, input5, input6):
         helper.create_mock_dynamodb_collection_session_table()
         collection_request_manager.generate_collect_request()
-        expected_response = {'collectionPIN': '123456', 'conversationPIN': '987654', 'mode': 'bot', 'contactIDs': [],
-                             'collectionGoal': 10, 'collectionStatus': 'START',
+        expected_response = {'collectionPIN': '123456', 'conversationPIN': '987654', 'mode': 'bot',
+                             'collectedCount': 0, 'collectionGoal': 10, 'collectionStatus': 'START',
                              'collectionBot': 'OrderFlowers', 'collectionName': 'name'}
 
         dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION_NAME)
@@ -393,7 +435,7 @@ class TestCollectionRequestManage(unittest.TestCase):
         self.assertEqual(actual_response, expected_response)
 
         expected_response = 0
-        actual_response = collection_request_manager.get_num_available_queue()
+        actual_response = collection_request_manager.get_num_available_queue(refresh=True)
         self.assertEqual(actual_response, expected_response)
 
         # test 2
@@ -416,7 +458,7 @@ class TestCollectionRequestManage(unittest.TestCase):
             batch.put_item(Item=actual_response_num3)
 
         expected_response = 3
-        actual_response = collection_request_manager.get_num_available_queue()
+        actual_response = collection_request_manager.get_num_available_queue(refresh=True)
         self.assertEqual(actual_response, expected_response)
 
     @mock_dynamodb2
@@ -427,7 +469,7 @@ class TestCollectionRequestManage(unittest.TestCase):
 
         # test 1
         expected_response = 0
-        actual_response = collection_request_manager.get_num_available_queue()
+        actual_response = collection_request_manager.get_num_available_queue(refresh=True)
         self.assertEqual(actual_response, expected_response)
 
         # test 2
@@ -443,19 +485,28 @@ class TestCollectionRequestManage(unittest.TestCase):
             batch.put_item(Item=routing_info_num3)
 
         expected_response = 3
-        actual_response = collection_request_manager.get_num_available_queue()
+        actual_response = collection_request_manager.get_num_available_queue(refresh=True)
         self.assertEqual(actual_response, expected_response)
 
-        # test 3
+        # test 3: the cached number follows the checkouts and releases, without scanning the queue pool
+        with mock.patch.object(collection_request_manager.queue_allocator, 'count') as count:
+            routing_info = collection_request_manager.get_routing_info()
+            self.assertEqual(collection_request_manager.get_num_available_queue(), 2)
+            collection_request_manager.queue_allocator.release(routing_info)
+            self.assertEqual(collection_request_manager.get_num_available_queue(), 3)
+        count.assert_not_called()
+
+        # test 4: a queue taken by another process is only counted once the cached number expires
         table.delete_item(
             Key={
                 'queueNumber': 1
             }
         )
-        expected_response = 2
-        actual_response = collection_request_manager.get_num_available_queue()
+        self.assertEqual(collection_request_manager.get_num_available_queue(), 3)
+        with mock.patch.object(collection_request_manager.queue_allocator, 'count_ttl', 0):
+            expected_response = 2
+            actual_response = collection_request_manager.get_num_available_queue()
         self.assertEqual(actual_response, expected_response)
 
-
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,133 @@
+# test_consume_ctr_stream.py: Unit test for the consume_ctr_stream lambda function
+
+import unittest
+import mock
+from moto import mock_s3
+import base64
+import json
+import time
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
+
+helper.set_mock_lambda_environment()
+import consume_ctr_stream
+
+CONNECT_BUCKET_NAME = 'test-connect-bucket'
+
+
+def get_record(sequence_number, contact_id, agent=True, recording=True, **attributes):
+    ctr = {'ContactId': contact_id, 'Agent': {'Username': 'test_agent'} if agent else None,
+           'Recording': {'Location': '{}/connect/CallRecordings/{}.wav'.format(CONNECT_BUCKET_NAME, contact_id)}
+           if agent and recording else None}
+    ctr.update(attributes)
+    return {'kinesis': {'sequenceNumber': sequence_number,
+                        'data': base64.b64encode(json.dumps(ctr).encode()).decode()}}
+
+
+class TestConsumeCtrStream(unittest.TestCase):
+    @mock_s3
+    def test_lambda_handler(self):
+        s3_client = boto3.client('s3', region_name=helper.AWS_REGION_NAME)
+        s3_client.create_bucket(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME)
+        s3_client.create_bucket(Bucket=CONNECT_BUCKET_NAME)
+        recording = b'\x01' * (6 * 1024 * 1024)
+        for contact_id in ['contact_id_human', 'contact_id_copied']:
+            s3_client.put_object(Bucket=CONNECT_BUCKET_NAME, Key='connect/CallRecordings/{}.wav'.format(contact_id),
+                                 Body=recording)
+        # Copied by an attempt that failed before deleting the source, or moved by an attempt that failed later on
+        for contact_id in ['contact_id_copied', 'contact_id_moved']:
+            s3_client.put_object(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME,
+                                 Key='{0}/call_recordings_{0}.wav'.format(contact_id), Body=recording)
+        records = [get_record('1', 'contact_id_human'), get_record('2', 'contact_id_bot', agent=False),
+                   get_record('3', 'contact_id_missing'), get_record('4', 'contact_id_copied'),
+                   get_record('5', 'contact_id_moved'), get_record('6', 'contact_id_unrecorded', recording=False)]
+
+        # Copy by parts of 5 MB
+        transfer_config = TransferConfig(multipart_threshold=5 * 1024 * 1024, multipart_chunksize=5 * 1024 * 1024)
+        s3_copy = consume_ctr_stream.s3_client.copy
+        with mock.patch.object(consume_ctr_stream, 'TRANSFER_CONFIG', transfer_config), \
+                mock.patch.object(consume_ctr_stream.s3_client, 'copy', wraps=s3_copy) as copy:
+            response = consume_ctr_stream.lambda_handler({'Records': records}, None)
+
+        # test 1: a missing call recording is skipped, the records are not retried
+        self.assertEqual(response, {'batchItemFailures': []})
+
+        # test 2: the recordings are moved, the ones already copied are not copied again
+        self.assertEqual(copy.call_count, 1)
+        self.assertNotIn('Contents', s3_client.list_objects_v2(Bucket=CONNECT_BUCKET_NAME))
+        keys = sorted(s3_object['Key'] for s3_object in
+                      s3_client.list_objects_v2(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME)['Contents'])
+        self.assertEqual(keys, ['contact_id_bot/ctr_contact_id_bot.json',
+                                'contact_id_copied/call_recordings_contact_id_copied.wav',
+                                'contact_id_copied/ctr_contact_id_copied.json',
+                                'contact_id_human/call_recordings_contact_id_human.wav',
+                                'contact_id_human/ctr_contact_id_human.json',
+                                'contact_id_missing/ctr_contact_id_missing.json',
+                                'contact_id_moved/call_recordings_contact_id_moved.wav',
+                                'contact_id_moved/ctr_contact_id_moved.json',
+                                'contact_id_unrecorded/ctr_contact_id_unrecorded.json'])
+        self.assertEqual(s3_client.get_object(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME,
+                                              Key='contact_id_human/call_recordings_contact_id_human.wav')[
+                             'Body'].read(), recording)
+        ctr = json.loads(s3_client.get_object(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME,
+                                              Key='contact_id_bot/ctr_contact_id_bot.json')['Body'].read())
+        self.assertEqual(ctr['ContactId'], 'contact_id_bot')
+
+    @mock_s3
+    def test_lambda_handler_s3_error(self):
+        s3_client = boto3.client('s3', region_name=helper.AWS_REGION_NAME)
+        s3_client.create_bucket(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME)
+        s3_client.create_bucket(Bucket=CONNECT_BUCKET_NAME)
+        s3_client.put_object(Bucket=CONNECT_BUCKET_NAME, Key='connect/CallRecordings/contact_id_human.wav',
+                             Body=b'\x01')
+        error = ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Please reduce your request rate.'}},
+                            'CopyObject')
+        with mock.patch.object(consume_ctr_stream.s3_client, 'copy', side_effect=error):
+            response = consume_ctr_stream.lambda_handler({'Records': [get_record('1', 'contact_id_human')]}, None)
+
+        # test: the record is retried, the call recording is kept at its source
+        self.assertEqual(response, {'batchItemFailures': [{'itemIdentifier': '1'}]})
+        self.assertEqual(len(s3_client.list_objects_v2(Bucket=CONNECT_BUCKET_NAME)['Contents']), 1)
+
+
+    @mock_s3
+    def test_lambda_handler_same_contact(self):
+        s3_client = boto3.client('s3', region_name=helper.AWS_REGION_NAME)
+        s3_client.create_bucket(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME)
+        # A CTR updated after the first one, and the CTR of another contact, in the same batch
+        records = [get_record('10', 'contact_id_bot', agent=False, Version=1),
+                   get_record('11', 'contact_id_other', agent=False),
+                   get_record('12', 'contact_id_bot', agent=False, Version=2)]
+        put_object = consume_ctr_stream.s3_client.put_object
+
+        def slow_put_object(**kwargs):
+            # The older CTR would be written last if the records of a contact were processed concurrently
+            if b'"Version": 1' in kwargs['Body'].encode():
+                time.sleep(0.2)
+            return put_object(**kwargs)
+
+        with mock.patch.object(consume_ctr_stream.s3_client, 'put_object', side_effect=slow_put_object):
+            response = consume_ctr_stream.lambda_handler({'Records': records}, None)
+
+        # test 1: the newer CTR is kept
+        self.assertEqual(response, {'batchItemFailures': []})
+        ctr = json.loads(s3_client.get_object(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME,
+                                              Key='contact_id_bot/ctr_contact_id_bot.json')['Body'].read())
+        self.assertEqual(ctr['Version'], 2)
+
+        # test 2: the records following a failed record of the same contact are retried with it
+        error = ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Please reduce your request rate.'}},
+                            'PutObject')
+        with mock.patch.object(consume_ctr_stream.s3_client, 'put_object', side_effect=[error, {}]) as put:
+            response = consume_ctr_stream.lambda_handler({'Records': records[::2]}, None)
+        self.assertEqual(put.call_count, 1)
+        self.assertEqual(response, {'batchItemFailures': [{'itemIdentifier': '10'}, {'itemIdentifier': '12'}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# test_forward_kvs_parser_queue.py: Unit test for the forward_kvs_parser_queue lambda function
+
+import unittest
+import mock
+import json
+import boto3
+from botocore.exceptions import ClientError
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
+
+helper.set_mock_lambda_environment()
+import forward_kvs_parser_queue
+import trigger_lambda_function
+from test_trigger_lambda_function import EVENT, EXPECTED_OUTPUT_EVENT
+
+
+def get_record(message_id, output_event):
+    return {'messageId': message_id, 'body': json.dumps(output_event), 'eventSource': 'aws:sqs'}
+
+
+class TestForwardKvsParserQueue(unittest.TestCase):
+    def test_lambda_handler(self):
+        # The message body queued by trigger_lambda_function is forwarded unchanged
+        queue_url = 'https://queue.amazonaws.com/123456789012/test_kvs_parser_queue'
+        with mock.patch.object(trigger_lambda_function, 'KVS_PARSER_QUEUE_URL', queue_url), \
+                mock.patch.object(trigger_lambda_function, 'sqs_client') as sqs_client:
+            trigger_lambda_function.lambda_handler(EVENT, None)
+        message_body = sqs_client.send_message.call_args[1]['MessageBody']
+        event = {'Records': [{'messageId': 'test_message_id', 'body': message_body, 'eventSource': 'aws:sqs'}]}
+
+        with mock.patch.object(forward_kvs_parser_queue.lambda_client, 'invoke') as invoke:
+            response = forward_kvs_parser_queue.lambda_handler(event, None)
+        self.assertEqual(response, {'batchItemFailures': []})
+        invoke.assert_called_once_with(FunctionName='KVSTranscribeStreamingLambda', InvocationType='Event',
+                                       Payload=mock.ANY)
+        self.assertEqual(json.loads(invoke.call_args[1]['Payload']), EXPECTED_OUTPUT_EVENT)
+
+    def test_lambda_handler_failure(self):
+        # Only the messages which could not be forwarded are retried
+        error = ClientError({'Error': {'Code': 'TooManyRequestsException', 'Message': 'Rate exceeded'}}, 'Invoke')
+        event = {'Records': [get_record('message_1', EXPECTED_OUTPUT_EVENT),
+                             {'messageId': 'message_2', 'body': 'not json', 'eventSource': 'aws:sqs'},
+                             get_record('message_3', EXPECTED_OUTPUT_EVENT)]}
+        with mock.patch.object(forward_kvs_parser_queue.lambda_client, 'invoke', side_effect=[None, error]) \
+                as invoke:
+            response = forward_kvs_parser_queue.lambda_handler(event, None)
+        self.assertEqual(invoke.call_count, 2)
+        self.assertEqual(response, {'batchItemFailures': [{'itemIdentifier': 'message_2'},
+                                                          {'itemIdentifier': 'message_3'}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# test_import_time.py: Guard the start-up time of the command line, measured by python -X importtime
+
+import unittest
+import os
+import sys
+import subprocess
+
+source_directory = os.path.join(os.path.dirname(__file__), '..', 'src')
+PACKAGE_NAME = 'aws_deep_sense_spoken_data_collection_framework'
+# Modules only needed by the operations which process audio or open the Contact Center Portal
+HEAVY_MODULES = ['numpy', 'scipy', 'selenium']
+# Generous budgets, far above the time measured on a laptop, so that only a heavy import added back fails
+FRAMEWORK_RUNNER_IMPORT_BUDGET_SECONDS = 0.5
+COLLECTION_REQUEST_MANAGER_IMPORT_BUDGET_SECONDS = 2
+
+
+def import_time(module_name):
+    """
+    Import a module in a new interpreter with -X importtime
+
+    :param module_name: module to import
+    :return: cumulative import time of every imported module in seconds, keyed by module name
+    """
+    # Only the framework is added to the path, nothing else is imported at start-up
+    env = dict(os.environ, PYTHONPATH=source_directory)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module_name)],
+                            env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    import_times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        import_times[name.strip()] = int(cumulative_us) / 1000000
+    return import_times
+
+
+class TestImportTime(unittest.TestCase):
+    def assertNotImported(self, import_times, module_names):
+        imported = [name for name in import_times if name.split('.')[0] in module_names]
+        self.assertEqual(imported, [])
+
+    def test_framework_runner(self):
+        module_name = '{}.framework_runner'.format(PACKAGE_NAME)
+        import_times = import_time(module_name)
+        # Nothing but the argument parser is imported before the operation is known
+        self.assertNotImported(import_times, HEAVY_MODULES + ['boto3', 'botocore'])
+        self.assertLess(import_times[module_name], FRAMEWORK_RUNNER_IMPORT_BUDGET_SECONDS)
+
+    def test_collection_request_manager(self):
+        module_name = '{}.collection_request_manager'.format(PACKAGE_NAME)
+        import_times = import_time(module_name)
+        self.assertNotImported(import_times, HEAVY_MODULES)
+        self.assertLess(import_times[module_name], COLLECTION_REQUEST_MANAGER_IMPORT_BUDGET_SECONDS)
+
+    def test_user_manager(self):
+        self.assertNotImported(import_time('{}.user_manager'.format(PACKAGE_NAME)), HEAVY_MODULES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# test_lambda_cache.py: Unit test for the warm container cache of the lambda functions
+
+import unittest
+import boto3
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
+
+helper.set_mock_lambda_environment()
+import lambda_cache
+
+
+class TestLambdaCache(unittest.TestCase):
+    def test_get_client(self):
+        client = lambda_cache.get_client('s3', region_name=helper.AWS_REGION_NAME)
+        self.assertIs(lambda_cache.get_client('s3', region_name=helper.AWS_REGION_NAME), client)
+        self.assertIsNot(lambda_cache.get_client('lambda', region_name=helper.AWS_REGION_NAME), client)
+        resource = lambda_cache.get_resource('dynamodb', region_name=helper.AWS_REGION_NAME)
+        self.assertIs(lambda_cache.get_resource('dynamodb', region_name=helper.AWS_REGION_NAME), resource)
+
+    def test_ttl_cache(self):
+        now = [1000]
+        items = {'12345': 'human'}
+        lookups = []
+
+        @lambda_cache.ttl_cache(ttl=60, clock=lambda: now[0])
+        def get_mode(collection_pin):
+            lookups.append(collection_pin)
+            return items.get(collection_pin)
+
+        # test 1: memoized by the arguments
+        self.assertEqual(get_mode('12345'), 'human')
+        self.assertEqual(get_mode('12345'), 'human')
+        self.assertEqual(lookups, ['12345'])
+
+        # test 2: a missing item is looked up again
+        self.assertIsNone(get_mode('98765'))
+        items['98765'] = 'bot'
+        self.assertEqual(get_mode('98765'), 'bot')
+        self.assertEqual(lookups, ['12345', '98765', '98765'])
+
+        # test 3: a result expires after the ttl
+        now[0] += 60
+        self.assertEqual(get_mode('12345'), 'human')
+        self.assertEqual(lookups, ['12345', '98765', '98765', '12345'])
+        get_mode.cache_clear()
+        get_mode('12345')
+        self.assertEqual(len(lookups), 5)
+
+    def test_log_start_latency(self):
+        lambda_cache.is_cold_start = True
+
+        @lambda_cache.log_start_latency
+        def lambda_handler(event, context):
+            return {'response': event}
+
+        with self.assertLogs(level='INFO') as logs:
+            self.assertEqual(lambda_handler('test_event', None), {'response': 'test_event'})
+            self.assertEqual(lambda_handler('test_event', None), {'response': 'test_event'})
+        self.assertRegex(logs.output[0], r'Cold start: [\d.]+ ms, including [\d.]+ ms of initialization\.')
+        self.assertRegex(logs.output[1], r'Warm start: [\d.]+ ms\.')
+
+
+if __name__ == '__main__':
+    unittest.main()
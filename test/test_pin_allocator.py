@@ -0,0 +1,110 @@
+# test_pin_allocator.py: Unit test for the PIN code allocator
+
+import unittest
+from moto import mock_dynamodb2
+import os
+import time
+import boto3
+import mock
+from botocore.exceptions import ClientError
+import aws_deep_sense_spoken_data_collection_framework.utils as utils
+from aws_deep_sense_spoken_data_collection_framework.pin_allocator import PinAllocator, RESERVATION_ATTRIBUTE, \
+    RESERVATION_EXPIRY_ATTRIBUTE
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
+
+# Retrieve AWS Access Key
+test_data_directory = os.path.join(os.path.dirname(__file__), '..', 'test-data')
+config_test_path = os.path.join(test_data_directory, 'aws_config_test')
+
+ACCESS_KEY_ID, ACCESS_KEY = utils.get_aws_access_key(config_test_path)
+AWS_REGION_NAME = utils.get_aws_region_name(config_test_path)
+
+
+def get_pin_allocator(num_digit):
+    return PinAllocator(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, utils.USER_ACCOUNT_DYNAMODB_TABLE,
+                        utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY, num_digit)
+
+
+class TestPinAllocator(unittest.TestCase):
+    @mock_dynamodb2
+    def test_reserve(self):
+        helper.create_mock_dynamodb_user_account_table()
+        pin_allocator = get_pin_allocator(1)
+        with self.assertLogs(level='WARNING'):
+            PINs = [pin_allocator.reserve() for _ in range(9)]
+        self.assertCountEqual(PINs, [str(i) for i in range(1, 10)])
+        # Every PIN code is reserved in AWS Dynamo DB
+        table = boto3.resource('dynamodb', region_name=AWS_REGION_NAME).Table(utils.USER_ACCOUNT_DYNAMODB_TABLE)
+        for PIN in PINs:
+            item = table.get_item(Key={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: PIN})['Item']
+            self.assertIn(RESERVATION_ATTRIBUTE, item)
+            # Deleted by the time to live of the table if never saved
+            self.assertGreater(item[RESERVATION_EXPIRY_ATTRIBUTE], time.time())
+        # The PIN code space is exhausted
+        self.assertEqual(pin_allocator.saturation(), 1)
+        with self.assertRaises(RuntimeError):
+            pin_allocator.reserve()
+
+    @mock_dynamodb2
+    def test_reserve_conflict(self):
+        helper.create_mock_dynamodb_user_account_table()
+        pin_allocator = get_pin_allocator(1)
+        pin_allocator.refresh()
+        # PIN codes written by another process after the bitmap is loaded
+        table = boto3.resource('dynamodb', region_name=AWS_REGION_NAME).Table(utils.USER_ACCOUNT_DYNAMODB_TABLE)
+        for i in range(1, 9):
+            table.put_item(Item={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: str(i)})
+        self.assertEqual(pin_allocator.reserve(), '9')
+
+    @mock_dynamodb2
+    def test_reserve_batch(self):
+        helper.create_mock_dynamodb_user_account_table()
+        pin_allocator = get_pin_allocator(2)
+        PINs = pin_allocator.reserve_batch(60)
+        self.assertEqual(len(PINs), 60)
+        self.assertEqual(len(set(PINs)), 60)
+        table = boto3.resource('dynamodb', region_name=AWS_REGION_NAME).Table(utils.USER_ACCOUNT_DYNAMODB_TABLE)
+        self.assertEqual(len(table.scan()['Items']), 60)
+
+    @mock_dynamodb2
+    def test_refresh_and_release(self):
+        helper.create_mock_dynamodb_user_account_table()
+        table = boto3.resource('dynamodb', region_name=AWS_REGION_NAME).Table(utils.USER_ACCOUNT_DYNAMODB_TABLE)
+        table.put_item(Item={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: '12'})
+        pin_allocator = get_pin_allocator(2)
+        pin_allocator.refresh()
+        self.assertTrue(pin_allocator.is_used('12'))
+        self.assertFalse(pin_allocator.is_used('13'))
+        # Saved items are not deleted by a release
+        pin_allocator.release('12')
+        self.assertIn('Item', table.get_item(Key={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: '12'}))
+        PIN = pin_allocator.reserve()
+        pin_allocator.release(PIN)
+        self.assertNotIn('Item', table.get_item(Key={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: PIN}))
+
+
+    @mock_dynamodb2
+    def test_reserve_error(self):
+        helper.create_mock_dynamodb_user_account_table()
+        pin_allocator = get_pin_allocator(2)
+        pin_allocator.refresh()
+        error = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'PutItem')
+        table = mock.Mock()
+        table.put_item.side_effect = error
+        table.meta.client.transact_write_items.side_effect = error
+        with mock.patch.object(PinAllocator, 'table', new_callable=mock.PropertyMock, return_value=table):
+            with self.assertRaises(ClientError):
+                pin_allocator.reserve()
+            with self.assertRaises(ClientError):
+                pin_allocator.reserve_batch(30)
+        # No PIN code is marked used by a failed request
+        self.assertEqual(pin_allocator.saturation(), 0)
+        self.assertEqual(len(pin_allocator.reserve_batch(30)), 30)
+        self.assertEqual(pin_allocator.num_used_pin, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
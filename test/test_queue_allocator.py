@@ -0,0 +1,111 @@
+# test_queue_allocator.py: Unit test for the queue pool allocator
+
+import unittest
+from moto import mock_dynamodb2
+import moto.dynamodb2.models
+import mock
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import aws_deep_sense_spoken_data_collection_framework.utils as utils
+from aws_deep_sense_spoken_data_collection_framework.queue_allocator import QueueAllocator
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
+
+# Retrieve AWS Access Key
+test_data_directory = os.path.join(os.path.dirname(__file__), '..', 'test-data')
+config_test_path = os.path.join(test_data_directory, 'aws_config_test')
+
+ACCESS_KEY_ID, ACCESS_KEY = utils.get_aws_access_key(config_test_path)
+AWS_REGION_NAME = utils.get_aws_region_name(config_test_path)
+
+
+def put_queues(num_queue):
+    table = boto3.resource('dynamodb', region_name=AWS_REGION_NAME).Table(utils.QUEUE_POOL_DYNAMODB_TABLE)
+    routing_infos = [{utils.QUEUE_POOL_DYNAMODB_TABLE_KEY: queue_number, 'queueID': 'test_queue_id_{}'.format(
+        queue_number), 'routingProfileID': 'test_routing_profile_id'} for queue_number in range(1, num_queue + 1)]
+    with table.batch_writer() as batch:
+        for routing_info in routing_infos:
+            batch.put_item(Item=routing_info)
+    return table, routing_infos
+
+
+class TestQueueAllocator(unittest.TestCase):
+    @mock_dynamodb2
+    def test_checkout_and_release(self):
+        helper.create_mock_dynamodb_queue_pool_table()
+        table, routing_infos = put_queues(3)
+        queue_allocator = QueueAllocator(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+
+        # test 1: every queue is checked out once, with its routing information
+        checked_out = [queue_allocator.checkout() for _ in range(3)]
+        self.assertCountEqual(checked_out, routing_infos)
+        self.assertEqual(table.scan()['Items'], [])
+        self.assertEqual(queue_allocator.num_free_queue(), 0)
+        self.assertIsNone(queue_allocator.checkout())
+
+        # test 2: a queue released twice is returned once
+        queue_allocator.release(checked_out[0])
+        queue_allocator.release(checked_out[0])
+        self.assertEqual(table.scan()['Items'], [checked_out[0]])
+        self.assertEqual(queue_allocator.num_free_queue(), 1)
+        self.assertEqual(queue_allocator.checkout(), checked_out[0])
+
+    @mock_dynamodb2
+    def test_checkout_conflict(self):
+        helper.create_mock_dynamodb_queue_pool_table()
+        table, routing_infos = put_queues(3)
+        queue_allocator = QueueAllocator(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+        queue_allocator.refresh()
+        # Queues checked out by another process after the cache is loaded, and a queue it released
+        table.delete_item(Key={utils.QUEUE_POOL_DYNAMODB_TABLE_KEY: 1})
+        table.delete_item(Key={utils.QUEUE_POOL_DYNAMODB_TABLE_KEY: 2})
+        self.assertEqual(queue_allocator.checkout(), routing_infos[2])
+        table.put_item(Item=routing_infos[0])
+        self.assertEqual(queue_allocator.checkout(), routing_infos[0])
+        self.assertIsNone(queue_allocator.checkout())
+
+    @mock_dynamodb2
+    def test_checkout_concurrent(self):
+        num_queue = 10
+        num_callers = 40
+        helper.create_mock_dynamodb_queue_pool_table()
+        table, routing_infos = put_queues(num_queue)
+
+        # DynamoDB applies the writes on one item one at a time, moto's in-memory backend does not lock
+        delete_lock = threading.Lock()
+        delete_item = moto.dynamodb2.models.DynamoDBBackend.delete_item
+
+        def locked_delete_item(*args, **kwargs):
+            with delete_lock:
+                return delete_item(*args, **kwargs)
+
+        start_barrier = threading.Barrier(num_callers)
+
+        def checkout(queue_allocator):
+            start_barrier.wait()
+            return queue_allocator.checkout()
+
+        # Each caller is a separate process with its own cache
+        queue_allocators = [QueueAllocator(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME) for _ in range(num_callers)]
+        for queue_allocator in queue_allocators:
+            queue_allocator.refresh()
+        with mock.patch.object(moto.dynamodb2.models.DynamoDBBackend, 'delete_item', locked_delete_item), \
+                ThreadPoolExecutor(max_workers=num_callers) as executor:
+            results = list(executor.map(checkout, queue_allocators))
+
+        # Every queue is checked out by exactly one caller
+        checked_out = [routing_info for routing_info in results if routing_info is not None]
+        self.assertCountEqual(checked_out, routing_infos)
+        self.assertEqual(table.scan()['Items'], [])
+
+        for routing_info in checked_out:
+            queue_allocators[0].release(routing_info)
+        self.assertEqual(len(table.scan()['Items']), num_queue)
+
+
+if __name__ == '__main__':
+    unittest.main()
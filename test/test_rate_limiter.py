@@ -0,0 +1,42 @@
+# test_rate_limiter.py: Unit test for the token bucket and the retries of the throttled calls
+
+import unittest
+import time
+import mock
+from botocore.exceptions import ClientError
+from aws_deep_sense_spoken_data_collection_framework.rate_limiter import TokenBucket, call_with_retry
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_token_bucket(self):
+        token_bucket = TokenBucket(rate=50, capacity=5)
+        start_time = time.monotonic()
+        # The burst is not throttled, the 10 following calls wait for 1/50 second each
+        for _ in range(15):
+            token_bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.18)
+
+    @mock.patch('aws_deep_sense_spoken_data_collection_framework.rate_limiter.time.sleep')
+    def test_call_with_retry(self, sleep):
+        throttled = ClientError({'Error': {'Code': 'TooManyRequestsException'}}, 'CreateUser')
+        rejected = ClientError({'Error': {'Code': 'InvalidParameterException'}}, 'CreateUser')
+
+        # test 1: a throttled call is retried
+        function = mock.MagicMock(side_effect=[throttled, throttled, 'test_response'])
+        self.assertEqual(call_with_retry(function), 'test_response')
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+        # test 2: any other error is raised at once, and throttling after the last attempt
+        function = mock.MagicMock(side_effect=rejected)
+        with self.assertRaises(ClientError):
+            call_with_retry(function)
+        self.assertEqual(function.call_count, 1)
+        function = mock.MagicMock(side_effect=throttled)
+        with self.assertRaises(ClientError):
+            call_with_retry(function, max_attempts=3)
+        self.assertEqual(function.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# test_store_lex_conversation.py: Unit test for the store_lex_conversation lambda function
+
+import unittest
+import mock
+from moto import mock_s3
+import collections
+import datetime
+import json
+import boto3
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
+
+helper.set_mock_lambda_environment()
+import store_lex_conversation
+
+LambdaContext = collections.namedtuple('LambdaContext', ['aws_request_id'])
+
+
+def get_bot_state_event(contact_id, turn):
+    return {'sessionAttributes': {'contactId': contact_id}, 'inputTranscript': 'turn {}'.format(turn),
+            'currentIntent': {'slots': {}}}
+
+
+def get_conversation_result_event(contact_id):
+    return {'Details': {'Parameters': {'contactId': contact_id, 'result': 'test_result'}}}
+
+
+class TestStoreLexConversation(unittest.TestCase):
+    @mock_s3
+    def test_store_lex_conversation(self):
+        s3_client = boto3.client('s3', region_name=helper.AWS_REGION_NAME)
+        s3_client.create_bucket(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME)
+        contact_id = 'test_contact_id'
+        # A state saved before the timestamped keys
+        s3_client.put_object(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME,
+                             Key='{0}/lex_bot_{0}_0'.format(contact_id), Body=json.dumps({'inputTranscript': 'turn 0'}))
+
+        # test 1: each turn is saved without listing the previous ones, concurrent turns never share a key
+        turn_time = datetime.datetime(2020, 7, 1, 12, 30, 10)
+        for turn in range(1, 12):
+            store_lex_conversation.save_bot_state_to_s3(get_bot_state_event(contact_id, turn), '2020-07-01T12:30:10Z',
+                                                        turn_time + datetime.timedelta(microseconds=turn // 2),
+                                                        'request_id_{}'.format(turn))
+        self.assertEqual(s3_client.list_objects_v2(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME)['KeyCount'], 12)
+        response = store_lex_conversation.lambda_handler(get_bot_state_event(contact_id, 12),
+                                                         LambdaContext('request_id_12'))
+        self.assertEqual(response, {'dialogAction': {'type': 'Delegate', 'slots': {}}})
+
+        # test 2: the turns are combined in order, more than one page of keys
+        with mock.patch.object(store_lex_conversation, 'LIST_OBJECTS_PAGE_SIZE', 5):
+            store_lex_conversation.lambda_handler(get_conversation_result_event(contact_id), None)
+        keys = [s3_object['Key'] for s3_object in
+                s3_client.list_objects_v2(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME)['Contents']]
+        self.assertEqual(keys, ['{0}/lex_bot_{0}.json'.format(contact_id)])
+        lex_bot_content = s3_client.get_object(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME, Key=keys[0])['Body'].read()
+        lex_bot_json = json.loads(lex_bot_content)
+        self.assertEqual(lex_bot_content.decode(), json.dumps(lex_bot_json, indent=4, sort_keys=True))
+        self.assertEqual(lex_bot_json['conversationResult'], 'test_result')
+        self.assertEqual([turn['inputTranscript'] for turn in lex_bot_json['conversationHistory']],
+                         ['turn {}'.format(turn) for turn in range(13)])
+
+
+    @mock_s3
+    def test_combine_bot_state_to_s3_without_turn(self):
+        s3_client = boto3.client('s3', region_name=helper.AWS_REGION_NAME)
+        s3_client.create_bucket(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME)
+        store_lex_conversation.combine_bot_state_to_s3(get_conversation_result_event('test_contact_id'),
+                                                       '2020-07-01T12:30:10Z')
+        lex_bot_content = s3_client.get_object(Bucket=helper.CALL_RECORDINGS_BUCKET_NAME,
+                                               Key='test_contact_id/lex_bot_test_contact_id.json')['Body'].read()
+        self.assertEqual(lex_bot_content.decode(), json.dumps(
+            {'conversationResult': 'test_result', 'conversationHistory': [],
+             'finishedTimestamp': '2020-07-01T12:30:10Z'}, indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# test_streaming_zip.py: Unit test for the streaming ZIP archive
+
+import unittest
+import mock
+import io
+import functools
+import zipfile
+import zlib
+import aws_deep_sense_spoken_data_collection_framework.streaming_zip as streaming_zip
+from aws_deep_sense_spoken_data_collection_framework.streaming_zip import StreamingZip, ZipEntry
+
+TEST_FILES = [('call_recordings_12345/12345/contact_id_1/call_recordings_contact_id_1.wav', bytes(range(256)) * 40),
+              ('call_recordings_12345/12345/contact_id_1/ctr_contact_id_1.json', b'{"customerPin": "111111"}'),
+              ('call_recordings_12345/12345/contact_id_2/empty.json', b''),
+              ('call_recordings_12345/12345/contact_id_2/unicode_é.json', b'{}' * 1000)]
+
+
+def get_test_entries(read_log=None, saved_crcs=None):
+    def get_reader(arcname, content):
+        def reader(offset):
+            if read_log is not None:
+                read_log.append((arcname, offset))
+            for position in range(offset, len(content), 1000):
+                yield content[position:position + 1000]
+        return reader
+    if saved_crcs is None:
+        return [ZipEntry(arcname, len(content), (2020, 7, 1, 12, 30, 10), get_reader(arcname, content), arcname)
+                for arcname, content in TEST_FILES]
+    return [ZipEntry(arcname, len(content), (2020, 7, 1, 12, 30, 10), get_reader(arcname, content), arcname,
+                     functools.partial(saved_crcs.get, arcname), functools.partial(saved_crcs.__setitem__, arcname))
+            for arcname, content in TEST_FILES]
+
+
+class TestStreamingZip(unittest.TestCase):
+    def setUp(self):
+        streaming_zip.clear_crc_cache()
+
+    def assert_valid_archive(self, archive_bytes):
+        with zipfile.ZipFile(io.BytesIO(archive_bytes)) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(zip_file.namelist(), [arcname for arcname, _ in TEST_FILES])
+            for arcname, content in TEST_FILES:
+                self.assertEqual(zip_file.read(arcname), content)
+                self.assertEqual(zip_file.getinfo(arcname).date_time, (2020, 7, 1, 12, 30, 10))
+
+    def test_iter_bytes(self):
+        archive = StreamingZip(get_test_entries())
+        archive_bytes = b''.join(archive.iter_bytes())
+        self.assertEqual(len(archive_bytes), archive.size)
+        self.assert_valid_archive(archive_bytes)
+
+    def test_iter_bytes_zip64(self):
+        with mock.patch.object(streaming_zip, 'ZIP64_LIMIT', 1000), \
+                mock.patch.object(streaming_zip, 'ZIP_FILECOUNT_LIMIT', 2):
+            archive = StreamingZip(get_test_entries())
+            self.assertTrue(any(archive.is_zip64))
+            archive_bytes = b''.join(archive.iter_bytes())
+        self.assertEqual(len(archive_bytes), archive.size)
+        self.assert_valid_archive(archive_bytes)
+
+    def test_iter_bytes_range(self):
+        archive_bytes = b''.join(StreamingZip(get_test_entries()).iter_bytes())
+        for start, end in [(0, 0), (0, 29), (10, 5000), (5000, 10339), (10400, len(archive_bytes) - 1),
+                           (len(archive_bytes) - 1, len(archive_bytes) + 10)]:
+            # Without cached CRC-32, the files before the range are read again
+            streaming_zip.clear_crc_cache()
+            archive = StreamingZip(get_test_entries())
+            self.assertEqual(b''.join(archive.iter_bytes(start, end)), archive_bytes[start:end + 1])
+
+    def test_iter_bytes_resume(self):
+        read_log = []
+        archive = StreamingZip(get_test_entries(read_log))
+        archive_bytes = b''.join(archive.iter_bytes())
+        # Resume in the middle of the last file, nothing but the rest of it is read again
+        read_log.clear()
+        start = archive_bytes.index(b'{}' * 1000) + 500
+        self.assertEqual(b''.join(archive.iter_bytes(start)), archive_bytes[start:])
+        self.assertEqual(read_log, [(TEST_FILES[-1][0], 500)])
+
+    def test_iter_bytes_saved_crc(self):
+        read_log = []
+        saved_crcs = {}
+        archive_bytes = b''.join(StreamingZip(get_test_entries(read_log, saved_crcs)).iter_bytes())
+        self.assertEqual(saved_crcs, {arcname: zlib.crc32(content) for arcname, content in TEST_FILES if content})
+        # Resume in another process, the saved CRC-32 spare reading the files before the range
+        streaming_zip.clear_crc_cache()
+        read_log.clear()
+        archive = StreamingZip(get_test_entries(read_log, saved_crcs))
+        start = archive_bytes.index(b'{}' * 1000) + 500
+        self.assertEqual(b''.join(archive.iter_bytes(start)), archive_bytes[start:])
+        self.assertEqual(read_log, [(TEST_FILES[-1][0], 500)])
+
+    def test_etag(self):
+        entries = get_test_entries()
+        self.assertEqual(StreamingZip(entries).etag, StreamingZip(get_test_entries()).etag)
+        entries[0] = entries[0]._replace(cache_key='changed')
+        self.assertNotEqual(StreamingZip(entries).etag, StreamingZip(get_test_entries()).etag)
+
+    def test_parse_range_header(self):
+        self.assertEqual(streaming_zip.parse_range_header('bytes=100-199', 1000), (100, 199))
+        self.assertEqual(streaming_zip.parse_range_header('bytes=100-', 1000), (100, 999))
+        self.assertEqual(streaming_zip.parse_range_header('bytes=-100', 1000), (900, 999))
+        self.assertEqual(streaming_zip.parse_range_header('bytes=900-2000', 1000), (900, 999))
+        self.assertIsNone(streaming_zip.parse_range_header('bytes=0-1,5-6', 1000))
+        self.assertIsNone(streaming_zip.parse_range_header(None, 1000))
+        with self.assertRaises(ValueError):
+            streaming_zip.parse_range_header('bytes=1000-', 1000)
+        with self.assertRaises(ValueError):
+            streaming_zip.parse_range_header('bytes=200-100', 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+# test_transcription_orchestrator.py: Unit test for the transcription orchestrator
+
+import unittest
+from moto import mock_dynamodb2
+import os
+import shutil
+import tempfile
+import boto3
+import mock
+from botocore.exceptions import ClientError
+from aws_deep_sense_spoken_data_collection_framework.call_recordings_manager import CallRecordingsManager
+from aws_deep_sense_spoken_data_collection_framework.transcription_orchestrator import TranscriptionOrchestrator, \
+    TranscribeStatusResolver
+import aws_deep_sense_spoken_data_collection_framework.utils as utils
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
+
+# Retrieve AWS Access Key
+test_data_directory = os.path.join(os.path.dirname(__file__), '..', 'test-data')
+config_test_path = os.path.join(test_data_directory, 'aws_config_test')
+
+ACCESS_KEY_ID, ACCESS_KEY = utils.get_aws_access_key(config_test_path)
+AWS_REGION_NAME = utils.get_aws_region_name(config_test_path)
+CALL_RECORDINGS_BUCKET_NAME = utils.get_call_recordings_bucket_name(config_test_path)
+
+call_recordings_manager = CallRecordingsManager(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME,
+                                                CALL_RECORDINGS_BUCKET_NAME)
+
+
+class TestTranscriptionOrchestrator(unittest.TestCase):
+    def setUp(self):
+        self.output_file_path = tempfile.mkdtemp()
+        self.transcript_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_file_path)
+        shutil.rmtree(self.transcript_directory)
+
+    @mock_dynamodb2
+    def test_run(self):
+        helper.create_mock_dynamodb_collection_session_table()
+        helper.create_mock_dynamodb_collection_contact_table()
+        table = boto3.resource('dynamodb', region_name=AWS_REGION_NAME).Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        contact_ids = ['test_contact_id_{}'.format(i) for i in range(5)]
+        helper.put_mock_dynamodb_collection_contacts('12345', contact_ids)
+        table.put_item(Item={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345',
+                             utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: '98765', 'mode': 'human',
+                             'collectedCount': 5, 'collectionGoal': 5, 'collectionStatus': 'STOP',
+                             'collectionName': 'test_collection_name', 'routingInfo': {}})
+        transcribe_client = helper.StubTranscribeClient(self.transcript_directory, num_polls_to_complete=2)
+        sleeps = []
+
+        def get_orchestrator():
+            return TranscriptionOrchestrator(call_recordings_manager, '12345', self.output_file_path,
+                                             transcribe_client=transcribe_client, max_in_flight=2,
+                                             initial_poll_interval=1, max_poll_interval=4, sleep=sleeps.append)
+
+        # test 1: a single pass starts no more jobs than the limit
+        summary = get_orchestrator().run()
+        self.assertEqual(summary, {'IN_PROGRESS': 2, 'NOT_STARTED': 3})
+        self.assertEqual(len(transcribe_client.jobs), 2)
+        self.assertEqual(sleeps, [])
+        # The contact ids not in the state yet are read once
+        self.assertEqual(transcribe_client.calls.count('get_transcription_job'), 5)
+        transcribe_client.calls.clear()
+
+        # test 2: wait until every transcript is downloaded, polling with backoff
+        summary = get_orchestrator().run(wait=True)
+        self.assertEqual(summary, {'DOWNLOADED': 5})
+        for contact_id in contact_ids:
+            self.assertTrue(os.path.isfile(os.path.join(self.output_file_path, contact_id,
+                                                        'transcribe_{}.json'.format(contact_id))))
+        self.assertTrue(all(interval <= 4 for interval in sleeps))
+        self.assertIn(2, sleeps)
+        # The jobs of the account are never listed, a poll reads the jobs in flight only,
+        # and a job is read once more to find its transcript
+        self.assertNotIn('list_transcription_jobs', transcribe_client.calls)
+        num_polls = len(sleeps) + 1
+        self.assertLessEqual(transcribe_client.calls.count('get_transcription_job'), 2 * num_polls + 5)
+
+        # test 3: nothing to do once everything is downloaded
+        num_calls = len(transcribe_client.calls)
+        summary = get_orchestrator().run(wait=True)
+        self.assertEqual(summary, {'DOWNLOADED': 5})
+        self.assertEqual(len(transcribe_client.calls), num_calls)
+
+    @mock_dynamodb2
+    def test_run_start_errors(self):
+        helper.create_mock_dynamodb_collection_session_table()
+        helper.create_mock_dynamodb_collection_contact_table()
+        table = boto3.resource('dynamodb', region_name=AWS_REGION_NAME).Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        contact_ids = ['test_contact_id_{}'.format(i) for i in range(4)]
+        helper.put_mock_dynamodb_collection_contacts('12345', contact_ids)
+        table.put_item(Item={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345',
+                             utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY: '98765', 'mode': 'human',
+                             'collectedCount': 4, 'collectionGoal': 4, 'collectionStatus': 'STOP',
+                             'collectionName': 'test_collection_name', 'routingInfo': {}})
+        transcribe_client = helper.StubTranscribeClient(self.transcript_directory, num_polls_to_complete=2)
+        # Started meanwhile by the web interface, rejected, throttled
+        errors = [ClientError({'Error': {'Code': error_code}}, 'StartTranscriptionJob')
+                  for error_code in ['ConflictException', 'BadRequestException', 'LimitExceededException']]
+
+        def get_orchestrator():
+            return TranscriptionOrchestrator(call_recordings_manager, '12345', self.output_file_path,
+                                             transcribe_client=transcribe_client, sleep=lambda seconds: None)
+
+        # test 1: only the rejected job fails, the throttled job and the following ones are not started yet
+        with mock.patch.object(transcribe_client, 'start_transcription_job', side_effect=errors) as start:
+            summary = get_orchestrator().run()
+        self.assertEqual(start.call_count, 3)
+        self.assertEqual(summary, {'IN_PROGRESS': 1, 'FAILED': 1, 'NOT_STARTED': 2})
+
+        # test 2: the jobs not started are started by the next run
+        summary = get_orchestrator().run()
+        self.assertEqual(summary, {'IN_PROGRESS': 3, 'FAILED': 1})
+        self.assertEqual(sorted(transcribe_client.jobs), contact_ids[2:])
+
+    def test_transcribe_status_resolver(self):
+        transcribe_client = helper.StubTranscribeClient(self.transcript_directory, num_polls_to_complete=1)
+        contact_ids = ['test_contact_id_{}'.format(i) for i in range(5)]
+        for contact_id in contact_ids[:3]:
+            transcribe_client.start_transcription_job(TranscriptionJobName=contact_id)
+        now = [1000]
+        resolver = TranscribeStatusResolver(transcribe_client, ttl=30, clock=lambda: now[0])
+
+        # test 1: nothing is cached yet
+        self.assertEqual(resolver.get_cached_statuses(contact_ids), dict.fromkeys(contact_ids))
+
+        # test 2: the listings of the queued and in progress jobs resolve the active ones,
+        # the others are read one by one, the ones without any job are not started
+        transcribe_client.calls.clear()
+        statuses = resolver.get_statuses(contact_ids)
+        self.assertEqual(statuses, {'test_contact_id_0': 'IN_PROGRESS', 'test_contact_id_1': 'IN_PROGRESS',
+                                    'test_contact_id_2': 'IN_PROGRESS', 'test_contact_id_3': 'NOT_STARTED',
+                                    'test_contact_id_4': 'NOT_STARTED'})
+        self.assertEqual(transcribe_client.calls, ['list_transcription_jobs'] * 3 + ['get_transcription_job'] * 2)
+
+        # test 3: served from the cache within the ttl
+        now[0] += 10
+        self.assertEqual(resolver.get_statuses(contact_ids), statuses)
+        self.assertEqual(len(transcribe_client.calls), 5)
+
+        # test 4: refreshed once expired, the jobs not listed as active any more are read one by one
+        now[0] += 30
+        statuses = resolver.get_statuses(contact_ids)
+        self.assertEqual([statuses[contact_id] for contact_id in contact_ids],
+                         ['COMPLETED', 'COMPLETED', 'COMPLETED', 'NOT_STARTED', 'NOT_STARTED'])
+        self.assertEqual(len(transcribe_client.calls), 10)
+
+        # test 5: the status of a finished job never expires
+        now[0] += 3600
+        self.assertEqual(resolver.get_statuses(contact_ids[:3]), {contact_id: 'COMPLETED'
+                                                                  for contact_id in contact_ids[:3]})
+        self.assertEqual(len(transcribe_client.calls), 10)
+
+        # test 6: a job started by this process is known without any listing
+        transcribe_client.start_transcription_job(TranscriptionJobName=contact_ids[3])
+        resolver.set_status(contact_ids[3], 'IN_PROGRESS')
+        self.assertEqual(resolver.get_statuses(contact_ids[3:4]), {'test_contact_id_3': 'IN_PROGRESS'})
+        self.assertEqual(transcribe_client.calls[10:], ['start_transcription_job'])
+
+        # test 7: a refresh does not depend on the jobs finished in the account
+        for i in range(20):
+            transcribe_client.start_transcription_job(TranscriptionJobName='test_other_job_{}'.format(i))
+            transcribe_client.complete_job('test_other_job_{}'.format(i))
+        transcribe_client.calls.clear()
+        now[0] += 30
+        self.assertEqual(resolver.get_statuses(contact_ids[3:]), {'test_contact_id_3': 'IN_PROGRESS',
+                                                                  'test_contact_id_4': 'NOT_STARTED'})
+        self.assertEqual(transcribe_client.calls, ['list_transcription_jobs'] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+# test_trigger_lambda_function.py: Unit test for the trigger_lambda_function lambda function
+
+import unittest
+import mock
+import json
+import boto3
+import unittest_helper_methods as helper
+
+# Set up default session for mocking AWS PYTHON SDK (boto3)
+boto3.setup_default_session()
+
+helper.set_mock_lambda_environment()
+import trigger_lambda_function
+
+EVENT = {'Details': {'ContactData': {'ContactId': 'test_contact_id', 'MediaStreams': {'Customer': {'Audio': {
+    'StreamARN': 'test_stream_arn', 'StartFragmentNumber': 'test_fragment_number'}}}}}}
+EXPECTED_OUTPUT_EVENT = {'streamARN': 'test_stream_arn', 'startFragmentNum': 'test_fragment_number',
+                         'connectContactId': 'test_contact_id', 'transcriptionEnabled': 'false',
+                         'saveCallRecording': 'true', 'languageCode': 'en-US'}
+
+
+class TestTriggerLambdaFunction(unittest.TestCase):
+    def test_lambda_handler_invoke(self):
+        with mock.patch.object(trigger_lambda_function.lambda_client, 'invoke') as invoke, \
+                self.assertLogs(level='INFO') as logs:
+            response = trigger_lambda_function.lambda_handler(EVENT, None)
+        self.assertEqual(response['statusCode'], trigger_lambda_function.HTTP_RESPONSE_SUCCESS_CODE)
+        invoke.assert_called_once_with(FunctionName='KVSTranscribeStreamingLambda', InvocationType='Event',
+                                       Payload=mock.ANY)
+        self.assertEqual(json.loads(invoke.call_args[1]['Payload']), EXPECTED_OUTPUT_EVENT)
+        self.assertTrue(any('Dispatch latency (invoke KVSTranscribeStreamingLambda)' in line
+                            for line in logs.output))
+
+    def test_lambda_handler_queue(self):
+        queue_url = 'https://queue.amazonaws.com/123456789012/test_kvs_parser_queue'
+        sqs_client = boto3.client('sqs', region_name=helper.AWS_REGION_NAME)
+        with mock.patch.object(trigger_lambda_function, 'KVS_PARSER_QUEUE_URL', queue_url), \
+                mock.patch.object(trigger_lambda_function, 'sqs_client', sqs_client), \
+                mock.patch.object(sqs_client, 'send_message') as send_message, \
+                mock.patch.object(trigger_lambda_function.lambda_client, 'invoke') as invoke:
+            response = trigger_lambda_function.lambda_handler(EVENT, None)
+        self.assertEqual(response['statusCode'], trigger_lambda_function.HTTP_RESPONSE_SUCCESS_CODE)
+        invoke.assert_not_called()
+        send_message.assert_called_once_with(QueueUrl=queue_url, MessageBody=mock.ANY)
+        self.assertEqual(json.loads(send_message.call_args[1]['MessageBody']), EXPECTED_OUTPUT_EVENT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,8 +3,10 @@
 import unittest
 import mock
 import os
+import io
 import boto3
 from moto import mock_dynamodb2
+from botocore.exceptions import ClientError
 from aws_deep_sense_spoken_data_collection_framework.user_manager import UserManager
 import aws_deep_sense_spoken_data_collection_framework.utils as utils
 import unittest_helper_methods as helper
@@ -81,6 +83,109 @@ class TestUserManage(unittest.TestCase):
         actual_response = session['Item']
         self.assertEqual(actual_response, expected_response)
 
+    @mock_dynamodb2
+    def test_create_users_bulk(self):
+        helper.create_mock_dynamodb_user_account_table()
+        helper.create_mock_dynamodb_collection_session_table()
+        collection_table = user_manager.dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        collection_table.put_item(Item={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345', 'mode': 'human',
+                                        'collectionName': 'test_collection',
+                                        'routingInfo': {'routingProfileID': 'test_routing_profile_id'}})
+        users = UserManager.read_users_csv(io.StringIO(
+            'name,role,collection_pin\n'
+            'customer_1,customer,\n'
+            'agent_1,agent,12345\n'
+            'agent_2,agent,99999\n'
+            'someone,manager,12345\n'
+            'agent_3, agent ,12345\n'))
+        throttled = ClientError({'Error': {'Code': 'TooManyRequestsException'}}, 'CreateUser')
+        rejected = ClientError({'Error': {'Code': 'DuplicateResourceException'}}, 'CreateUser')
+
+        # One agent at a time: agent_1 is throttled once then created, agent_3 is rejected
+        with mock.patch.object(user_manager, 'connect_create_user',
+                               side_effect=[throttled, {'UserId': 'test_id'}, rejected]) as create_user, \
+                mock.patch('aws_deep_sense_spoken_data_collection_framework.rate_limiter.time.sleep'):
+            report = user_manager.create_users_bulk(users, max_concurrency=1)
+
+        # test 1: one result per row, the invalid rows and the rejected agent are reported
+        self.assertEqual([result['status'] for result in report], ['created', 'created', 'failed', 'failed', 'failed'])
+        self.assertIn('No collection request', report[2]['error'])
+        self.assertIn('Invalid role', report[3]['error'])
+        self.assertIn('DuplicateResourceException', report[4]['error'])
+        # The throttled request is retried
+        self.assertEqual(create_user.call_count, 3)
+        create_user.assert_called_with('agent_' + report[4]['user_pin'], 'Abcd' + report[4]['user_pin'],
+                                       report[4]['user_pin'], 'test_routing_profile_id')
+
+        # test 2: the created users are saved, the PIN code of the rejected agent is released
+        user_table = user_manager.dynamodb.Table(utils.USER_ACCOUNT_DYNAMODB_TABLE)
+        items = {item['name']: item for item in user_table.scan()['Items']}
+        self.assertNotIn(report[4]['user_pin'], [item['PIN'] for item in items.values()])
+        self.assertEqual(set(items), {'customer_1', 'agent_1'})
+        self.assertEqual(items['customer_1']['account'], {})
+        self.assertEqual(items['agent_1']['PIN'], report[1]['user_pin'])
+        self.assertEqual(items['agent_1']['account'], {
+            'username': 'agent_' + report[1]['user_pin'], 'password': 'Abcd' + report[1]['user_pin'],
+            'collectionPIN': '12345', 'collectionName': 'test_collection', 'userId': 'test_id'})
+
+    @mock_dynamodb2
+    def test_create_users_bulk_not_saved(self):
+        helper.create_mock_dynamodb_user_account_table()
+        helper.create_mock_dynamodb_collection_session_table()
+        collection_table = user_manager.dynamodb.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        collection_table.put_item(Item={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '12345', 'mode': 'human',
+                                        'collectionName': 'test_collection',
+                                        'routingInfo': {'routingProfileID': 'test_routing_profile_id'}})
+        users = [{'name': 'customer_1', 'role': 'customer'},
+                 {'name': 'agent_1', 'role': 'agent', 'collection_pin': '12345'}]
+        rejected = ClientError({'Error': {'Code': 'ValidationException'}}, 'BatchWriteItem')
+        with mock.patch.object(user_manager, 'connect_create_user', return_value={'UserId': 'test_id'}), \
+                mock.patch.object(user_manager, 'connect_delete_user') as delete_user, \
+                mock.patch.object(user_manager.dynamodb, 'batch_write_item', side_effect=rejected):
+            report = user_manager.create_users_bulk(users)
+
+        # test: the users not saved are reported, the agent account is deleted and the PIN codes are released
+        self.assertEqual([result['status'] for result in report], ['failed', 'failed'])
+        self.assertIn('ValidationException', report[1]['error'])
+        delete_user.assert_called_once_with('test_id')
+        user_table = user_manager.dynamodb.Table(utils.USER_ACCOUNT_DYNAMODB_TABLE)
+        self.assertEqual(user_table.scan()['Items'], [])
+
+    @mock.patch('builtins.input', return_value='Y')
+    @mock_dynamodb2
+    def test_delete_all_user(self, input):
+        helper.create_mock_dynamodb_user_account_table()
+        table = user_manager.dynamodb.Table(utils.USER_ACCOUNT_DYNAMODB_TABLE)
+        users = [{utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: str(100000 + index), 'name': 'test_name', 'type': 'customer',
+                  'account': {}} for index in range(30)]
+        users += [{utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: '2000{}0'.format(index), 'name': 'test_name', 'type': 'agent',
+                   'account': {'userId': user_id}} for index, user_id in enumerate(['ok', 'missing', 'rejected'])]
+        with table.batch_writer() as batch:
+            for user in users:
+                batch.put_item(Item=user)
+            # A PIN code reserved by a user being created is kept
+            batch.put_item(Item={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: '300000', 'reservedAt': 'test_time'})
+
+        def connect_delete_user(user_id):
+            if user_id == 'missing':
+                raise ClientError({'Error': {'Code': 'ResourceNotFoundException'}}, 'DeleteUser')
+            if user_id == 'rejected':
+                raise ClientError({'Error': {'Code': 'AccessDeniedException'}}, 'DeleteUser')
+
+        with mock.patch.object(user_manager, 'connect_delete_user', side_effect=connect_delete_user) as delete_user, \
+                mock.patch.object(user_manager.dynamodb, 'batch_write_item',
+                                  wraps=user_manager.dynamodb.batch_write_item) as batch_write_item:
+            statistics = user_manager.delete_all_user()
+
+        # test 1: the agent rejected by Amazon Connect is kept to be deleted later
+        self.assertEqual(statistics['deleted'], 32)
+        self.assertEqual([failure['PIN'] for failure in statistics['failed']], ['200020'])
+        self.assertEqual(delete_user.call_count, 3)
+        self.assertCountEqual([item[utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY] for item in table.scan()['Items']],
+                              ['200020', '300000'])
+        # test 2: the items are deleted by batches of 25
+        self.assertEqual(batch_write_item.call_count, 2)
+
     @mock_dynamodb2
     def test_list_all_user(self):
         helper.create_mock_dynamodb_user_account_table()
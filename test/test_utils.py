@@ -6,7 +6,10 @@ from moto import mock_dynamodb2
 import os
 import logging
 import zipfile
+import tempfile
 import boto3
+from boto3.dynamodb.conditions import Attr
+from concurrent.futures import ThreadPoolExecutor
 import aws_deep_sense_spoken_data_collection_framework.utils as utils
 import unittest_helper_methods as helper
 
@@ -49,6 +52,30 @@ class TestUtils(unittest.TestCase):
         actual_response = utils.parse_config(config_test_path)
         self.assertEqual(actual_response, expected_response)
 
+    def test_get_config(self):
+        config_file = tempfile.NamedTemporaryFile('w', delete=False)
+        try:
+            with open(config_test_path) as test_config:
+                config_file.write(test_config.read())
+            config_file.close()
+
+            # test 1: the configuration file is parsed once for all parameters
+            with mock.patch.object(utils, 'parse_config', wraps=utils.parse_config) as parse_config:
+                utils.get_aws_access_key(config_file.name)
+                utils.get_aws_region_name(config_file.name)
+                utils.get_call_recordings_bucket_name(config_file.name)
+                utils.get_connect_info(config_file.name)
+            self.assertEqual(parse_config.call_count, 1)
+
+            # test 2: a modified configuration file is parsed again
+            with open(config_file.name, 'w') as modified_config:
+                with open(config_test_path) as test_config:
+                    modified_config.write(test_config.read().replace('test_phone_number', 'new_phone_number'))
+            os.utime(config_file.name, ns=(0, 0))
+            self.assertEqual(utils.get_connect_info(config_file.name)[2], 'new_phone_number')
+        finally:
+            os.remove(config_file.name)
+
     def test_get_aws_access_key(self):
         expected_response = ('AAAAAAAAAAAAAAAAAAAA', 'BBBBB/BBBBBBBBB+BBBBBBB+BBBBB/BBBBBBBBBB')
         actual_response = utils.get_aws_access_key(config_test_path)
@@ -70,6 +97,53 @@ class TestUtils(unittest.TestCase):
         actual_response = utils.get_connect_info(config_test_path)
         self.assertEqual(actual_response, expected_response)
 
+    def test_get_boto3_client(self):
+        # test 1: the same client is shared for the same service, region and credentials
+        client = utils.get_boto3_client('s3', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+        self.assertIs(utils.get_boto3_client('s3', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME), client)
+
+        # test 2: a different region gets its own client
+        self.assertIsNot(utils.get_boto3_client('s3', ACCESS_KEY_ID, ACCESS_KEY, 'us-west-2'), client)
+
+        # test 3: clients are shared among threads
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            thread_clients = list(executor.map(
+                lambda _: utils.get_boto3_client('s3', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME), range(4)))
+        for thread_client in thread_clients:
+            self.assertIs(thread_client, client)
+
+    def test_get_boto3_resource(self):
+        # test 1: the same resource is shared within a thread
+        resource = utils.get_boto3_resource('dynamodb', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+        self.assertIs(utils.get_boto3_resource('dynamodb', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME), resource)
+
+        # test 2: resources are not thread-safe, every thread gets its own resource
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            thread_resource = executor.submit(utils.get_boto3_resource, 'dynamodb', ACCESS_KEY_ID, ACCESS_KEY,
+                                              AWS_REGION_NAME).result()
+        self.assertIsNot(thread_resource, resource)
+
+    def test_set_max_pool_connections(self):
+        default_max_pool_connections = utils.MAX_POOL_CONNECTIONS
+        client = utils.get_boto3_client('s3', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+
+        def get_resource():
+            return utils.get_boto3_resource('dynamodb', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            thread_resource = executor.submit(get_resource).result()
+            try:
+                utils.set_max_pool_connections(4)
+                tuned_client = utils.get_boto3_client('s3', ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME)
+                self.assertIsNot(tuned_client, client)
+                self.assertEqual(tuned_client.meta.config.max_pool_connections, 4)
+                # The resources of the other threads are dropped as well
+                tuned_thread_resource = executor.submit(get_resource).result()
+                self.assertIsNot(tuned_thread_resource, thread_resource)
+                self.assertEqual(tuned_thread_resource.meta.client.meta.config.max_pool_connections, 4)
+            finally:
+                utils.set_max_pool_connections(default_max_pool_connections)
+
     @mock_dynamodb2
     def test_is_collection_pin_exists(self):
         helper.create_mock_dynamodb_collection_session_table()
@@ -89,6 +163,11 @@ class TestUtils(unittest.TestCase):
         actual_response = utils.is_collection_pin_exists(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, '98765')
         self.assertEqual(actual_response, expected_response)
 
+        # Test 3: a PIN code only reserved
+        table.put_item(Item={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '23456',
+                             utils.PIN_RESERVATION_ATTRIBUTE: '2020-01-01T00:00:00Z'})
+        self.assertFalse(utils.is_collection_pin_exists(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, '23456'))
+
     @mock_dynamodb2
     def test_is_conversation_pin_exists(self):
         helper.create_mock_dynamodb_collection_session_table()
@@ -128,6 +207,11 @@ class TestUtils(unittest.TestCase):
         actual_response = utils.is_user_pin_exists(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, '987654')
         self.assertEqual(actual_response, expected_response)
 
+        # Test 3: a PIN code only reserved
+        table.put_item(Item={utils.USER_ACCOUNT_DYNAMODB_TABLE_KEY: '234567',
+                             utils.PIN_RESERVATION_ATTRIBUTE: '2020-01-01T00:00:00Z'})
+        self.assertFalse(utils.is_user_pin_exists(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, '234567'))
+
     @mock_dynamodb2
     @mock.patch('builtins.input', return_value='12345')
     def test_ask_collection_pin(self, input):
@@ -159,12 +243,17 @@ class TestUtils(unittest.TestCase):
     @mock_dynamodb2
     def test_get_contact_ids(self):
         helper.create_mock_dynamodb_collection_session_table()
+        helper.create_mock_dynamodb_collection_contact_table()
         dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION_NAME)
         table = dynamodb_resource.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
         contact_id_list = ['1', '2', '3']
         with table.batch_writer() as batch:
-            user_item = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '123456', 'contactIDs': contact_id_list}
+            user_item = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '123456', 'collectedCount': 3}
             batch.put_item(Item=user_item)
+            # Not migrated into the contact table yet
+            user_item = {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: '234567', 'contactIDs': ['4', '5']}
+            batch.put_item(Item=user_item)
+        helper.put_mock_dynamodb_collection_contacts('123456', contact_id_list)
 
         # test 1
         expected_response = contact_id_list
@@ -176,6 +265,19 @@ class TestUtils(unittest.TestCase):
         actual_response = utils.get_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, 'invalid_collection_pin')
         self.assertEqual(actual_response, expected_response)
 
+        # test 3: the contact ids of the collection request item come first
+        helper.put_mock_dynamodb_collection_contacts('234567', ['6'])
+        actual_response = utils.get_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, '234567')
+        self.assertEqual(actual_response, ['4', '5', '6'])
+
+        # test 4: one page after the other
+        contact_ids, start_key = utils.query_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, '123456', 2)
+        self.assertEqual(contact_ids, ['1', '2'])
+        contact_ids, start_key = utils.query_contact_ids(ACCESS_KEY_ID, ACCESS_KEY, AWS_REGION_NAME, '123456', 2,
+                                                         start_key)
+        self.assertEqual(contact_ids, ['3'])
+        self.assertIsNone(start_key)
+
     @mock_dynamodb2
     def test_check_collection_request_mode(self):
         helper.create_mock_dynamodb_collection_session_table()
@@ -197,6 +299,52 @@ class TestUtils(unittest.TestCase):
                                                               'invalid_collection_pin')
         self.assertEqual(actual_response, expected_response)
 
+    @mock_dynamodb2
+    def test_scan_table(self):
+        helper.create_mock_dynamodb_collection_session_table()
+        dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION_NAME)
+        table = dynamodb_resource.Table(utils.COLLECTION_REQUEST_DYNAMODB_TABLE)
+        with table.batch_writer() as batch:
+            for i in range(30):
+                batch.put_item(Item={utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY: str(i),
+                                     'mode': ['human', 'bot'][i % 2], 'contactIDs': [str(i)] * 100})
+        scan = table.meta.client.scan
+        scan_calls = []
+
+        def segmented_scan(Segment=0, TotalSegments=1, **kwargs):
+            # moto ignores the segments, every segment only keeps its share of the items
+            scan_calls.append(Segment)
+            response = scan(**kwargs)
+            response['Items'] = [item for item in response['Items']
+                                 if int(item[utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY]) % TotalSegments == Segment]
+            return response
+
+        with mock.patch.object(table.meta.client, 'scan', side_effect=segmented_scan):
+            # test 1: every page is read, with the projected attributes only
+            items = list(utils.scan_table(table, [utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY, 'mode'], page_size=7))
+            self.assertEqual(sorted(int(item[utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY]) for item in items),
+                             list(range(30)))
+            self.assertTrue(all(set(item) == {utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY, 'mode'} for item in items))
+            self.assertEqual(len(scan_calls), 5)
+
+            # test 2: filtered on the server side
+            items = list(utils.scan_table(table, filter_expression=Attr('mode').eq('bot')))
+            self.assertEqual(len(items), 15)
+            self.assertTrue(all(item['mode'] == 'bot' for item in items))
+
+            # test 3: segments scanned in parallel
+            scan_calls.clear()
+            items = list(utils.scan_table(table, [utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY], total_segments=3,
+                                          page_size=4))
+            self.assertEqual(sorted(int(item[utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY]) for item in items),
+                             list(range(30)))
+            self.assertEqual(sorted(set(scan_calls)), [0, 1, 2])
+
+            # test 4: the consumer may stop early
+            items = utils.scan_table(table, total_segments=3, page_size=1)
+            self.assertEqual(len([next(items) for _ in range(3)]), 3)
+            items.close()
+
     def test_is_category_choice_valid(self):
         # Test 1
         expected_response = False
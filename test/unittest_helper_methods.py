@@ -1,5 +1,11 @@
 import boto3
 import os
+import sys
+import json
+import datetime
+import pathlib
+import threading
+from botocore.exceptions import ClientError
 import aws_deep_sense_spoken_data_collection_framework.utils as utils
 
 test_data_directory = os.path.join(os.path.dirname(__file__), '..', 'test-data')
@@ -10,6 +16,19 @@ AWS_REGION_NAME = utils.get_aws_region_name(config_test_path)
 CALL_RECORDINGS_BUCKET_NAME = utils.get_call_recordings_bucket_name(config_test_path)
 
 
+def set_mock_lambda_environment():
+    # The lambda functions read their configuration and credentials from the environment when they are imported,
+    # and are deployed as top-level modules next to lambda_cache
+    lambda_functions_directory = os.path.join(os.path.dirname(utils.__file__), 'aws_lambda_functions')
+    if lambda_functions_directory not in sys.path:
+        sys.path.insert(0, lambda_functions_directory)
+    os.environ.setdefault('AWS_REGION_NAME', AWS_REGION_NAME)
+    os.environ.setdefault('AWS_DEFAULT_REGION', AWS_REGION_NAME)
+    os.environ.setdefault('CALL_RECORDINGS_BUCKET_NAME', CALL_RECORDINGS_BUCKET_NAME)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', ACCESS_KEY_ID)
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', ACCESS_KEY)
+
+
 def create_mock_dynamodb_collection_session_table():
     dynamodb_client = boto3.client('dynamodb', region_name=AWS_REGION_NAME)
     response = dynamodb_client.create_table(
@@ -25,6 +44,10 @@ def create_mock_dynamodb_collection_session_table():
                 'AttributeName': utils.COLLECTION_REQUEST_DYNAMODB_TABLE_KEY,
                 'AttributeType': 'S'
             },
+            {
+                'AttributeName': utils.COLLECTION_REQUEST_DYNAMODB_SECONDARY_INDEX_KEY,
+                'AttributeType': 'S'
+            },
         ],
         ProvisionedThroughput={
             'ReadCapacityUnits': 10,
@@ -47,6 +70,47 @@ def create_mock_dynamodb_collection_session_table():
     )
 
 
+def create_mock_dynamodb_collection_contact_table():
+    dynamodb_client = boto3.client('dynamodb', region_name=AWS_REGION_NAME)
+    response = dynamodb_client.create_table(
+        TableName=utils.COLLECTION_CONTACT_DYNAMODB_TABLE,
+        KeySchema=[
+            {
+                'AttributeName': utils.COLLECTION_CONTACT_DYNAMODB_TABLE_KEY,
+                'KeyType': 'HASH'
+            },
+            {
+                'AttributeName': utils.COLLECTION_CONTACT_DYNAMODB_TABLE_SORT_KEY,
+                'KeyType': 'RANGE'
+            },
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': utils.COLLECTION_CONTACT_DYNAMODB_TABLE_KEY,
+                'AttributeType': 'S'
+            },
+            {
+                'AttributeName': utils.COLLECTION_CONTACT_DYNAMODB_TABLE_SORT_KEY,
+                'AttributeType': 'S'
+            },
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 10,
+            'WriteCapacityUnits': 10,
+        },
+    )
+
+
+def put_mock_dynamodb_collection_contacts(collection_pin, contact_ids):
+    table = boto3.resource('dynamodb', region_name=AWS_REGION_NAME).Table(utils.COLLECTION_CONTACT_DYNAMODB_TABLE)
+    for index, contact_id in enumerate(contact_ids):
+        contact_time = datetime.datetime(2020, 7, 1, 12, 30, index)
+        table.put_item(Item={utils.COLLECTION_CONTACT_DYNAMODB_TABLE_KEY: collection_pin,
+                             utils.COLLECTION_CONTACT_DYNAMODB_TABLE_SORT_KEY: utils.get_contact_sort_key(
+                                 contact_time, contact_id),
+                             utils.COLLECTION_CONTACT_ID_ATTRIBUTE: contact_id})
+
+
 def create_mock_dynamodb_user_account_table():
     dynamodb_client = boto3.client('dynamodb', region_name=AWS_REGION_NAME)
     response = dynamodb_client.create_table(
@@ -112,4 +176,79 @@ def create_mock_dynamodb_queue_pool_table():
             'ReadCapacityUnits': 10,
             'WriteCapacityUnits': 10,
         },
-    )
\ No newline at end of file
+    )
+
+
+class StubTranscribeClient:
+    """
+    Offline stand-in for the AWS Transcribe client
+    A job completes after its status has been read a given number of times, by get_transcription_job or by
+    a listing, and its transcript is written under a local directory and served through a file:// URI
+
+    :param transcript_directory: directory for the transcripts
+    :param num_polls_to_complete: number of times the status of a job is read before it completes
+    :param page_size: maximum number of jobs per page of list_transcription_jobs
+    """
+
+    def __init__(self, transcript_directory, num_polls_to_complete=1, page_size=2):
+        self.transcript_directory = transcript_directory
+        self.num_polls_to_complete = num_polls_to_complete
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.calls = []
+
+    def start_transcription_job(self, TranscriptionJobName, **kwargs):
+        with self.lock:
+            self.calls.append('start_transcription_job')
+            if TranscriptionJobName in self.jobs:
+                raise ClientError({'Error': {'Code': 'ConflictException'}}, 'StartTranscriptionJob')
+            self.jobs[TranscriptionJobName] = {'status': 'IN_PROGRESS', 'polls': 0, 'media': kwargs.get('Media')}
+        return {'TranscriptionJob': {'TranscriptionJobName': TranscriptionJobName,
+                                     'TranscriptionJobStatus': 'IN_PROGRESS'}}
+
+    def complete_job(self, job_name):
+        transcript_file = os.path.join(self.transcript_directory, '{}.json'.format(job_name))
+        with open(transcript_file, 'w+') as json_file:
+            json.dump({'jobName': job_name, 'results': {'transcripts': [{'transcript': 'hello'}]}}, json_file)
+        self.jobs[job_name]['status'] = 'COMPLETED'
+        self.jobs[job_name]['uri'] = pathlib.Path(os.path.abspath(transcript_file)).as_uri()
+
+    def poll_job(self, job_name):
+        job = self.jobs[job_name]
+        if job['status'] == 'IN_PROGRESS':
+            job['polls'] += 1
+            if job['polls'] > self.num_polls_to_complete:
+                self.complete_job(job_name)
+
+    def list_transcription_jobs(self, MaxResults=None, NextToken=None, Status=None, **kwargs):
+        with self.lock:
+            self.calls.append('list_transcription_jobs')
+            # The statuses are read at the first page, so that the pages of a listing are consistent
+            if not NextToken:
+                for job_name in self.jobs:
+                    if Status is None or self.jobs[job_name]['status'] == Status:
+                        self.poll_job(job_name)
+            job_names = [job_name for job_name in sorted(self.jobs)
+                         if Status is None or self.jobs[job_name]['status'] == Status]
+            start = int(NextToken) if NextToken else 0
+            page_size = min(MaxResults or self.page_size, self.page_size)
+            summaries = [{'TranscriptionJobName': job_name, 'TranscriptionJobStatus': self.jobs[job_name]['status']}
+                         for job_name in job_names[start:start + page_size]]
+            response = {'TranscriptionJobSummaries': summaries}
+            if start + page_size < len(job_names):
+                response['NextToken'] = str(start + page_size)
+            return response
+
+    def get_transcription_job(self, TranscriptionJobName):
+        with self.lock:
+            self.calls.append('get_transcription_job')
+            if TranscriptionJobName not in self.jobs:
+                raise ClientError({'Error': {'Code': 'BadRequestException'}}, 'GetTranscriptionJob')
+            self.poll_job(TranscriptionJobName)
+            job = self.jobs[TranscriptionJobName]
+            transcription_job = {'TranscriptionJobName': TranscriptionJobName,
+                                 'TranscriptionJobStatus': job['status']}
+            if job['status'] == 'COMPLETED':
+                transcription_job['Transcript'] = {'TranscriptFileUri': job['uri']}
+            return {'TranscriptionJob': transcription_job}